@@ -3,13 +3,19 @@ __date__ = "Jan 2020"
 
 """
 provides a class for dealing with (mostly) infrared images and infrared panoramas
+
+IndexedImage keeps an ir image that only has colors of one palette as one uint8 palette index per pixel, a third of the
+memory of the b, g, r image. Changing its palette only changes the 256 (or fewer) colors the indexes point to
 """
 
 import numpy as np
 from util import Color
-import util
+import lut
+import palette_registry
+import instrument
+import mixed
 import cv2
-from typing import List, Dict, Optional, Tuple
+from typing import List, Optional, Tuple
 
 
 class Image:
@@ -18,28 +24,19 @@ class Image:
         self.edges: np.ndarray = None
         self.contours: List[np.ndarray] = None
 
-    def change_palette(self, new_palette_name: str) -> None:
+    def change_palette(self, new_palette_name: str, mode: str = "stretch") -> None:
         """
         given an image that only contains colors from one palette, change it to the colors of another palette
         :param new_palette_name: the palette you want to new image to follow like "lava.pal"
+        :param mode: how palettes with different numbers of colors get lined up, "stretch" (the original way),
+        "nearest", or "linear" (see palette_registry.py)
         :return: an image that follows the new palette
         """
 
-        old_palette: List[Color] = util.palette_to_bgr("palettes/" + self.identify_palette())
-        new_palette: List[Color] = util.palette_to_bgr("palettes/" + new_palette_name)
-
-        # if the sizes don't match up stretch one of them
-        if len(new_palette) != len(old_palette):
-            if len(new_palette) > len(old_palette):
-                old_palette = util.stretch_list(old_palette, len(new_palette))
-            else:
-                new_palette = util.stretch_list(new_palette, len(old_palette))
-
-        old_to_new: Dict[Color, Color] = dict(zip(old_palette, new_palette))
-
-        for i in range(self.img.shape[0]):
-            row: np.ndarray = self.img[i]
-            self.img[i] = util.replace(row, old_to_new)
+        # the table for this pair of palettes is only built once, then the whole image is replaced in one pass
+        with instrument.span("apply palette lut", megapix=instrument.megapix(self.img)):
+            old_to_new: lut.ColorLUT = lut.palette_lut(self.identify_palette(), new_palette_name, mode)
+            self.img[:] = old_to_new.apply(self.img)
 
     def set_colors_to_palette(self, palette: List[Color]) -> None:
         """
@@ -47,85 +44,37 @@ class Image:
         given palette. The stitching process changing pixels slightly and this function corrects that
         :param palette: output of util.palette_to_bgr()
         """
-        # flatten image into 2d array then find unique values
-        unique_values, inv = np.unique(
-            self.img.reshape(self.img.shape[0] * self.img.shape[1], self.img.shape[2]),
-            axis=0, return_inverse=True)
-
-        # get pixel matches
-        for y in range(unique_values.shape[0]):
-            unique_values[y] = util.get_palette_color_match(unique_values[y], palette)
-
-        self.img = unique_values[inv].reshape(self.img.shape)  # recreate original image shape with the changed colors
+        # the index remembers the closest palette color of every color it has seen, so only new colors get searched
+        with instrument.span("snap colors", megapix=instrument.megapix(self.img)):
+            nearest: lut.NearestColorIndex = lut.nearest_color_index(palette)
+            self.img = nearest.snap(self.img).astype(self.img.dtype, copy=False)
+            nearest.save()
 
     def identify_palette(self) -> Optional[str]:
         """
         given an image it figures out which palette it uses. NOTE: the colors of the image must match exactly with
         those of the palette
-        :return: filename of palette e.g. "iron.pal"
-        """
-        # convert palette to bgr. originally in YCbCr
-        bgr_palettes: List[List[Color]] = []
-        for p in util.PALETTES:
-            bgr_palettes.append(util.palette_to_bgr("palettes/" + p))
-
-        # get rid of all palettes that do not have those (b, g, r) values
-        bgr_pal_copy: List[List[Color]] = bgr_palettes.copy()
-        for y in range(self.img.shape[0]):
-            for x in range(self.img.shape[1]):
-                to_pop: List[List[Color]] = []
-                for pal in bgr_palettes:
-                    if tuple(self.img[y, x]) not in pal:
-                        to_pop.append(pal)
-                for pal in to_pop:
-                    bgr_palettes.pop(bgr_palettes.index(pal))
-
-                found_match: bool = len(bgr_palettes) == 1
-                if found_match:
-                    return util.PALETTES[bgr_pal_copy.index(bgr_palettes[0])]
-        return None
-
-    def remove_black(self) -> Tuple[int, int, bool, bool]:
+        :return: filename of palette e.g. "iron.pal", None if no palette (or more than one palette) has all the colors
+        """
+        # one lookup of every pixel in an index of which palettes contain each color
+        return lut.palette_identifier().identify(self.img)[0]
+
+    def remove_black(self, mask: Optional[np.ndarray] = None) -> Tuple[int, int, bool, bool]:
         """
         removes the black border on the tops and bottoms of images and if there is black on the first column at the edges
+        :param mask: where this is 0 the pixel is part of the border (like the result mask of a blender), None to treat
+        every pixel with a 0 in any channel as border
         :return: rows of upper limit and lower limit of the image, whether the leftmost and rightmost columns were removed
         """
-        BLACK: np.ndarray = np.zeros((1, 3))
-        removed_left: bool = False
-        removed_right: bool = False
-
-        # get rid of black line at edge if it exists
-        for y in range(self.img.shape[0]):
-            if self.img[y, 0] in BLACK:
-                self.img = self.img[:, 1:]
-                removed_left = True
-                break
-        for y in range(self.img.shape[0] - 1, -1, -1):
-            if self.img[y, -1] in BLACK:
-                self.img = self.img[:, :-1]
-                removed_right = True
-                break
-
-        # looks at the top half of each column and finds the place where the image stops being black
-        upper_limit: int = 0
-        for x in range(self.img.shape[1]):
-            for y in range(self.img.shape[0] // 2):
-                if self.img[y, x] in BLACK:
-                    if y > upper_limit:
-                        upper_limit = y
-                else:
-                    break
-
-        # looks at the bottom half of each column and finds the place where the image stops being black
-        lower_limit: int = self.img.shape[0] - 1
-        for x in range(self.img.shape[1]):
-            for y in range(self.img.shape[0] - 1, self.img.shape[0] // 2, -1):
-                if self.img[y, x] in BLACK:
-                    if y < lower_limit:
-                        lower_limit = y
-                else:
-                    break
-        self.img = self.img[upper_limit:lower_limit, :]
+        with instrument.span("find border", megapix=instrument.megapix(self.img)):
+            if mask is not None:
+                black: np.ndarray = mask == 0
+            elif self.img.ndim == 3:
+                black = (self.img == 0).any(axis=2)
+            else:
+                black = self.img == 0
+            upper_limit, lower_limit, removed_left, removed_right = find_black_border(black)
+            self.img = crop_border(self.img, upper_limit, lower_limit, removed_left, removed_right)
         return upper_limit, lower_limit, removed_left, removed_right
 
     def get_blurred(self) -> np.ndarray:
@@ -163,6 +112,71 @@ class Image:
         self.contours = cv2.findContours(self.edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
 
 
+class IndexedImage:
+    def __init__(self, index: np.ndarray, palette_name: str, colors: Optional[np.ndarray] = None):
+        """
+        :param index: uint8 array with the palette index of each pixel
+        :param palette_name: palette the indexes are into, like "iron.pal"
+        :param colors: uint8 array with shape (n, 3) of the color of each index, None for the colors of the palette
+        """
+        self.index: np.ndarray = index
+        self.palette_name: str = palette_name
+        self.colors: np.ndarray = palette_registry.get_palette(palette_name).colors if colors is None else colors
+
+    @classmethod
+    def from_bgr(cls, img: np.ndarray, palette_name: Optional[str] = None) -> "IndexedImage":
+        """
+        :param img: b, g, r image whose colors are all exactly colors of the palette
+        :param palette_name: like "iron.pal", None to figure it out (see Image.identify_palette())
+        :return: the image as palette indexes
+        """
+        if palette_name is None:
+            palette_name = lut.palette_identifier().identify(img)[0]
+            if palette_name is None:
+                raise ValueError("could not identify the palette of the image")
+        return cls(palette_registry.get_palette(palette_name).index_of(img).astype(np.uint8), palette_name)
+
+    @classmethod
+    def snap(cls, img: np.ndarray, palette_name: str) -> "IndexedImage":
+        """
+        same as Image.set_colors_to_palette() but keeps the indexes of the closest colors instead of the colors
+        :param img: b, g, r image with colors close to those of the palette (like a stitched panorama)
+        :param palette_name: like "iron.pal"
+        :return: the image as palette indexes
+        """
+        with instrument.span("snap colors", megapix=instrument.megapix(img)):
+            nearest: lut.NearestColorIndex = lut.nearest_color_index(palette_registry.get_palette(palette_name).as_list())
+            index: np.ndarray = nearest.query(img).astype(np.uint8)
+            nearest.save()
+        return cls(index, palette_name)
+
+    def to_bgr(self) -> np.ndarray:
+        """:return: uint8 b, g, r image"""
+        return np.take(self.colors, self.index, axis=0)
+
+    def change_palette(self, new_palette_name: str, mode: str = "stretch") -> None:
+        """
+        gives the image the colors Image.change_palette() would, without touching the indexes
+        :param new_palette_name: like "lava.pal"
+        :param mode: how palettes with different numbers of colors get lined up, see Image.change_palette()
+        """
+        self.colors = lut.palette_lut(self.palette_name, new_palette_name, mode).apply(self.colors)
+        self.palette_name = new_palette_name
+
+    def remove_black(self, mask: Optional[np.ndarray] = None) -> Tuple[int, int, bool, bool]:
+        """
+        same as Image.remove_black(), looking at the colors of the indexes
+        :param mask: where this is 0 the pixel is part of the border, None to treat every pixel whose color has a 0 in
+        any channel as border
+        :return: rows of upper limit and lower limit of the image, whether the leftmost and rightmost columns were removed
+        """
+        with instrument.span("find border", megapix=instrument.megapix(self.index)):
+            black: np.ndarray = mask == 0 if mask is not None else (self.colors == 0).any(axis=1)[self.index]
+            upper_limit, lower_limit, removed_left, removed_right = find_black_border(black)
+            self.index = crop_border(self.index, upper_limit, lower_limit, removed_left, removed_right)
+        return upper_limit, lower_limit, removed_left, removed_right
+
+
 def draw_contours(img: np.ndarray, contours: List[np.ndarray], color: Tuple[int, int, int] = (0, 255, 0)) -> np.ndarray:
     """
     draws the contours on the image
@@ -188,10 +202,8 @@ def create_mx(vl: np.ndarray, ir: np.ndarray) -> np.ndarray:
     :param ir: infrared image of same scene as vl
     :return: the mixed image
     """
-    mask = cv2.adaptiveThreshold(cv2.cvtColor(Image(vl).get_blurred(), cv2.COLOR_BGR2GRAY), 255,
-                                cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 3, 1)
-    with_black = cv2.bitwise_and(ir, ir, mask=mask)
-    return cv2.addWeighted(with_black, .4, ir, .6, 0)
+    with instrument.span("create mx", megapix=instrument.megapix(ir)):
+        return mixed.MixedImages(vl).mx(ir)  # to make more than one kind of mixed image use MixedImages.make()
 
 
 def create_mx2(vl: np.ndarray, ir: np.ndarray) -> np.ndarray:
@@ -206,7 +218,7 @@ def create_mx2(vl: np.ndarray, ir: np.ndarray) -> np.ndarray:
     :param ir: infrared image of same scene as vl
     :return: the mixed image
     """
-    return cv2.addWeighted(vl, .2, ir, .8, 0)
+    return mixed.MixedImages(vl).mx2(ir)
 
 
 def create_mx3(vl: np.ndarray, ir: np.ndarray) -> np.ndarray:
@@ -220,15 +232,50 @@ def create_mx3(vl: np.ndarray, ir: np.ndarray) -> np.ndarray:
     :param ir:
     :return:
     """
-    vis = Image(vl)
-    vis.find_contours()
-    ir_with_contours = draw_contours(ir, vis.contours, (255, 255, 255))
-    return create_mx(vis.img, ir_with_contours)
-
-
-
-
+    return mixed.MixedImages(vl).mx3(ir)
 
 
+def black_run_lengths(black: np.ndarray) -> np.ndarray:
+    """
+    :param black: 2d boolean array
+    :return: for each column, how many pixels in a row are True starting from the first row
+    """
+    if black.shape[0] == 0:
+        return np.zeros(black.shape[1], np.intp)
+    return np.where(black.all(axis=0), black.shape[0], np.argmin(black, axis=0))
 
 
+def find_black_border(black: np.ndarray) -> Tuple[int, int, bool, bool]:
+    """
+    finds the border that Image.remove_black() cuts off
+    :param black: 2d boolean array, True where the pixel is part of the border
+    :return: rows of upper limit and lower limit, whether the leftmost and rightmost columns are part of the border
+    """
+    removed_left: bool = bool(black[:, 0].any())
+    if removed_left:
+        black = black[:, 1:]
+    removed_right: bool = bool(black[:, -1].any())
+    if removed_right:
+        black = black[:, :-1]
+
+    # the longest black run down from the top (in the top half) and up from the bottom (in the bottom half) of any column
+    height: int = black.shape[0]
+    top_run: int = int(black_run_lengths(black[:height // 2]).max(initial=0))
+    bottom_run: int = int(black_run_lengths(black[height // 2 + 1:][::-1]).max(initial=0))
+    upper_limit: int = max(top_run, 1) - 1
+    lower_limit: int = height - max(bottom_run, 1)
+    return upper_limit, lower_limit, removed_left, removed_right
+
+
+def crop_border(img: np.ndarray, upper_limit: int, lower_limit: int, removed_left: bool, removed_right: bool) -> np.ndarray:
+    """
+    crops an image the same way Image.remove_black() cropped the image it was run on
+    :param img: image of the same size as the one remove_black() was run on
+    :return: the cropped image
+    """
+    img = img[upper_limit:lower_limit, :]
+    if removed_left:
+        img = img[:, 1:]
+    if removed_right:
+        img = img[:, :-1]
+    return img
@@ -17,6 +17,7 @@ import cv2
 import time
 import os
 from datetime import datetime
+from frames import FrameSource
 
 
 def stitch_fast(data, use_kaze=False):
@@ -40,6 +41,7 @@ def stitch_fast(data, use_kaze=False):
     seam_work_aspect = 1
     features = []
     images = []
+    frame_sizes = []  # (height, width) of each vl frame, so they don't have to be read again to warp the other layers
     print("getting image features and scaling images...")
     work_scale = -1
     seam_scale = -1
@@ -59,6 +61,7 @@ def stitch_fast(data, use_kaze=False):
             seam_work_aspect = seam_scale / work_scale
         features.append(cv2.detail.computeImageFeatures2(finder, img))  # gets image features
         images.append(cv2.resize(src=full_img, dsize=None, fx=seam_scale, fy=seam_scale, interpolation=cv2.INTER_LINEAR_EXACT))
+        frame_sizes.append(full_img.shape[:2])
 
     print("getting matches info...")
     matcher = cv2.detail.BestOf2NearestMatcher_create(use_gpu, match_conf)
@@ -187,7 +190,7 @@ def stitch_fast(data, use_kaze=False):
                     cameras[c].ppx *= compose_work_aspect
                     cameras[c].ppy *= compose_work_aspect
 
-                    sz = (data[0][1][c].shape[1] * compose_scale, data[0][1][c].shape[0] * compose_scale)
+                    sz = (frame_sizes[c][1] * compose_scale, frame_sizes[c][0] * compose_scale)
                     K = cameras[c].K().astype(np.float32)
                     roi = warper.warpRoi(sz, K, cameras[c].R)
                     corners.append(roi[0:2])
@@ -254,26 +257,26 @@ def stitch(data, use_kaze=False):
         match_mask[i, i + 1] = 1
     stitcher.setMatchingMask(match_mask)
 
+    # opencv needs real lists of images, not FrameSources
     print("vl...")
-    status, stitched_vl = stitcher.stitch(data[0][1], data[0][1])
+    vl_images = list(data[0][1])
+    status, stitched_vl = stitcher.stitch(vl_images, vl_images)
     if status == 0:
         print("SIZE:", stitched_vl.shape)
         cv2.imwrite(data[0][0], stitched_vl)
 
     print("ir...")
-    status, stitched_ir = stitcher.composePanorama(data[1][1])
+    status, stitched_ir = stitcher.composePanorama(list(data[1][1]))
     if status == 0:
         cv2.imwrite(data[1][0], stitched_ir)
 
     print("mx...")
-    status, stitched_mx = stitcher.composePanorama(data[2][1])
+    status, stitched_mx = stitcher.composePanorama(list(data[2][1]))
     if status == 0:
         cv2.imwrite(data[2][0], stitched_mx)
 
 
 if __name__ == "__main__":
-    num_imgs = 45
-
     # grab all the pano folders
     pano_dirs = []
     for dir in next(os.walk('.'))[1]:
@@ -292,9 +295,9 @@ if __name__ == "__main__":
         print(datetime.utcfromtimestamp(start - 4 * 3600).strftime('%Y-%m-%d %H:%M:%S'))
         print(directory)
 
-        vl_im = [cv2.imread(directory + "/vl{0}.png".format(i)) if i > 9 else cv2.imread(directory + "/vl0{0}.png".format(i)) for i in range(num_imgs)]
-        ir_im = [cv2.imread(directory + "/ir{0}.png".format(i)) if i > 9 else cv2.imread(directory + "/ir0{0}.png".format(i)) for i in range(num_imgs)]
-        mx_im = [cv2.imread(directory + "/mx{0}.png".format(i)) if i > 9 else cv2.imread(directory + "/mx0{0}.png".format(i)) for i in range(num_imgs)]
+        vl_im = FrameSource.from_directory(directory, "vl")
+        ir_im = FrameSource.from_directory(directory, "ir")
+        mx_im = FrameSource.from_directory(directory, "mx")
 
         types = ["vl", "ir", "mx"]
 
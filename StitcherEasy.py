@@ -5,6 +5,10 @@ __date__ = "Summer 2019 & January 2020"
 A working python stitcher for ir images. Uses visible light images to find the keypoints and do all of the adjustments,
 but then swaps out the visible light images for ir (or mx) images.
 
+register() does the first part and gives back a PanoramaModel, which can then compose any number of layers (and can be
+saved so the same images never need to be registered again). compose_tiled() blends the panorama a tile at a time into
+memory mapped files for sweeps too long to blend in memory.
+
 The stitch() is a modified version of these:
 https://raw.githubusercontent.com/opencv/opencv/master/samples/python/stitching_detailed.py
 https://raw.githubusercontent.com/opencv/opencv/master/samples/cpp/stitching_detailed.cpp
@@ -14,84 +18,157 @@ https://raw.githubusercontent.com/opencv/opencv/master/samples/cpp/stitching_det
 import cv2
 import numpy as np
 import time
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import util
 from util import open_directory_chooser
 from Image import Image
-
-
-def stitch(data, use_kaze=False):
-    """same as stitch_fast() in Stitcher.py"""
-    final_panos = []
-
+from frames import FrameSource
+import feature_cache
+from matching import MatchPlanner
+from scratch import ScratchStore
+import instrument
+
+
+def stitch(data, use_kaze=False, cache=None, planner=None, work_megapix=-1, seam_megapix=0.1, compose_megapix=-1,
+           adaptive=False, quality="balanced", time_budget=None):
+    """
+    same as stitch_fast() in Stitcher.py
+    :param data: list of lists of images, the first list (visible light) is used to find how the images fit together
+    :param use_kaze: KAZE features instead of ORB
+    :param cache: feature_cache.FeatureCache to load/save features, matches and camera params, None to not use one
+    :param planner: matching.MatchPlanner that decides which frames get matched, None to match each frame with the next
+    :param work_megapix: size (in megapixels) frames are shrunk to before finding features, -1 for full size
+    :param seam_megapix: size frames are shrunk to for finding seams
+    :param compose_megapix: size frames are shrunk to for the panorama, -1 for full size
+    :param adaptive: ignore the megapix settings and pick them with register_adaptive() instead
+    :param quality: see register_adaptive()
+    :param time_budget: see register_adaptive()
+    :return: list of panoramas, one for each list of images in data
+    """
+    if adaptive:
+        model = register_adaptive(data[0], use_kaze=use_kaze, cache=cache, planner=planner, quality=quality,
+                                  time_budget=time_budget)
+    else:
+        model = register(data[0], use_kaze=use_kaze, cache=cache, planner=planner, work_megapix=work_megapix,
+                         seam_megapix=seam_megapix, compose_megapix=compose_megapix)
+    return model.compose(data)
+
+
+def register(vl_images, use_kaze=False, cache=None, planner=None, work_megapix=-1, seam_megapix=0.1, compose_megapix=-1):
+    """
+    figures out how the images fit together (camera params, warping, seams) without making any panoramas
+    :param vl_images: list (or frames.FrameSource) of visible light images
+    :param use_kaze: KAZE features instead of ORB
+    :param cache: feature_cache.FeatureCache to load/save features, matches and camera params, None to not use one
+    :param planner: matching.MatchPlanner that decides which frames get matched, None to match each frame with the next
+    (and wider pairs where that isn't good enough)
+    :param work_megapix: size (in megapixels) frames are shrunk to before finding features, -1 for full size
+    :param seam_megapix: size frames are shrunk to for finding seams
+    :param compose_megapix: size frames are shrunk to for the panorama, -1 for full size
+    :return: PanoramaModel that can compose any layers of images taken by the same cameras
+    """
     use_gpu = False
-    work_megapix = -1
-    seam_megapix = 0.1
-    compose_megapix = -1
     wave_correct = "horiz"  # "vert"
     warp_type = "cylindrical"  # "spherical"  #"mercator"  #"cylindrical"
     match_conf = 0.3
     blend_type = "multiband"  # feather  # multiband #for no blending at all put any other string, like "no"
     blend_strength = 5
+    seam_find_type = "no"  # "voronoi"  # "gc_color"  # "dp_color"
+
+    if planner is None:
+        planner = MatchPlanner()
 
     if use_kaze:
         finder = cv2.KAZE.create()
     else:
         finder = cv2.ORB.create()
+    finder_name = "kaze" if use_kaze else "orb"
 
     seam_work_aspect = 1
     features = []
     images = []
+    hashes = []
+    frame_sizes = []
     print("getting image features and scaling images...")
     work_scale = -1
     seam_scale = -1
-    for i in range(len(data[0])):
-        full_img = data[0][i]
-
-        if work_megapix < 0:
-            img = full_img
-            work_scale = 1
-        else:
-            if work_scale == -1:  # if it hasn't been set yet
+    with instrument.span("features") as span:
+        for i, full_img in enumerate(vl_images):  # vl_images can be a frames.FrameSource, so only loop over it
+            if work_megapix < 0:
+                work_scale = 1
+            elif work_scale == -1:  # if it hasn't been set yet
                 work_scale = min(1.0, np.sqrt(work_megapix * 1e6 / (full_img.shape[0] * full_img.shape[1])))
-            img = cv2.resize(src=full_img, dsize=None, fx=work_scale, fy=work_scale,
-                             interpolation=cv2.INTER_LINEAR_EXACT)
-        if seam_scale == -1:  # if it hasn't been set yet
-            seam_scale = min(1.0, np.sqrt(seam_megapix * 1e6 / (full_img.shape[0] * full_img.shape[1])))
-            seam_work_aspect = seam_scale / work_scale
-        features.append(cv2.detail.computeImageFeatures2(finder, img))  # gets image features
-        images.append(cv2.resize(src=full_img, dsize=None, fx=seam_scale, fy=seam_scale, interpolation=cv2.INTER_LINEAR_EXACT))
-
-    print("getting matches info...")
-    matcher = cv2.detail.BestOf2NearestMatcher_create(use_gpu, match_conf)
-
-    # setting the matching mask makes it a lot faster because it tells it the order of images:
-    # https://software.intel.com/sites/default/files/Fast%20Panorama%20Stitching.pdf
-    match_mask = np.zeros((len(features), len(features)), np.uint8)
-    for i in range(len(data[0]) - 1):
-        match_mask[i, i + 1] = 1
-
-    matches_info = matcher.apply2(features, match_mask)
-    matcher.collectGarbage()
-
-    num_images = len(data[0])
-
-    # get camera params
-    print("finding camera params...")
-    estimator = cv2.detail_HomographyBasedEstimator()
-    b, cameras = estimator.apply(features, matches_info, None)
-    if not b:
-        print("Homography estimation failed.")
-        exit()
-    for cam in cameras:
-        cam.R = cam.R.astype(np.float32)
-
-    # adjust camera params
-    print("adjusting camera params...")
-    adjuster = cv2.detail_BundleAdjusterRay()
-    adjuster.setConfThresh(1)
-    b, cameras = adjuster.apply(features, matches_info, cameras)
-    if not b:
-        print("Camera parameters adjusting failed.")
-        exit()
+            if seam_scale == -1:  # if it hasn't been set yet
+                seam_scale = min(1.0, np.sqrt(seam_megapix * 1e6 / (full_img.shape[0] * full_img.shape[1])))
+                seam_work_aspect = seam_scale / work_scale
+            if cache is None:
+                features.append(get_features(finder, finder_name, work_resize(full_img, work_scale), work_megapix))
+            else:
+                hashes.append(feature_cache.image_hash(full_img))
+            images.append(cv2.resize(src=full_img, dsize=None, fx=seam_scale, fy=seam_scale, interpolation=cv2.INTER_LINEAR_EXACT))
+            frame_sizes.append((full_img.shape[1], full_img.shape[0]))
+        span.set(frames=len(frame_sizes), megapix=sum(w * h for w, h in frame_sizes) / 1e6)
+
+    num_images = len(images)
+
+    # the camera params only depend on the vl images and these settings ("pyramid" is how work_resize() shrinks them, the
+    # same tag as in the features key so params found on the old cv2.resize work images aren't used)
+    cameras_key = feature_cache.make_key("cameras", finder_name, work_megapix, "pyramid", match_conf, planner.settings(),
+                                         *hashes)
+    cached_cameras = cache.get("cameras", cameras_key) if cache is not None else None
+    if cache is not None and cached_cameras is None:
+        with instrument.span("features", frames=len(frame_sizes)):
+            # the features weren't needed if the camera params were cached, but they are now so go over the images again
+            for i, full_img in enumerate(vl_images):
+                features.append(get_features(finder, finder_name, work_resize(full_img, work_scale), work_megapix,
+                                             cache, hashes[i]))
+
+    if cached_cameras is not None:
+        print("using cached camera params...")
+        cameras = feature_cache.arrays_to_cameras(cached_cameras)
+    else:
+        print("getting matches info...")
+        with instrument.span("matching", frames=num_images):
+            matcher = cv2.detail.BestOf2NearestMatcher_create(use_gpu, match_conf)
+
+            matches_key = feature_cache.make_key("matches", finder_name, work_megapix, "pyramid", match_conf,
+                                                 planner.settings(), *hashes)
+            cached_matches = cache.get("matches", matches_key) if cache is not None else None
+            if cached_matches is not None:
+                matches_info = feature_cache.arrays_to_matches(cached_matches)
+            else:
+                # only matching frames near each other makes it a lot faster because it tells it the order of images:
+                # https://software.intel.com/sites/default/files/Fast%20Panorama%20Stitching.pdf
+                matches_info = planner.match(matcher, features)
+                planner.print_report()
+                if cache is not None:
+                    cache.put("matches", matches_key, feature_cache.matches_to_arrays(matches_info))
+
+        # get camera params
+        print("finding camera params...")
+        with instrument.span("estimate cameras", frames=num_images):
+            estimator = cv2.detail_HomographyBasedEstimator()
+            b, cameras = estimator.apply(features, matches_info, None)
+            if not b:
+                raise RuntimeError("Homography estimation failed.")
+            for cam in cameras:
+                cam.R = cam.R.astype(np.float32)
+
+        # adjust camera params
+        print("adjusting camera params...")
+        with instrument.span("bundle adjust", frames=num_images):
+            adjuster = cv2.detail_BundleAdjusterRay()
+            adjuster.setConfThresh(1)
+            b, cameras = adjuster.apply(features, matches_info, cameras)
+            if not b:
+                raise RuntimeError("Camera parameters adjusting failed.")
+        if cache is not None:
+            cache.put("cameras", cameras_key, feature_cache.cameras_to_arrays(cameras))
+
+    if cache is not None:
+        print("cache:", cache.stats())
 
     # get warped image scale
     print("getting warped image scale...")
@@ -106,17 +183,18 @@ def stitch(data, use_kaze=False):
 
     # wave correct. see section 5 of this paper: http://matthewalunbrown.com/papers/ijcv2007.pdf
     print("wave correction...")
-    rmats = []
-    for cam in cameras:
-        rmats.append(np.copy(cam.R))
+    with instrument.span("wave correct", frames=num_images):
+        rmats = []
+        for cam in cameras:
+            rmats.append(np.copy(cam.R))
 
-    if wave_correct == "horiz":
-        rmats = cv2.detail.waveCorrect(rmats, cv2.detail.WAVE_CORRECT_HORIZ)
-    elif wave_correct == "vert":
-        rmats = cv2.detail.waveCorrect(rmats, cv2.detail.WAVE_CORRECT_VERT)
+        if wave_correct == "horiz":
+            rmats = cv2.detail.waveCorrect(rmats, cv2.detail.WAVE_CORRECT_HORIZ)
+        elif wave_correct == "vert":
+            rmats = cv2.detail.waveCorrect(rmats, cv2.detail.WAVE_CORRECT_VERT)
 
-    for i in range(len(cameras)):
-        cameras[i].R = rmats[i]
+        for i in range(len(cameras)):
+            cameras[i].R = rmats[i]
 
     masks_warped = []
     images_warped = []
@@ -132,116 +210,530 @@ def stitch(data, use_kaze=False):
     warper = cv2.PyRotationWarper(warp_type, warped_image_scale * seam_work_aspect)
     print()
 
-    corners = []
-    for i in range(num_images):
-        K = cameras[i].K().astype(np.float32)
-        K[0, 0] *= seam_work_aspect
-        K[0, 2] *= seam_work_aspect
-        K[1, 1] *= seam_work_aspect
-        K[1, 2] *= seam_work_aspect
-
-        corner, image_wp = warper.warp(images[i], K, cameras[i].R, cv2.INTER_LINEAR, cv2.BORDER_REFLECT)
-        images_warped.append(image_wp)
-        corners.append(corner)
-
-        p, mask_wp = warper.warp(masks[i], K, cameras[i].R, cv2.INTER_NEAREST, cv2.BORDER_CONSTANT)
-        masks_warped.append(mask_wp.get())
-
-    # convert type
-    images_warped_f = []
-    for img in images_warped:
-        imgf = img.astype(np.float32)
-        images_warped_f.append(imgf)
-
-    # blends each type of image and saves them
-    for imgs in data:
-        # compensate for exposure -- NOTE it doesn't do this
-        # but see https://docs.opencv.org/4.1.0/d2/d37/classcv_1_1detail_1_1ExposureCompensator.html for options
-        compensator = cv2.detail.ExposureCompensator_createDefault(cv2.detail.ExposureCompensator_NO)
-        compensator.feed(corners=corners, images=images_warped, masks=masks_warped)
-
-        # find seams in the images -- NOTE just as with exposure this doesn't actually do anything
-        # but there are other possibilities here: https://docs.opencv.org/4.1.0/d7/d09/classcv_1_1detail_1_1SeamFinder.html#aaefc003adf1ebec13867ad9203096f6fa55b2503305e94168c0b36c4531f288d7
-        seam_finder = cv2.detail.SeamFinder_createDefault(cv2.detail.SeamFinder_NO)
-        seam_finder.find(images_warped_f, corners, masks_warped)
-
-        sizes = []
-        blender = None
-        compose_scale = -1
-
+    with instrument.span("seam warp", frames=num_images):
+        corners = []
         for i in range(num_images):
-            full_img = imgs[i]
-
-            if compose_scale == -1:  # if it hasn't been set yet
-                corners = []
-                if compose_megapix > 0:
-                    compose_scale = min(1.0, np.sqrt(compose_megapix * 1e6 / (full_img.shape[0] * full_img.shape[1])))
-                else:
-                    compose_scale = 1
-                compose_work_aspect = compose_scale / work_scale
-                warped_image_scale *= compose_work_aspect
-
-                warper = cv2.PyRotationWarper(warp_type, warped_image_scale)
-                for c in range(len(data[0])):
-                    cameras[c].focal *= compose_work_aspect
-                    cameras[c].ppx *= compose_work_aspect
-                    cameras[c].ppy *= compose_work_aspect
-
-                    sz = (data[0][c].shape[1] * compose_scale, data[0][c].shape[0] * compose_scale)
-                    K = cameras[c].K().astype(np.float32)
-                    roi = warper.warpRoi(sz, K, cameras[c].R)
-                    corners.append(roi[0:2])
-                    sizes.append(roi[2:4])
-
-            if abs(compose_scale - 1) > 1e-1:
-                img = cv2.resize(src=full_img, dsize=None, fx=compose_scale, fy=compose_scale,
-                                 interpolation=cv2.INTER_LINEAR_EXACT)
-            else:
-                img = full_img
-
             K = cameras[i].K().astype(np.float32)
-            corner, image_warped = warper.warp(img, K, cameras[i].R, cv2.INTER_LINEAR, cv2.BORDER_REFLECT)
-            mask = 255 * np.ones((img.shape[0], img.shape[1]), np.uint8)
-            p, mask_warped = warper.warp(mask, K, cameras[i].R, cv2.INTER_NEAREST, cv2.BORDER_CONSTANT)
-            compensator.apply(i, corners[i], image_warped, mask_warped)
-            image_warped_s = image_warped.astype(np.int16)
-
-            dilated_mask = cv2.dilate(masks_warped[i], None)
-            seam_mask = cv2.resize(dilated_mask, (mask_warped.shape[1], mask_warped.shape[0]), 0, 0,
-                                   cv2.INTER_LINEAR_EXACT)
-            mask_warped = cv2.bitwise_and(seam_mask, mask_warped)
-
-            # setup blender -- this sets up the part that combines the images by laying them on top of each other
-            if blender is None:
-                blender = cv2.detail.Blender_createDefault(cv2.detail.Blender_NO)
-                dst_sz = cv2.detail.resultRoi(corners=corners, sizes=sizes)
-                blend_width = np.sqrt(dst_sz[2] * dst_sz[3]) * blend_strength / 100
-                if blend_width < 1:
-                    print("no blend")
-                    blender = cv2.detail.Blender_createDefault(cv2.detail.Blender_NO)
-                elif blend_type == "multiband": # I think this is generally better
-                    print(blend_type)
-                    blender = cv2.detail_MultiBandBlender()
-                elif blend_type == "feather":  # mixes images at borders
-                    print(blend_type)
-                    blender = cv2.detail_FeatherBlender()
-                    blender.setSharpness(1.0 / blend_width)
-                blender.prepare(dst_sz)
-
-            blender.feed(image_warped_s, mask_warped, corners[i])
-
-        result = None
-        result_mask = None
-        print("blending...")
-        result, result_mask = blender.blend(result, result_mask)
-        print("SIZE:", result.shape)
-        final_panos.append(result)
-
-    return final_panos
+            K[0, 0] *= seam_work_aspect
+            K[0, 2] *= seam_work_aspect
+            K[1, 1] *= seam_work_aspect
+            K[1, 2] *= seam_work_aspect
+
+            corner, image_wp = warper.warp(images[i], K, cameras[i].R, cv2.INTER_LINEAR, cv2.BORDER_REFLECT)
+            images_warped.append(image_wp)
+            corners.append(corner)
+
+            p, mask_wp = warper.warp(masks[i], K, cameras[i].R, cv2.INTER_NEAREST, cv2.BORDER_CONSTANT)
+            masks_warped.append(mask_wp.get())
+
+    # compensate for exposure -- NOTE it doesn't do this
+    # but see https://docs.opencv.org/4.1.0/d2/d37/classcv_1_1detail_1_1ExposureCompensator.html for options
+    compensator = cv2.detail.ExposureCompensator_createDefault(cv2.detail.ExposureCompensator_NO)
+    compensator.feed(corners=corners, images=images_warped, masks=masks_warped)
+
+    # find seams in the images -- NOTE by default ("no") just as with exposure this doesn't actually do anything
+    # but there are other possibilities here: https://docs.opencv.org/4.1.0/d7/d09/classcv_1_1detail_1_1SeamFinder.html#aaefc003adf1ebec13867ad9203096f6fa55b2503305e94168c0b36c4531f288d7
+    if seam_find_type != "no":  # the seam finders want float32 images, but the NO one leaves the masks alone so skip the copies
+        with instrument.span("find seams", frames=num_images):
+            images_warped_f = [img.astype(np.float32) for img in images_warped]
+            masks_warped = make_seam_finder(seam_find_type).find(images_warped_f, corners, masks_warped)
+            masks_warped = [m.get() if isinstance(m, cv2.UMat) else m for m in masks_warped]
+            del images_warped_f
+
+    # move everything to the scale the panoramas get composed at
+    if compose_megapix > 0:
+        compose_scale = min(1.0, np.sqrt(compose_megapix * 1e6 / (frame_sizes[0][0] * frame_sizes[0][1])))
+    else:
+        compose_scale = 1
+    compose_work_aspect = compose_scale / work_scale
+    for cam in cameras:
+        cam.focal *= compose_work_aspect
+        cam.ppx *= compose_work_aspect
+        cam.ppy *= compose_work_aspect
+
+    return PanoramaModel(cameras, warp_type, warped_image_scale * compose_work_aspect, compose_scale, frame_sizes,
+                         masks_warped, blend_type, blend_strength, compensator)
+
+
+WORK_MEGAPIX_LEVELS = [0.1, 0.25, 0.5, 1.0, -1]  # what register_adaptive() tries, from fastest to best (-1 is full size)
+QUALITY_BUDGETS = {"fast": (0.1, 0.05, 1.0), "balanced": (0.5, 0.1, -1), "best": (-1, 0.1, -1)}  # work, seam & compose megapix
+
+
+def frame_megapix(img):
+    """:return: size of an image in megapixels"""
+    return img.shape[0] * img.shape[1] / 1e6
+
+
+def estimate_register_time(vl_images, use_kaze, work_megapix):
+    """
+    guesses how long finding the features of every frame takes by timing one small frame (the time it takes is about
+    proportional to the number of pixels) -- matching is counted as half again as long
+    :param vl_images: list (or frames.FrameSource) of visible light images
+    :param use_kaze: KAZE features instead of ORB
+    :param work_megapix: list of sizes to guess the time of (-1 is full size)
+    :return: list of secs, one for each size
+    """
+    finder = cv2.KAZE.create() if use_kaze else cv2.ORB.create()
+    full_img = vl_images[0]
+    small = work_resize(full_img, min(1.0, np.sqrt(WORK_MEGAPIX_LEVELS[0] / frame_megapix(full_img))))
+    start = time.time()
+    cv2.detail.computeImageFeatures2(finder, small)
+    secs_per_megapix = (time.time() - start) / frame_megapix(small)
+    sizes = [frame_megapix(full_img) if mp < 0 else min(mp, frame_megapix(full_img)) for mp in work_megapix]
+    return [1.5 * len(vl_images) * secs_per_megapix * size for size in sizes]
+
+
+def register_adaptive(vl_images, use_kaze=False, cache=None, planner=None, quality="balanced", time_budget=None):
+    """
+    register() at the lowest resolution the budget calls for, then at higher resolutions only if the frames don't match
+    well enough (a weak link that the planner couldn't bridge) or registering fails
+    :param vl_images: list (or frames.FrameSource) of visible light images
+    :param use_kaze: KAZE features instead of ORB
+    :param cache: feature_cache.FeatureCache or None
+    :param planner: matching.MatchPlanner or None for the default one
+    :param quality: "fast", "balanced" or "best" (see QUALITY_BUDGETS). "fast" also makes the panorama smaller
+    :param time_budget: secs finding features and matching can take, it picks the biggest work size that should fit.
+    None to only go by quality
+    :return: PanoramaModel
+    """
+    if planner is None:
+        planner = MatchPlanner()
+    work_megapix, seam_megapix, compose_megapix = QUALITY_BUDGETS[quality]
+    if time_budget is not None:
+        estimates = estimate_register_time(vl_images, use_kaze, WORK_MEGAPIX_LEVELS)
+        fits = [mp for mp, secs in zip(WORK_MEGAPIX_LEVELS, estimates) if secs <= time_budget]
+        work_megapix = fits[-1] if len(fits) > 0 else WORK_MEGAPIX_LEVELS[0]
+        print("estimated secs for each work megapix:",
+              {mp: round(float(secs), 1) for mp, secs in zip(WORK_MEGAPIX_LEVELS, estimates)})
+
+    model = None
+    for level in WORK_MEGAPIX_LEVELS[WORK_MEGAPIX_LEVELS.index(work_megapix):]:
+        print("\nregistering with work megapix", level)
+        planner.weak = set()  # stays empty if the camera params come from the cache
+        try:
+            model = register(vl_images, use_kaze, cache, planner, work_megapix=level,
+                             seam_megapix=seam_megapix if level < 0 else min(seam_megapix, level),
+                             compose_megapix=compose_megapix)
+        except RuntimeError as e:
+            print(e, "-- trying a higher resolution")
+            continue
+        if len(planner.weak) == 0:
+            return model
+        print("frames still don't match well enough -- trying a higher resolution")
+    if model is None:
+        raise RuntimeError("registering failed at every resolution")
+    return model
+
+
+class PanoramaModel:
+    """
+    everything registering a set of images figured out: the cameras (at compose scale), how to warp them, where each
+    warped image goes and the seam masks. Any number of layers (vl, ir, mx, rescaled ir...) taken by the same cameras can
+    be composed with it, and it can be saved and loaded so the images never have to be registered again
+    """
+    def __init__(self, cameras, warp_type, warped_image_scale, compose_scale, frame_sizes, seam_masks,
+                 blend_type="multiband", blend_strength=5, compensator=None):
+        """
+        :param cameras: list of cv2.detail.CameraParams at compose scale
+        :param warp_type: "cylindrical", "spherical", etc.
+        :param warped_image_scale: scale of the warper at compose scale
+        :param compose_scale: how much the frames are resized by before being warped
+        :param frame_sizes: list of (width, height) of each frame at full size
+        :param seam_masks: list of warped masks at seam scale that say which part of each frame to use
+        :param blend_type: "multiband", "feather", or anything else for no blending
+        :param blend_strength: bigger blends over a wider area
+        :param compensator: exposure compensator that has been fed the warped images, None for no compensation (it is
+        not saved by save())
+        """
+        self.cameras = cameras
+        self.warp_type = warp_type
+        self.warped_image_scale = warped_image_scale
+        self.compose_scale = compose_scale
+        self.frame_sizes = frame_sizes
+        self.seam_masks = seam_masks
+        self.blend_type = blend_type
+        self.blend_strength = blend_strength
+        if compensator is None:
+            compensator = cv2.detail.ExposureCompensator_createDefault(cv2.detail.ExposureCompensator_NO)
+        self.compensator = compensator
+
+        self.thread_data = threading.local()  # each thread gets its own warper since warping changes the warper's state
+        self.corners = []
+        self.sizes = []
+        for c in range(len(cameras)):
+            roi = self.get_warper().warpRoi(self.compose_size(c), self.K(c), cameras[c].R)
+            self.corners.append(roi[0:2])
+            self.sizes.append(roi[2:4])
+
+    def get_warper(self):
+        """:return: the warper for the thread that calls this"""
+        if not hasattr(self.thread_data, "warper"):
+            self.thread_data.warper = cv2.PyRotationWarper(self.warp_type, self.warped_image_scale)
+        return self.thread_data.warper
+
+    def K(self, i):
+        """:return: camera matrix of frame i as float32"""
+        return self.cameras[i].K().astype(np.float32)
+
+    def make_blender(self, dst_roi=None):
+        """
+        setup blender -- this sets up the part that combines the images by laying them on top of each other
+        :param dst_roi: (x, y, width, height) of the part of the panorama to blend, None for all of it. The blend width
+        always comes from the size of the whole panorama so every part is blended the same way
+        :return: prepared blender
+        """
+        dst_sz = cv2.detail.resultRoi(corners=self.corners, sizes=self.sizes)
+        blend_width = np.sqrt(dst_sz[2] * dst_sz[3]) * self.blend_strength / 100
+        verbose = dst_roi is None  # tiles don't each announce their blender
+        if blend_width < 1:
+            if verbose:
+                print("no blend")
+            blender = cv2.detail.Blender_createDefault(cv2.detail.Blender_NO)
+        elif self.blend_type == "multiband":  # I think this is generally better
+            if verbose:
+                print(self.blend_type)
+            blender = cv2.detail_MultiBandBlender()
+        elif self.blend_type == "feather":  # mixes images at borders
+            if verbose:
+                print(self.blend_type)
+            blender = cv2.detail_FeatherBlender()
+            blender.setSharpness(1.0 / blend_width)
+        else:
+            blender = cv2.detail.Blender_createDefault(cv2.detail.Blender_NO)
+        blender.prepare(dst_sz if dst_roi is None else tuple(dst_roi))
+        return blender
+
+    def resize_for_compose(self, full_img):
+        """:return: the frame at compose scale"""
+        if abs(self.compose_scale - 1) > 1e-1:
+            return cv2.resize(src=full_img, dsize=None, fx=self.compose_scale, fy=self.compose_scale,
+                              interpolation=cv2.INTER_LINEAR_EXACT)
+        return full_img
+
+    def compose_size(self, i):
+        """:return: (width, height) of frame i after resize_for_compose()"""
+        w, h = self.frame_sizes[i]
+        if abs(self.compose_scale - 1) > 1e-1:
+            return int(round(w * self.compose_scale)), int(round(h * self.compose_scale))
+        return w, h
+
+    def warp_mask(self, i):
+        """
+        :param i: frame number
+        :return: the part of the warped frame that goes into the panorama (warped frame shape & the seam mask combined)
+        """
+        w, h = self.compose_size(i)
+        mask = 255 * np.ones((h, w), np.uint8)
+        p, mask_warped = self.get_warper().warp(mask, self.K(i), self.cameras[i].R, cv2.INTER_NEAREST, cv2.BORDER_CONSTANT)
+
+        dilated_mask = cv2.dilate(self.seam_masks[i], None)
+        seam_mask = cv2.resize(dilated_mask, (mask_warped.shape[1], mask_warped.shape[0]), 0, 0,
+                               cv2.INTER_LINEAR_EXACT)
+        return cv2.bitwise_and(seam_mask, mask_warped)
+
+    def warp_image(self, i, full_img):
+        """
+        :param i: frame number
+        :param full_img: frame i of any layer at full size
+        :return: the warped frame
+        """
+        corner, image_warped = self.get_warper().warp(self.resize_for_compose(full_img), self.K(i), self.cameras[i].R,
+                                                      cv2.INTER_LINEAR, cv2.BORDER_REFLECT)
+        return image_warped
+
+    def warp_frame(self, i, layers):
+        """
+        :param i: frame number
+        :param layers: list of lists of images
+        :return: the warped mask of frame i, list of frame i of each layer warped
+        """
+        with instrument.span("warp", frames=1, layers=len(layers), frame=i):
+            return self.warp_mask(i), [self.warp_image(i, imgs[i]) for imgs in layers]
+
+    def feed(self, blender, image_warped, mask_warped, corner):
+        """
+        gives a warped frame to a blender. The multiband blender takes uint8 frames as they are, the others need int16
+        :param blender: from make_blender()
+        :param image_warped: warped frame (or the part of it being blended)
+        :param mask_warped: its mask
+        :param corner: (x, y) of its top left corner in the panorama
+        """
+        if not (isinstance(blender, cv2.detail_MultiBandBlender) and image_warped.dtype == np.uint8):
+            image_warped = image_warped.astype(np.int16)
+        blender.feed(image_warped, mask_warped, corner)
+
+    def compose(self, layers, workers=None, return_masks=False):
+        """
+        warps and blends every layer in one pass over the frames: the mask of each frame is only warped once and then
+        used for the frame of every layer. Frames are warped by a pool of threads (opencv lets go of the GIL while it
+        works) and fed to the blenders in order as they finish
+        :param layers: list of lists (or frames.FrameSources, which then get read by the threads) of images, each has one
+        image per frame in the same order as registered
+        :param workers: number of threads warping frames, None for one per cpu
+        :param return_masks: also return the result mask of each blender (255 wherever some frame landed, 0 in the border)
+        :return: list of panoramas (int16), one for each layer (and list of result masks if return_masks)
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        blenders = [self.make_blender() for imgs in layers]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            warped_frames = util.imap_ordered(executor, lambda i: self.warp_frame(i, layers), range(len(self.cameras)),
+                                              window=2 * workers)
+            for i, (mask_warped, images_warped) in enumerate(warped_frames):
+                with instrument.span("feed", frames=1, layers=len(layers), frame=i):
+                    for image_warped, blender in zip(images_warped, blenders):
+                        self.compensator.apply(i, self.corners[i], image_warped, mask_warped)
+                        self.feed(blender, image_warped, mask_warped, self.corners[i])
+
+        final_panos = []
+        final_masks = []
+        for blender in blenders:
+            result = None
+            result_mask = None
+            print("blending...")
+            with instrument.span("blend") as span:
+                result, result_mask = blender.blend(result, result_mask)
+                span.set(megapix=instrument.megapix(result))
+            print("SIZE:", result.shape)
+            final_panos.append(result)
+            final_masks.append(result_mask)
+        if return_masks:
+            return final_panos, final_masks
+        return final_panos
+
+    def tiles(self, tile_width, tile_height=None, align=1):
+        """
+        splits the panorama into a grid of tiles
+        :param tile_width: width of each tile (the last one in a row can be narrower)
+        :param tile_height: height of each tile, None for the whole height
+        :param align: tile sizes are rounded up to a multiple of this
+        :return: list of (x, y, width, height) in the same coordinates as self.corners, row by row
+        """
+        x0, y0, width, height = cv2.detail.resultRoi(corners=self.corners, sizes=self.sizes)
+        tile_width = -(-tile_width // align) * align
+        tile_height = height if tile_height is None else -(-tile_height // align) * align
+        return [(x, y, min(tile_width, x0 + width - x), min(tile_height, y0 + height - y))
+                for y in range(y0, y0 + height, tile_height) for x in range(x0, x0 + width, tile_width)]
+
+    def tile_margin(self, blender):
+        """
+        :param blender: a blender from make_blender()
+        :return: how far past the edges of a tile frames need to be blended so the inside of the tile comes out the same
+        as when the whole panorama is blended at once, and the multiple tiles have to start on
+        """
+        if isinstance(blender, cv2.detail_MultiBandBlender):
+            align = 1 << blender.numBands()  # the pyramids are lined up on multiples of this
+            return 8 * align, align
+        if isinstance(blender, cv2.detail_FeatherBlender):
+            return int(np.ceil(1 / blender.sharpness())) + 1, 1  # weights stop changing a blend width from an edge
+        return 0, 1
+
+    def compose_tiled(self, layers, out_paths, mask_path=None, tile_width=4096, tile_height=None, margin=None,
+                      workers=None, scratch_directory=None):
+        """
+        like compose() but the panoramas are blended one tile at a time into memory mapped .npy files, so memory use
+        depends on the tile size and not on the size of the panorama. Each tile is blended (with a margin around it)
+        from only the frames that land on it, and a warped frame is kept only until the last tile that needs it is done
+        :param layers: list of lists (or frames.FrameSources) of images, each has one image per frame
+        :param out_paths: one .npy path per layer to write the panoramas (int16) to
+        :param mask_path: .npy path for where frames landed (255) and the border (0), None to keep it in memory
+        :param tile_width: width of a tile, panoramas are long so by default tiles are the full height
+        :param tile_height: height of a tile, None for the whole height
+        :param margin: extra pixels around each tile that are blended and thrown away, None to pick it from the blender
+        :param workers: number of threads warping frames, None for one per cpu
+        :param scratch_directory: where warped frames are kept on disk until the tiles are done with them, None for a
+        temporary folder. Only the files it writes get deleted from a folder that is passed in
+        :return: list of read only memory mapped panoramas (one per layer), the result mask
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        x0, y0, width, height = cv2.detail.resultRoi(corners=self.corners, sizes=self.sizes)
+        default_margin, align = self.tile_margin(self.make_blender((x0, y0, 1, 1)))
+        margin = default_margin if margin is None else -(-margin // align) * align
+
+        tiles = self.tiles(tile_width, tile_height, align)
+        padded = [intersect_rects((x - margin, y - margin, w + 2 * margin, h + 2 * margin), (x0, y0, width, height))
+                  for x, y, w, h in tiles]
+        frame_rects = [(c[0], c[1], s[0], s[1]) for c, s in zip(self.corners, self.sizes)]
+        frames_in_tile = [[f for f in range(len(frame_rects)) if intersect_rects(frame_rects[f], p) is not None]
+                          for p in padded]
+        last_tile = {f: t for t, frames in enumerate(frames_in_tile) for f in frames}
+
+        # make the output files, each tile opens them just long enough to write itself so the parts of the panoramas
+        # that are done don't stay in the memory of this process
+        for path in out_paths:
+            np.lib.format.open_memmap(path, mode="w+", dtype=np.int16, shape=(height, width, 3))
+        if mask_path is None:
+            result_mask = np.zeros((height, width), np.uint8)
+        else:
+            np.lib.format.open_memmap(mask_path, mode="w+", dtype=np.uint8, shape=(height, width))
+
+        on_disk = set()  # frames that are warped and waiting in the scratch store for the tiles that still need them
+        with ThreadPoolExecutor(max_workers=workers) as executor, ScratchStore(scratch_directory) as store:
+            for t, ((x, y, w, h), pad) in enumerate(zip(tiles, padded)):
+                print("tile {0}/{1}".format(t + 1, len(tiles)))
+                if len(frames_in_tile[t]) == 0:
+                    continue
+                new_frames = [f for f in frames_in_tile[t] if f not in on_disk]
+                for f, (mask_warped, images_warped) in zip(new_frames, util.imap_ordered(
+                        executor, lambda i: self.warp_frame(i, layers), new_frames, window=2 * workers)):
+                    for image_warped in images_warped:
+                        self.compensator.apply(f, self.corners[f], image_warped, mask_warped)
+                    store.put("mask{0}".format(f), mask_warped)
+                    for l, image_warped in enumerate(images_warped):
+                        # feed() cuts everything but uint8 down to int16 anyway, so store it that way
+                        store.put("layer{0}-{1}".format(l, f), image_warped,
+                                  None if image_warped.dtype == np.uint8 else np.int16)
+                    on_disk.add(f)
+
+                with instrument.span("blend tile", frames=len(frames_in_tile[t]), megapix=w * h / 1e6, tile=t):
+                    blenders = [self.make_blender(pad) for imgs in layers]
+                    for f in frames_in_tile[t]:
+                        cx, cy, cw, ch = intersect_rects(frame_rects[f], pad)
+                        rows = slice(cy - frame_rects[f][1], cy - frame_rects[f][1] + ch)
+                        cols = slice(cx - frame_rects[f][0], cx - frame_rects[f][0] + cw)
+                        mask_warped = np.asarray(store.get("mask{0}".format(f))[rows, cols])  # only reads this part
+                        for l, blender in enumerate(blenders):
+                            image_warped = np.asarray(store.get("layer{0}-{1}".format(l, f))[rows, cols])
+                            self.feed(blender, image_warped, mask_warped, (cx, cy))
+                        if last_tile[f] == t:
+                            on_disk.remove(f)
+                            store.delete("mask{0}".format(f))
+                            for l in range(len(layers)):
+                                store.delete("layer{0}-{1}".format(l, f))
+
+                    # keep only the inside of the tile
+                    inside = (slice(y - pad[1], y - pad[1] + h), slice(x - pad[0], x - pad[0] + w))
+                    out = (slice(y - y0, y - y0 + h), slice(x - x0, x - x0 + w))
+                    for blender, path in zip(blenders, out_paths):
+                        result, mask = blender.blend(None, None)
+                        pano = np.load(path, mmap_mode="r+")
+                        pano[out] = result[inside]
+                        del pano
+                        if mask_path is None:
+                            result_mask[out] = mask[inside]
+                        else:
+                            pano_mask = np.load(mask_path, mmap_mode="r+")
+                            pano_mask[out] = mask[inside]
+                            del pano_mask
+        print("SIZE:", (height, width, 3))
+        panos = [np.load(path, mmap_mode="r") for path in out_paths]
+        if mask_path is not None:
+            result_mask = np.load(mask_path, mmap_mode="r")
+        return panos, result_mask
+
+    def to_arrays(self):
+        """:return: dictionary of arrays with everything in the model (except the compensator)"""
+        arrays = feature_cache.cameras_to_arrays(self.cameras)
+        arrays["settings"] = np.array([self.warped_image_scale, self.compose_scale, self.blend_strength])
+        arrays["names"] = np.array([self.warp_type, self.blend_type])
+        arrays["frame_sizes"] = np.array(self.frame_sizes)
+        for i, m in enumerate(self.seam_masks):
+            arrays["seam_mask_{0}".format(i)] = m
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        :param arrays: from to_arrays() (or an open .npz file)
+        :return: PanoramaModel
+        """
+        warped_image_scale, compose_scale, blend_strength = arrays["settings"]
+        warp_type, blend_type = [str(n) for n in arrays["names"]]
+        frame_sizes = [tuple(int(x) for x in s) for s in arrays["frame_sizes"]]
+        seam_masks = [arrays["seam_mask_{0}".format(i)] for i in range(len(frame_sizes))]
+        cameras = feature_cache.arrays_to_cameras(arrays)
+        return cls(cameras, warp_type, float(warped_image_scale), float(compose_scale), frame_sizes, seam_masks,
+                   blend_type, float(blend_strength))
+
+    def save(self, path):
+        """
+        writes the model to a .npz file
+        :param path: where to save it
+        """
+        np.savez(path, **self.to_arrays())
+
+    @classmethod
+    def load(cls, path):
+        """
+        reads a model written by save()
+        :param path: .npz file
+        :return: PanoramaModel
+        """
+        with np.load(path) as f:
+            return cls.from_arrays(f)
+
+
+def make_seam_finder(seam_find_type):
+    """
+    :param seam_find_type: "voronoi", "gc_color", "dp_color" or "no"
+    :return: seam finder
+    """
+    if seam_find_type == "voronoi":
+        return cv2.detail.SeamFinder_createDefault(cv2.detail.SeamFinder_VORONOI_SEAM)
+    elif seam_find_type == "gc_color":
+        return cv2.detail_GraphCutSeamFinder("COST_COLOR")
+    elif seam_find_type == "dp_color":
+        return cv2.detail_DpSeamFinder("COLOR")
+    return cv2.detail.SeamFinder_createDefault(cv2.detail.SeamFinder_NO)
+
+
+def intersect_rects(a, b):
+    """
+    :param a: (x, y, width, height)
+    :param b: (x, y, width, height)
+    :return: (x, y, width, height) of where they overlap, None if they don't
+    """
+    x, y = max(a[0], b[0]), max(a[1], b[1])
+    w, h = min(a[0] + a[2], b[0] + b[2]) - x, min(a[1] + a[3], b[1] + b[3]) - y
+    if w <= 0 or h <= 0:
+        return None
+    return x, y, w, h
+
+
+def work_resize(full_img, work_scale):
+    """
+    shrinks the image down a pyramid (halving it with a blur each time, so small features don't alias into noise) and
+    then resizes the rest of the way
+    :return: the image at the scale features are found at
+    """
+    if work_scale == 1:
+        return full_img
+    img = full_img
+    scale = 1.0
+    while work_scale <= scale / 2:
+        img = cv2.pyrDown(img)
+        scale /= 2
+    if abs(work_scale / scale - 1) < 1e-3:
+        return img
+    return cv2.resize(src=img, dsize=(int(round(full_img.shape[1] * work_scale)), int(round(full_img.shape[0] * work_scale))),
+                      interpolation=cv2.INTER_LINEAR_EXACT)
+
+
+def get_features(finder, finder_name, img, work_megapix, cache=None, img_hash=None):
+    """
+    finds the keypoints and descriptors of an image, or loads them from the cache
+    :param finder: cv2.KAZE or cv2.ORB
+    :param finder_name: "kaze" or "orb" (part of the cache key)
+    :param img: image at work scale
+    :param work_megapix: part of the cache key
+    :param cache: feature_cache.FeatureCache or None
+    :param img_hash: feature_cache.image_hash() of the full size image
+    :return: cv2.detail.ImageFeatures
+    """
+    if cache is None:
+        return cv2.detail.computeImageFeatures2(finder, img)
+
+    key = feature_cache.make_key("features", finder_name, work_megapix, "pyramid", img_hash)
+    cached = cache.get("features", key)
+    if cached is not None:
+        return feature_cache.arrays_to_features(cached)
+    features = cv2.detail.computeImageFeatures2(finder, img)  # gets image features
+    cache.put("features", key, feature_cache.features_to_arrays(features))
+    return features
 
 
 def main():
-    NUM_IMGS = 45
     REMOVE_BLACK = True
 
     print("*** SELECT folder containing all images ***")
@@ -252,20 +744,14 @@ def main():
     print("\n\n---------------")
     print(directory)
 
-    #  get images
-    vl_im = [
-        cv2.imread(directory + "/vl{0}.png".format(i)) if i > 9 else cv2.imread(directory + "/vl0{0}.png".format(i)) for
-        i in range(NUM_IMGS)]
-    ir_im = [
-        cv2.imread(directory + "/ir{0}.png".format(i)) if i > 9 else cv2.imread(directory + "/ir0{0}.png".format(i)) for
-        i in range(NUM_IMGS)]
-    mx_im = [
-        cv2.imread(directory + "/mx{0}.png".format(i)) if i > 9 else cv2.imread(directory + "/mx0{0}.png".format(i)) for
-        i in range(NUM_IMGS)]
+    #  get images -- they are only read from disk as they are needed
+    vl_im = FrameSource.from_directory(directory, "vl")
+    ir_im = FrameSource.from_directory(directory, "ir")
+    mx_im = FrameSource.from_directory(directory, "mx")
 
     data = [vl_im, ir_im, mx_im]
 
-    panos = stitch(data, use_kaze=True)  # if the stitch fails try changing kaze to False/True
+    panos = stitch(data, use_kaze=True, cache=feature_cache.FeatureCache())  # if the stitch fails try changing kaze to False/True
     # get rid of black border
     if REMOVE_BLACK:
         for p in range(len(panos)):
@@ -0,0 +1,250 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+makes the panoramas of every pano folder under a root folder without any pop-ups
+
+    python3 batch.py captures/ --output panos/ --workers 4 --timeout 600
+
+a pano folder is any folder with vl frames, ir frames and an info.json. Each one is a job that runs
+runner.process_pano() in its own process, at most --workers at a time, and a job that takes longer than --timeout is
+killed. The panoramas of captures/a/pano-1 go to panos/a/pano-1/ along with log.txt (everything the job printed) and
+stages.jsonl (how long each stage took, see instrument.py)
+
+every finished job is added as a line of json to progress.jsonl in the output folder, so running the same command again
+skips the folders that are already done (and with --retry-failed also tries the ones that failed or timed out again).
+At the end there is a summary of how many jobs finished and how fast
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import traceback
+import multiprocessing
+import cv2
+import runner
+import instrument
+import mixed
+from frames import discover_frames
+from typing import Any, Dict, List, Optional
+
+PROGRESS_FILE: str = "progress.jsonl"
+
+
+def is_pano_folder(directory: str) -> bool:
+    """:return: whether the folder has everything runner.process_pano() needs"""
+    return os.path.isfile(os.path.join(directory, "info.json")) and len(discover_frames(directory, "vl")) > 0 \
+        and len(discover_frames(directory, "ir")) > 0
+
+
+def find_pano_folders(root: str, skip: Optional[str] = None) -> List[str]:
+    """
+    :param root: folder to look through (along with every folder inside it)
+    :param skip: folder to leave out, like the output folder when it is inside root
+    :return: paths of the pano folders, sorted
+    """
+    folders: List[str] = []
+    for directory, subdirectories, files in os.walk(root):
+        if skip is not None and os.path.abspath(directory) == os.path.abspath(skip):
+            subdirectories[:] = []
+            continue
+        if is_pano_folder(directory):
+            folders.append(directory)
+            subdirectories[:] = []  # a pano folder doesn't have other pano folders in it
+    return sorted(folders)
+
+
+def read_progress(path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    :param path: progress.jsonl written by an earlier run
+    :return: the last record of each folder, empty if there is no file yet
+    """
+    progress: Dict[str, Dict[str, Any]] = {}
+    if os.path.isfile(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    record: Dict[str, Any] = json.loads(line)
+                except ValueError:  # the last line can be cut off if the batch itself was killed
+                    continue
+                progress[record["folder"]] = record
+    return progress
+
+
+def run_job(folder: str, save_directory: str, settings: runner.Settings, results: multiprocessing.Queue) -> None:
+    """
+    runs in its own process, makes the panoramas of one folder and puts a record of how it went on results
+    :param folder: pano folder
+    :param save_directory: where the panoramas, log.txt and stages.jsonl go
+    :param settings: how to make the panoramas
+    :param results: where the record goes
+    """
+    os.makedirs(save_directory, exist_ok=True)
+    # everything the job prints (including from opencv) goes to its log instead of mixing with the other jobs
+    log = open(os.path.join(save_directory, "log.txt"), "w")
+    os.dup2(log.fileno(), sys.stdout.fileno())
+    os.dup2(log.fileno(), sys.stderr.fileno())
+
+    record: Dict[str, Any] = {"folder": folder}
+    try:
+        with instrument.recording() as recorder:
+            outputs: Dict[str, str] = runner.process_pano(folder, save_directory, settings)
+        recorder.write_log(os.path.join(save_directory, "stages.jsonl"))
+        frames: List[str] = discover_frames(folder, "vl")
+        first = cv2.imread(frames[0])
+        record.update(status="done", outputs=outputs, frames=len(frames),
+                      megapix=len(frames) * instrument.megapix(first),
+                      stages={s.name: s.secs for s in recorder.top_level()})
+    except Exception as e:
+        traceback.print_exc()
+        record.update(status="failed", error="{0}: {1}".format(type(e).__name__, str(e).strip()))
+    sys.stdout.flush()
+    sys.stderr.flush()
+    results.put(record)
+
+
+class Batch:
+    def __init__(self, root: str, output: str, settings: runner.Settings, workers: int = 1,
+                 timeout: Optional[float] = None, retry_failed: bool = False):
+        """
+        :param root: folder with pano folders in it (anywhere inside it)
+        :param output: where the panoramas and progress.jsonl go
+        :param settings: how to make the panoramas
+        :param workers: most jobs running at once
+        :param timeout: seconds a job gets before it is killed, None for no limit
+        :param retry_failed: also run folders that failed or timed out last time
+        """
+        self.root: str = root
+        self.output: str = output
+        self.settings: runner.Settings = settings
+        self.workers: int = workers
+        self.timeout: Optional[float] = timeout
+        self.progress_path: str = os.path.join(output, PROGRESS_FILE)
+        os.makedirs(output, exist_ok=True)
+
+        previous: Dict[str, Dict[str, Any]] = read_progress(self.progress_path)
+        self.folders: List[str] = find_pano_folders(root, skip=output)
+        self.skipped: List[str] = [f for f in self.folders if f in previous and
+                                   (previous[f]["status"] == "done" or not retry_failed)]
+        self.todo: List[str] = [f for f in self.folders if f not in self.skipped]
+        self.records: List[Dict[str, Any]] = []
+        self.secs: float = 0
+
+    def save_directory(self, folder: str) -> str:
+        """:return: where the panoramas of a folder go, the same path inside the output folder as it has inside root"""
+        return os.path.join(self.output, os.path.relpath(folder, self.root))
+
+    def finish(self, record: Dict[str, Any]) -> None:
+        """keeps the record of a job and adds it to progress.jsonl"""
+        self.records.append(record)
+        with open(self.progress_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        print("[{0}/{1}] {2} {3} ({4:.1f} secs){5}".format(len(self.records), len(self.todo), record["status"],
+                                                          record["folder"], record["secs"],
+                                                          "" if "error" not in record else " -- " + record["error"]))
+
+    def run(self) -> List[Dict[str, Any]]:
+        """
+        runs every job, at most self.workers at a time
+        :return: the record of each job that ran
+        """
+        print("{0} pano folders, {1} already done, {2} to do".format(len(self.folders), len(self.skipped),
+                                                                     len(self.todo)))
+        start: float = time.time()
+        results: multiprocessing.Queue = multiprocessing.Queue()
+        waiting: List[str] = list(self.todo)
+        running: Dict[str, Any] = {}  # folder -> (process, start time)
+        while len(waiting) > 0 or len(running) > 0:
+            while len(waiting) > 0 and len(running) < self.workers:
+                folder: str = waiting.pop(0)
+                process = multiprocessing.Process(target=run_job, args=(folder, self.save_directory(folder),
+                                                                        self.settings, results))
+                process.start()
+                running[folder] = (process, time.time())
+
+            try:
+                record: Dict[str, Any] = results.get(timeout=0.5)
+                if record["folder"] in running:  # not if it was already counted as timed out
+                    process, started = running.pop(record["folder"])
+                    process.join()
+                    record["secs"] = time.time() - started
+                    self.finish(record)
+            except queue.Empty:
+                pass
+
+            for folder, (process, started) in list(running.items()):
+                if self.timeout is not None and time.time() - started > self.timeout:
+                    process.kill()
+                    process.join()
+                    del running[folder]
+                    self.finish({"folder": folder, "status": "timeout", "secs": time.time() - started,
+                                 "error": "took longer than {0} secs".format(self.timeout)})
+                elif not process.is_alive() and process.exitcode != 0:  # died without sending a record
+                    del running[folder]
+                    self.finish({"folder": folder, "status": "crashed", "secs": time.time() - started,
+                                 "error": "exit code {0}".format(process.exitcode)})
+        self.secs = time.time() - start
+        return self.records
+
+    def print_summary(self) -> None:
+        """prints how many jobs finished and how fast"""
+        done: List[Dict[str, Any]] = [r for r in self.records if r["status"] == "done"]
+        print("\nSUMMARY")
+        for status in ["done", "failed", "timeout", "crashed"]:
+            print("{0:>10}: {1}".format(status, sum(r["status"] == status for r in self.records)))
+        print("{0:>10}: {1}".format("skipped", len(self.skipped)))
+        print("{0:>10}: {1:.1f} secs".format("wall time", self.secs))
+        if len(done) > 0 and self.secs > 0:
+            frames: int = sum(r["frames"] for r in done)
+            megapix: float = sum(r["megapix"] for r in done)
+            print("{0:>10}: {1:.1f} panos/hour, {2:.2f} frames/sec, {3:.2f} megapix/sec".format(
+                "throughput", len(done) * 3600 / self.secs, frames / self.secs, megapix / self.secs))
+            print("{0:>10}: {1:.1f} secs".format("mean job", sum(r["secs"] for r in done) / len(done)))
+            for name in done[0]["stages"]:
+                print("{0:>22}: {1:.2f} secs per pano".format(name, sum(r["stages"].get(name, 0) for r in done) / len(done)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="make the panoramas of every pano folder under a folder")
+    parser.add_argument("root", help="folder with pano folders in it")
+    parser.add_argument("--output", help="where the panoramas go, by default a folder called output in root")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="most pano folders at once")
+    parser.add_argument("--timeout", type=float, help="seconds before a pano folder is given up on")
+    parser.add_argument("--retry-failed", action="store_true", help="try folders that failed or timed out last time again")
+    parser.add_argument("--change-palette", metavar="PALETTE", help="change the ir panorama to this palette, like lava.pal")
+    parser.add_argument("--temperature-domain", action="store_true", help="stitch temperatures instead of colors")
+    parser.add_argument("--register-quality", choices=["fast", "balanced", "best"], help="register with smaller frames first")
+    parser.add_argument("--tile-width", type=int, help="blend in tiles this wide")
+    parser.add_argument("--wrap-around", action="store_true", help="the sweeps go all the way around")
+    parser.add_argument("--no-flir-mx", action="store_true", help="don't stitch the mx frames")
+    parser.add_argument("--no-my-mx", action="store_true", help="don't make a mixed image from the panoramas")
+    parser.add_argument("--my-mx", nargs="+", choices=mixed.VARIANTS, default=["mx"], help="which mixed images to make")
+    parser.add_argument("--mx-mode", choices=["panorama", "frames"], default="panorama",
+                        help="mix the stitched panoramas, or mix each frame and stitch those")
+    parser.add_argument("--mx-filter", choices=mixed.FILTERS, default="bilateral", help="how the vl panorama is blurred for them")
+    parser.add_argument("--keep-info", action="store_true", help="don't write the replaced high temps to info.json")
+    args = parser.parse_args()
+
+    # the jobs already run side by side, so each one rescales in its own process
+    settings: runner.Settings = runner.Settings(RESCALE_WORKERS=1, TEMPERATURE_DOMAIN=args.temperature_domain,
+                                                REGISTER_QUALITY=args.register_quality, TILE_WIDTH=args.tile_width,
+                                                WRAP_AROUND=args.wrap_around, USE_FLIR_MX=not args.no_flir_mx,
+                                                CREATE_MY_MX=not args.no_my_mx, MY_MX_VARIANTS=args.my_mx, MX_MODE=args.mx_mode,
+                                                MY_MX_FILTER=args.mx_filter, OVERWRITE_FILE=not args.keep_info)
+    if args.change_palette is not None:
+        settings.CHANGE_PALETTE = True
+        settings.NEW_PALETTE = args.change_palette
+
+    output: str = os.path.join(args.root, "output") if args.output is None else args.output
+    batch: Batch = Batch(args.root, output, settings, args.workers, args.timeout, args.retry_failed)
+    batch.run()
+    batch.print_summary()
+    if any(r["status"] != "done" for r in batch.records):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+timings for the slow parts of the pipeline, run with "python3 benchmark.py"
+
+the palette lookup table benchmark changes the palette of fake ir panoramas of growing width. If the work is linear in
+the number of pixels the time per megapixel stays about the same no matter how wide the panorama gets
+
+the memory benchmark composes a fake sweep (cameras turning in a circle, no registering needed) in a separate process
+for each way of composing and reports the peak resident memory of that process
+
+the pipeline benchmark makes a fake pano folder (synthetic.py) and times every stage of runner.process_pano() on it,
+"python3 benchmark.py --pipeline --frames 20 --json before.json" saves the numbers so two commits can be compared
+"""
+
+import os
+import time
+import json
+import argparse
+import subprocess
+import tempfile
+import multiprocessing
+import cv2
+import numpy as np
+import lut
+import palette_registry
+import Image
+import runner
+import StitcherEasy
+import synthetic
+import mixed
+import instrument
+from typing import List, Dict, Optional
+
+
+def make_fake_ir_pano(height: int, width: int, palette_name: str = "iron.pal", seed: int = 0) -> np.ndarray:
+    """
+    :param height: rows in the panorama
+    :param width: columns in the panorama
+    :param palette_name: every pixel of the panorama will be a color from this palette
+    :param seed: for the random number generator
+    :return: uint8 bgr image that only uses colors from the palette
+    """
+    palette: np.ndarray = palette_registry.get_palette(palette_name).colors
+    rng = np.random.default_rng(seed)
+    idx: np.ndarray = (np.add.outer(np.arange(height), np.arange(width)) // 7 + rng.integers(0, 5, (height, width)))
+    return palette[idx % len(palette)]
+
+
+def bench_palette_lut(height: int = 480, widths: List[int] = (2500, 5000, 10000, 20000), repeats: int = 3) -> None:
+    """
+    times Image.change_palette() on panoramas of each width (the time it takes to identify the palette is not counted)
+    :param height: rows in the panoramas
+    :param widths: columns in the panoramas
+    :param repeats: the best of this many runs is reported
+    """
+    lut.palette_lut("iron.pal", "lava.pal")  # build the table before timing
+    print("palette lookup table (iron.pal -> lava.pal)")
+    print("{0:>8} {1:>8} {2:>10} {3:>10}".format("width", "mpix", "secs", "secs/mpix"))
+    for width in widths:
+        pano: np.ndarray = make_fake_ir_pano(height, width)
+        best: float = float("inf")
+        for r in range(repeats):
+            im: Image.Image = Image.Image(pano.copy())
+            im.identify_palette = lambda: "iron.pal"
+            start: float = time.perf_counter()
+            im.change_palette("lava.pal")
+            best = min(best, time.perf_counter() - start)
+        mpix: float = height * width / 1e6
+        print("{0:>8} {1:>8.2f} {2:>10.4f} {3:>10.4f}".format(width, mpix, best, best / mpix))
+
+
+def bench_match_palette(height: int = 480, width: int = 10000, noise: int = 6) -> None:
+    """
+    times Image.set_colors_to_palette() on a fake stitched panorama whose colors are slightly off from the palette.
+    The first run has to search the palette for every color, the second run finds them all in the index
+    :param height: rows in the panorama
+    :param width: columns in the panorama
+    :param noise: colors are moved up to this much away from the palette (like blending does)
+    """
+    palette = palette_registry.get_palette("iron.pal").as_list()
+    pano: np.ndarray = make_fake_ir_pano(height, width).astype(np.int16)
+    pano += np.random.default_rng(1).integers(-noise, noise + 1, pano.shape, dtype=np.int16)
+    pano = np.clip(pano, 0, 255).astype(np.uint8)
+
+    lut._nearest_indexes[np.array(palette, np.uint8).tobytes()] = lut.NearestColorIndex(palette)  # start empty
+    print("match palette ({0} x {1}, {2} unique colors)".format(width, height, len(np.unique(lut.pack_colors(pano)))))
+    for run in ["cold", "warm"]:
+        start: float = time.perf_counter()
+        Image.Image(pano.copy()).set_colors_to_palette(palette)
+        print("{0:>8} {1:>10.4f}".format(run, time.perf_counter() - start))
+
+
+def bench_all_palettes(height: int = 480, width: int = 10000) -> None:
+    """
+    times runner.make_all_palettes() (reading, rendering every palette and writing the pngs) on a fake ir panorama
+    :param height: rows in the panorama
+    :param width: columns in the panorama
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path: str = os.path.join(directory, "0-ir.png")
+        cv2.imwrite(path, make_fake_ir_pano(height, width))
+        start: float = time.perf_counter()
+        runner.make_all_palettes(path, directory)
+        print("all palettes ({0} x {1}) {2:.4f} secs".format(width, height, time.perf_counter() - start))
+
+
+def bench_mixed(height: int = 1000, width: int = 12000) -> None:
+    """
+    makes all three mixed images of a fake panorama with the old functions (each blurs the vl image on its own) and
+    with mixed.MixedImages using each filter
+    """
+    vl: np.ndarray = synthetic.make_scene(width, height)
+    ir: np.ndarray = make_fake_ir_pano(height, width)
+    print("\nmixed images of a {0}x{1} panorama".format(width, height))
+    start: float = time.perf_counter()
+    Image.create_mx(vl, ir), Image.create_mx2(vl, ir), Image.create_mx3(vl, ir)
+    print("{0:>28}: {1:.2f} secs".format("create_mx, create_mx2, 3", time.perf_counter() - start))
+    for name in mixed.FILTERS:
+        start = time.perf_counter()
+        mixed.MixedImages(vl, name).make(ir)
+        print("{0:>28}: {1:.2f} secs".format("MixedImages " + name, time.perf_counter() - start))
+
+
+class FakeFrames:
+    """
+    list-like set of frames that are made when they are asked for (like frames.FrameSource but without files)
+    """
+    def __init__(self, num_frames: int, width: int, height: int, seed: int = 0):
+        self.num_frames: int = num_frames
+        self.width: int = width
+        self.height: int = height
+        self.seed: int = seed
+
+    def __len__(self) -> int:
+        return self.num_frames
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        noise: np.ndarray = np.random.default_rng((self.seed, i)).integers(0, 256, (self.height, self.width, 3), np.uint8)
+        return cv2.GaussianBlur(noise, (0, 0), 3)
+
+
+def make_fake_model(num_frames: int, width: int, height: int, degrees_per_frame: float = 5,
+                    blend_type: str = "multiband") -> StitcherEasy.PanoramaModel:
+    """
+    :param num_frames: number of frames in the sweep
+    :param width: columns in each frame
+    :param height: rows in each frame
+    :param degrees_per_frame: how far the camera turns between frames
+    :param blend_type: see StitcherEasy.PanoramaModel
+    :return: model of a camera turning in a circle, as if register() had been run
+    """
+    focal: float = width / (2 * np.tan(np.deg2rad(25)))  # 50 degree field of view
+    cameras: List[cv2.detail.CameraParams] = []
+    for i in range(num_frames):
+        cam: cv2.detail.CameraParams = cv2.detail.CameraParams()
+        cam.focal, cam.aspect, cam.ppx, cam.ppy = focal, 1.0, width / 2, height / 2
+        a: float = np.deg2rad(degrees_per_frame * (i - (num_frames - 1) / 2))  # centered so no frame is cut by the seam
+        cam.R = np.array([[np.cos(a), 0, np.sin(a)], [0, 1, 0], [-np.sin(a), 0, np.cos(a)]], np.float32)
+        cam.t = np.zeros((3, 1))
+        cameras.append(cam)
+    seam_masks: List[np.ndarray] = [np.full((height // 4, width // 4), 255, np.uint8) for i in range(num_frames)]
+    return StitcherEasy.PanoramaModel(cameras, "cylindrical", focal, 1.0, [(width, height)] * num_frames, seam_masks,
+                                      blend_type)
+
+
+def _compose_and_measure(how: str, num_frames: int, width: int, height: int, num_layers: int,
+                         tile_width: Optional[int], results: multiprocessing.Queue) -> None:
+    """runs in its own process so that its peak memory is only from this one compose"""
+    model: StitcherEasy.PanoramaModel = make_fake_model(num_frames, width, height)
+    layers: List[FakeFrames] = [FakeFrames(num_frames, width, height, seed) for seed in range(num_layers)]
+    before: float = instrument.peak_rss_mb()
+    start: float = time.perf_counter()
+    if how == "in memory":
+        model.compose(layers, workers=1)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            model.compose_tiled(layers, [os.path.join(directory, "{0}.npy".format(l)) for l in range(num_layers)],
+                                tile_width=tile_width, workers=1)
+    results.put({"how": how, "secs": time.perf_counter() - start, "before_mb": before, "peak_mb": instrument.peak_rss_mb()})
+
+
+def bench_compose_memory(num_frames: int = 45, width: int = 640, height: int = 480, num_layers: int = 3,
+                         tile_width: int = 512) -> List[Dict]:
+    """
+    peak memory of composing a fake sweep all at once in memory and in tiles with the warped frames on disk
+    :param num_frames: number of frames in the sweep
+    :param width: columns in each frame
+    :param height: rows in each frame
+    :param num_layers: like vl, mx and ir
+    :param tile_width: width of the tiles
+    :return: list of {"how", "secs", "before_mb", "peak_mb"}
+    """
+    print("compose memory ({0} frames of {1} x {2}, {3} layers)".format(num_frames, width, height, num_layers))
+    print("{0:>12} {1:>10} {2:>14} {3:>12}".format("how", "secs", "start rss mb", "peak rss mb"))
+    reports: List[Dict] = []
+    for how in ["in memory", "tiled"]:
+        results: multiprocessing.Queue = multiprocessing.Queue()
+        p: multiprocessing.Process = multiprocessing.Process(
+            target=_compose_and_measure, args=(how, num_frames, width, height, num_layers, tile_width, results))
+        p.start()
+        report: Dict = results.get()
+        p.join()
+        print("{how:>12} {secs:>10.2f} {before_mb:>14.1f} {peak_mb:>12.1f}".format(**report))
+        reports.append(report)
+    return reports
+
+
+def git_commit() -> Optional[str]:
+    """:return: hash of the commit being benchmarked, None if it isn't a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_pipeline(num_frames: int = 8, width: int = 320, height: int = 240,
+                   settings: Optional[runner.Settings] = None, trace_path: Optional[str] = None) -> Dict:
+    """
+    makes a fake pano folder (see synthetic.py) and runs the whole pipeline on it, timing every stage
+    :param num_frames: frames in the sweep
+    :param width: columns in each frame
+    :param height: rows in each frame
+    :param settings: how to make the panorama, None for the defaults without the feature cache (so every run registers
+    from scratch). Rescaling runs in other processes, their memory isn't in peak_rss_mb
+    :param trace_path: save a chrome trace of every span here, None to not
+    :return: the timings, ready for json.dump()
+    """
+    if settings is None:
+        settings = runner.Settings(CACHE_DIRECTORY=None)
+    with tempfile.TemporaryDirectory() as tmp, instrument.recording() as recorder:
+        directory: str = os.path.join(tmp, "pano")
+        save_directory: str = os.path.join(tmp, "out")
+        os.makedirs(save_directory)
+        synthetic.make_pano_folder(directory, num_frames, width, height)
+        start: float = time.perf_counter()
+        runner.process_pano(directory, save_directory, settings)
+        total: float = time.perf_counter() - start
+    stages: Dict[str, Dict] = {s.name: {"secs": s.secs, "cpu_secs": s.cpu_secs, "peak_rss_mb": s.peak_rss_mb}
+                               for s in recorder.top_level()}
+    if trace_path is not None:
+        recorder.write_chrome_trace(trace_path)
+
+    print("\n{0} frames of {1}x{2}".format(num_frames, width, height))
+    recorder.print_summary()
+    print("{0:>22} {1:>6} {2:>9.3f}".format("total", "", total))
+    return {"commit": git_commit(), "frames": num_frames, "width": width, "height": height,
+            "settings": {name: getattr(settings, name) for name in dir(runner.Settings) if name.isupper()},
+            "stages": stages, "substages": recorder.totals(), "total_secs": total}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="timings for the slow parts of the pipeline")
+    parser.add_argument("--pipeline", action="store_true", help="only run the whole pipeline on a fake pano folder")
+    parser.add_argument("--frames", type=int, default=8, help="frames in the fake pano folder")
+    parser.add_argument("--width", type=int, default=320, help="columns in each fake frame")
+    parser.add_argument("--height", type=int, default=240, help="rows in each fake frame")
+    parser.add_argument("--json", help="save the pipeline timings to this file (for comparing commits)")
+    parser.add_argument("--trace", help="save a chrome trace of the pipeline to this file")
+    args = parser.parse_args()
+
+    if not args.pipeline:
+        bench_palette_lut()
+        bench_match_palette()
+        bench_all_palettes()
+        bench_mixed()
+        bench_compose_memory()
+    result: Dict = bench_pipeline(args.frames, args.width, args.height, trace_path=args.trace)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
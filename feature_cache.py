@@ -0,0 +1,213 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+on-disk cache for the slow registration steps of StitcherEasy.stitch()
+
+finding KAZE/ORB features and matching them takes most of the time of a stitch, but it only depends on the visible light
+images and the settings. Features are saved per image (keyed by a hash of the image and the finder settings) and the
+matches and adjusted camera params are saved per set of images, so re-stitching the same pano folder with a different
+palette or mixed image can skip straight to warping. Entries are .npz files, and when the cache gets bigger than its
+size limit the least recently used ones get deleted
+"""
+
+import os
+import hashlib
+import cv2
+import numpy as np
+from typing import Dict, List, Optional, Any
+
+DEFAULT_DIRECTORY: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".stitch_cache")  # works from any folder
+
+
+def image_hash(img: np.ndarray) -> str:
+    """
+    :param img: any image
+    :return: hash of the image's pixels and shape
+    """
+    h = hashlib.sha1(str(img.shape).encode())
+    h.update(np.ascontiguousarray(img).data)
+    return h.hexdigest()
+
+
+def make_key(*parts: Any) -> str:
+    """
+    :param parts: anything with a str() that describes it (hashes, settings, etc.)
+    :return: a name for a cache entry
+    """
+    return hashlib.sha1("|".join(str(p) for p in parts).encode()).hexdigest()
+
+
+def features_to_arrays(features: cv2.detail.ImageFeatures) -> Dict[str, np.ndarray]:
+    """
+    :param features: output of cv2.detail.computeImageFeatures2()
+    :return: dictionary of arrays that can be saved with np.savez
+    """
+    keypoints: np.ndarray = np.array([[k.pt[0], k.pt[1], k.size, k.angle, k.response, k.octave, k.class_id]
+                                      for k in features.keypoints], np.float64).reshape(-1, 7)
+    descriptors = features.descriptors
+    if isinstance(descriptors, cv2.UMat):
+        descriptors = descriptors.get()
+    return {"keypoints": keypoints, "descriptors": np.asarray(descriptors), "img_size": np.array(features.img_size)}
+
+
+def arrays_to_features(arrays: Dict[str, np.ndarray]) -> cv2.detail.ImageFeatures:
+    """
+    reverses features_to_arrays()
+    :param arrays: loaded cache entry
+    :return: image features that can be given to a matcher
+    """
+    # setting the descriptors of an ImageFeatures made with its constructor crashes opencv, so start from real (empty)
+    # features of a blank image and fill them in
+    features: cv2.detail.ImageFeatures = cv2.detail.computeImageFeatures2(cv2.ORB.create(),
+                                                                          np.zeros((8, 8, 3), np.uint8))
+    features.img_size = tuple(int(s) for s in arrays["img_size"])
+    features.keypoints = tuple(cv2.KeyPoint(x, y, size, angle, response, int(octave), int(class_id))
+                               for x, y, size, angle, response, octave, class_id in arrays["keypoints"])
+    features.descriptors = cv2.UMat(arrays["descriptors"])
+    return features
+
+
+def matches_to_arrays(matches_info: List[cv2.detail.MatchesInfo]) -> Dict[str, np.ndarray]:
+    """
+    :param matches_info: output of a matcher's apply2()
+    :return: dictionary of arrays that can be saved with np.savez (the matches of all pairs are stored end to end)
+    """
+    pairs: List[List[float]] = []
+    homographies: List[np.ndarray] = []
+    matches: List[List[float]] = []
+    inliers: List[np.ndarray] = []
+    for m in matches_info:
+        pairs.append([m.src_img_idx, m.dst_img_idx, m.confidence, m.num_inliers, len(m.matches)])
+        homographies.append(np.zeros((3, 3)) if m.H is None or np.size(m.H) == 0 else m.H)
+        matches.extend([d.queryIdx, d.trainIdx, d.imgIdx, d.distance] for d in m.matches)
+        inliers.append(np.array(m.inliers_mask, np.uint8).reshape(-1))
+    return {"pairs": np.array(pairs, np.float64).reshape(-1, 5),
+            "homographies": np.array(homographies, np.float64).reshape(-1, 3, 3),
+            "matches": np.array(matches, np.float64).reshape(-1, 4),
+            "inliers": np.concatenate(inliers) if len(inliers) > 0 else np.zeros(0, np.uint8)}
+
+
+def arrays_to_matches(arrays: Dict[str, np.ndarray]) -> List[cv2.detail.MatchesInfo]:
+    """
+    reverses matches_to_arrays()
+    :param arrays: loaded cache entry
+    :return: list of matches info that can be given to the camera estimator and adjuster
+    """
+    matches_info: List[cv2.detail.MatchesInfo] = []
+    start: int = 0
+    for (src, dst, confidence, num_inliers, num_matches), H in zip(arrays["pairs"], arrays["homographies"]):
+        end: int = start + int(num_matches)
+        m: cv2.detail.MatchesInfo = cv2.detail.MatchesInfo()
+        m.src_img_idx = int(src)
+        m.dst_img_idx = int(dst)
+        m.confidence = float(confidence)
+        m.num_inliers = int(num_inliers)
+        m.H = H if src >= 0 else np.zeros((0, 0))
+        m.matches = [cv2.DMatch(int(q), int(t), int(i), float(d)) for q, t, i, d in arrays["matches"][start:end]]
+        m.inliers_mask = arrays["inliers"][start:end]
+        matches_info.append(m)
+        start = end
+    return matches_info
+
+
+def cameras_to_arrays(cameras: List[cv2.detail.CameraParams]) -> Dict[str, np.ndarray]:
+    """
+    :param cameras: camera params from an estimator or adjuster
+    :return: dictionary of arrays that can be saved with np.savez
+    """
+    return {"intrinsics": np.array([[c.focal, c.aspect, c.ppx, c.ppy] for c in cameras], np.float64),
+            "R": np.array([c.R for c in cameras], np.float32),
+            "t": np.array([np.asarray(c.t, np.float64).reshape(3) for c in cameras])}
+
+
+def arrays_to_cameras(arrays: Dict[str, np.ndarray]) -> List[cv2.detail.CameraParams]:
+    """
+    reverses cameras_to_arrays()
+    :param arrays: loaded cache entry
+    :return: list of camera params
+    """
+    cameras: List[cv2.detail.CameraParams] = []
+    for (focal, aspect, ppx, ppy), R, t in zip(arrays["intrinsics"], arrays["R"], arrays["t"]):
+        cam: cv2.detail.CameraParams = cv2.detail.CameraParams()
+        cam.focal, cam.aspect, cam.ppx, cam.ppy = float(focal), float(aspect), float(ppx), float(ppy)
+        cam.R = R.astype(np.float32)
+        cam.t = t.reshape(3, 1)
+        cameras.append(cam)
+    return cameras
+
+
+class FeatureCache:
+    def __init__(self, directory: str = DEFAULT_DIRECTORY, max_bytes: int = 1 << 30):
+        """
+        :param directory: where the cache entries are kept, it is created if it does not exist
+        :param max_bytes: once the entries take up more space than this the least recently used ones are deleted
+        """
+        self.directory: str = directory
+        self.max_bytes: int = max_bytes
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, kind: str, key: str) -> str:
+        """
+        :param kind: "features", "matches", or "cameras"
+        :param key: output of make_key()
+        :return: path to the cache entry
+        """
+        return "{0}/{1}-{2}.npz".format(self.directory, kind, key)
+
+    def get(self, kind: str, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """
+        :param kind: "features", "matches", or "cameras"
+        :param key: output of make_key()
+        :return: the saved arrays, None if there is no entry
+        """
+        path: str = self.path(kind, key)
+        try:
+            with np.load(path) as f:
+                arrays: Dict[str, np.ndarray] = dict(f)
+        except (OSError, ValueError):  # not there (or half written by a process that crashed)
+            self.misses[kind] = self.misses.get(kind, 0) + 1
+            return None
+        os.utime(path)  # mark as recently used
+        self.hits[kind] = self.hits.get(kind, 0) + 1
+        return arrays
+
+    def put(self, kind: str, key: str, arrays: Dict[str, np.ndarray]) -> None:
+        """
+        saves an entry then makes sure the cache is not too big
+        :param kind: "features", "matches", or "cameras"
+        :param key: output of make_key()
+        :param arrays: what to save
+        """
+        path: str = self.path(kind, key)
+        tmp_path: str = "{0}.{1}.tmp.npz".format(path[:-len(".npz")], os.getpid())
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)  # other processes never see half a file
+        self.evict()
+
+    def entries(self) -> List[os.DirEntry]:
+        """:return: the finished cache entries (not the .tmp.npz files other processes are still writing in put())"""
+        return [e for e in os.scandir(self.directory) if e.name.endswith(".npz") and ".tmp." not in e.name]
+
+    def evict(self) -> None:
+        """deletes the least recently used entries until the cache fits in max_bytes"""
+        entries: List[os.DirEntry] = self.entries()
+        total: int = sum(e.stat().st_size for e in entries)
+        for e in sorted(entries, key=lambda e: e.stat().st_mtime):
+            if total <= self.max_bytes:
+                break
+            total -= e.stat().st_size
+            try:
+                os.remove(e.path)
+            except FileNotFoundError:  # another process got to it first
+                pass
+
+    def size(self) -> int:
+        """:return: bytes used by the cache entries"""
+        return sum(e.stat().st_size for e in self.entries())
+
+    def stats(self) -> Dict[str, Any]:
+        """:return: hits and misses of each kind of entry and the size of the cache"""
+        return {"hits": dict(self.hits), "misses": dict(self.misses), "bytes": self.size()}
@@ -0,0 +1,99 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+lazy loading of the frames of a pano folder
+
+instead of reading every vl, ir and mx image into memory up front, a FrameSource only knows the paths of the frames.
+Frames are read when they are asked for, and when looping over a FrameSource a pool of threads reads (and decodes) a few
+frames ahead of the one being used so that reading from disk happens at the same time as the work on earlier frames
+"""
+
+import os
+import re
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import util
+from typing import List, Iterator, Optional
+
+
+def discover_frames(directory: str, type_img: str) -> List[str]:
+    """
+    finds the frames of one type in a folder, like vl00.png, vl01.png, ..., vl44.png (any number of digits works)
+    :param directory: path to pano folder
+    :param type_img: "vl", "ir", or "mx"
+    :return: paths of the frames sorted by frame number
+    """
+    pattern = re.compile(r"^{0}(\d+)\.png$".format(re.escape(type_img)))
+    numbered: List = []
+    for name in os.listdir(directory):
+        match = pattern.match(name)
+        if match:
+            numbered.append((int(match.group(1)), os.path.join(directory, name)))
+    return [path for num, path in sorted(numbered)]
+
+
+class FrameSource:
+    """
+    a list of frames that are only read from disk when they are used. It can be indexed (frame_source[i]) and looped over
+    as many times as needed, but never holds on to the frames it reads
+    """
+    def __init__(self, paths: List[str], workers: int = 4, read_ahead: int = 8):
+        """
+        :param paths: image files in frame order
+        :param workers: number of threads reading frames while looping
+        :param read_ahead: most frames that are read before they are used while looping
+        """
+        self.paths: List[str] = list(paths)
+        self.workers: int = workers
+        self.read_ahead: int = read_ahead
+
+    @classmethod
+    def from_directory(cls, directory: str, type_img: str, num_imgs: Optional[int] = None, **kwargs) -> "FrameSource":
+        """
+        :param directory: path to pano folder
+        :param type_img: "vl", "ir", or "mx"
+        :param num_imgs: only use the first num_imgs frames, None for all of them
+        :return: FrameSource of the frames of that type in the folder
+        """
+        paths: List[str] = discover_frames(directory, type_img)
+        return cls(paths if num_imgs is None else paths[:num_imgs], **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        img: Optional[np.ndarray] = cv2.imread(self.paths[i])
+        if img is None:
+            raise IOError("could not read " + self.paths[i])
+        return img
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for img in util.imap_ordered(executor, self.__getitem__, range(len(self)), window=self.read_ahead):
+                yield img
+
+
+class ConvertedFrames:
+    """
+    the frames of another list of frames (or FrameSource) changed to another type, one at a time when each is used, so
+    that only the frame being worked on is ever held in the bigger type
+    """
+    def __init__(self, frames, dtype: np.dtype):
+        """
+        :param frames: list of frames or FrameSource
+        :param dtype: type to give each frame, like np.float64
+        """
+        self.frames = frames
+        self.dtype: np.dtype = dtype
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return np.asarray(self.frames[i], self.dtype)
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for img in self.frames:
+            yield np.asarray(img, self.dtype)
@@ -0,0 +1,202 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+spans for timing the stages of making a panorama
+
+wrap a stage in "with instrument.span("warp", frames=n):" and, while something is recording (see recording()), the
+wall time, cpu time, number of frames, megapixels and peak resident memory of that stage are kept. Spans can be nested
+(like "bundle adjust" inside "register") and opened from other threads. When nothing is recording a span costs two clock
+reads, so they are left in everywhere. The spans can be printed as a table, written as one json object per line, or
+saved as a chrome trace (open it at chrome://tracing or https://ui.perfetto.dev)
+
+peak memory is for the whole process: it is reset when a span starts on the main thread (linux only, elsewhere it is
+the peak since the process started) and each span reports the most that was in use while it was open. Work done in
+other processes (like rescale_all() with workers) isn't included
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import threading
+import contextlib
+import numpy as np
+from typing import Any, Dict, Iterator, List, Optional
+
+
+def peak_rss_mb() -> float:
+    """:return: most resident memory this process has used so far (or since reset_peak_rss()) in megabytes"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    max_rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return max_rss / (1024 * 1024)  # bytes on macos
+    return max_rss / 1024  # kilobytes on linux
+
+
+def reset_peak_rss() -> bool:
+    """
+    starts measuring the peak resident memory over again from what is in use right now (only works on linux)
+    :return: whether it could be reset, if not peak_rss_mb() keeps giving the peak since the process started
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def megapix(*imgs: np.ndarray) -> float:
+    """:return: total megapixels of the images"""
+    return sum(img.shape[0] * img.shape[1] for img in imgs) / 1e6
+
+
+class Span:
+    def __init__(self, name: str, parent: Optional["Span"], attrs: Dict[str, Any]):
+        """
+        :param name: like "warp"
+        :param parent: span this one was opened inside of (on the same thread), None if it is a top level span
+        :param attrs: anything else worth knowing about the stage, like frames=8 or megapix=12.5
+        """
+        self.name: str = name
+        self.parent: Optional[Span] = parent
+        self.depth: int = 0 if parent is None else parent.depth + 1
+        self.attrs: Dict[str, Any] = {k: v for k, v in attrs.items() if v is not None}
+        self.thread: int = threading.get_ident()
+        self.main_thread: bool = threading.current_thread() is threading.main_thread()
+        self.start: float = 0
+        self.secs: float = 0
+        self.cpu_secs: float = 0
+        self.peak_rss_mb: float = 0
+
+    def set(self, **attrs) -> None:
+        """adds to or changes the attributes, for things only known once the stage is running"""
+        self.attrs.update({k: v for k, v in attrs.items() if v is not None})
+
+    def as_dict(self) -> Dict[str, Any]:
+        """:return: the span as plain values (for json)"""
+        return {"name": self.name, "parent": None if self.parent is None else self.parent.name, "depth": self.depth,
+                "start": self.start, "secs": self.secs, "cpu_secs": self.cpu_secs, "peak_rss_mb": self.peak_rss_mb,
+                "thread": self.thread, **self.attrs}
+
+
+class Recorder:
+    """
+    keeps every span that ends while it is recording
+    """
+    def __init__(self):
+        self.spans: List[Span] = []
+        self.origin: float = time.perf_counter()
+        self.lock: threading.Lock = threading.Lock()
+
+    def add(self, s: Span) -> None:
+        with self.lock:
+            self.spans.append(s)
+
+    def top_level(self) -> List[Span]:
+        """:return: the spans on the main thread that weren't inside another span (the stages)"""
+        return [s for s in self.spans if s.parent is None and s.main_thread]
+
+    def totals(self) -> Dict[str, Dict[str, float]]:
+        """
+        :return: for each span name (in the order they first started) how many times it ran, the total wall and cpu
+        time and the highest peak memory
+        """
+        totals: Dict[str, Dict[str, float]] = {}
+        for s in sorted(self.spans, key=lambda s: s.start):
+            t: Dict[str, float] = totals.setdefault(s.name, {"count": 0, "secs": 0, "cpu_secs": 0, "peak_rss_mb": 0})
+            t["count"] += 1
+            t["secs"] += s.secs
+            t["cpu_secs"] += s.cpu_secs
+            t["peak_rss_mb"] = max(t["peak_rss_mb"], s.peak_rss_mb)
+        return totals
+
+    def print_summary(self) -> None:
+        """prints a table of totals()"""
+        print("{0:>22} {1:>6} {2:>9} {3:>9} {4:>9}".format("stage", "count", "secs", "cpu", "peak mb"))
+        for name, t in self.totals().items():
+            print("{0:>22} {1:>6} {2:>9.3f} {3:>9.3f} {4:>9.1f}".format(name, t["count"], t["secs"], t["cpu_secs"],
+                                                                        t["peak_rss_mb"]))
+
+    def write_log(self, path: str) -> None:
+        """
+        saves the spans as structured logs
+        :param path: file to write, one json object per span per line in the order they started
+        """
+        with open(path, "w") as f:
+            for s in sorted(self.spans, key=lambda s: s.start):
+                f.write(json.dumps(s.as_dict(), default=str) + "\n")
+
+    def write_chrome_trace(self, path: str) -> None:
+        """
+        saves the spans in the chrome trace event format
+        :param path: .json file to write
+        """
+        events: List[Dict[str, Any]] = [{
+            "name": s.name, "cat": "stage", "ph": "X", "pid": os.getpid(), "tid": s.thread,
+            "ts": s.start * 1e6, "dur": s.secs * 1e6,
+            "args": {"cpu_secs": s.cpu_secs, "peak_rss_mb": s.peak_rss_mb, **s.attrs}} for s in self.spans]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+
+_recorder: Optional[Recorder] = None
+_local: threading.local = threading.local()  # the innermost open span of each thread
+
+
+@contextlib.contextmanager
+def recording() -> Iterator[Recorder]:
+    """
+    keeps the spans of everything run inside the with block
+    :return: the Recorder the spans go to
+    """
+    global _recorder
+    previous: Optional[Recorder] = _recorder
+    _recorder = Recorder()
+    try:
+        yield _recorder
+    finally:
+        _recorder = previous
+
+
+@contextlib.contextmanager
+def span(name: str, frames: Optional[int] = None, megapix: Optional[float] = None, **attrs) -> Iterator[Span]:
+    """
+    times the code inside the with block
+    :param name: name of the stage, spans with the same name get added together in Recorder.totals()
+    :param frames: number of frames the stage works on
+    :param megapix: megapixels the stage works on
+    :param attrs: anything else to keep with the span
+    :return: the Span, call set() on it to add things that are only known later
+    """
+    recorder: Optional[Recorder] = _recorder
+    parent: Optional[Span] = getattr(_local, "span", None)
+    s: Span = Span(name, parent, dict(attrs, frames=frames, megapix=megapix))
+    if recorder is not None:
+        if parent is not None:
+            parent.peak_rss_mb = max(parent.peak_rss_mb, peak_rss_mb())  # before the reset loses it
+        if s.main_thread:
+            reset_peak_rss()
+    _local.span = s
+    cpu_clock = time.process_time if s.main_thread else time.thread_time  # the main thread counts its workers too
+    start, cpu_start = time.perf_counter(), cpu_clock()
+    try:
+        yield s
+    finally:
+        s.secs = time.perf_counter() - start
+        s.cpu_secs = cpu_clock() - cpu_start
+        _local.span = parent
+        if recorder is not None:
+            s.start = start - recorder.origin
+            s.peak_rss_mb = max(s.peak_rss_mb, peak_rss_mb())
+            if parent is not None:
+                parent.peak_rss_mb = max(parent.peak_rss_mb, s.peak_rss_mb)
+            recorder.add(s)
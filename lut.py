@@ -0,0 +1,330 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+color lookup tables for remapping whole images at once
+
+every (b, g, r) color is packed into a single 24-bit integer key, so instead of finding the unique colors of an image
+and looking each one up in a dictionary, an image can be remapped with one gather from a table indexed by those keys
+"""
+
+import os
+import hashlib
+import numpy as np
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Iterator
+from util import Color
+import util
+import palette_registry
+from palette_registry import pack_colors, unpack_colors
+
+NUM_KEYS: int = 1 << 24  # every possible packed (b, g, r) color
+CACHE_DIRECTORY: str = os.path.join(palette_registry.PALETTE_DIRECTORY, "cache")
+
+
+class ColorLUT:
+    """
+    maps colors to values (usually other colors) for an entire image in one vectorized pass
+
+    a table with one slot per possible packed color holds the position of the color's value (plus one, so that the
+    untouched zeros mean "not in the table"). The table is allocated with zeros so only the pages that are actually
+    written to take up memory.
+    """
+    def __init__(self, colors: np.ndarray, values: np.ndarray):
+        """
+        :param colors: array with shape (n, 3) of the colors to replace
+        :param values: array with n entries (scalars or arrays) to replace them with. If a color shows up more than
+        once the last value wins, just like building a dictionary from the pairs
+        """
+        keys: np.ndarray = pack_colors(np.asarray(colors).reshape(-1, 3))
+        self.values: np.ndarray = np.asarray(values)
+        self.table: np.ndarray = np.zeros(NUM_KEYS, np.uint16 if len(keys) < 65535 else np.uint32)
+        self.table[keys] = np.arange(1, len(keys) + 1)  # fancy assignment keeps the last of any repeated keys
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "ColorLUT":
+        """
+        :param d: keys are (b, g, r) tuples
+        :return: lookup table that does the same replacements as the dictionary
+        """
+        return cls(np.array(list(d.keys())), np.array(list(d.values())))
+
+    def lookup(self, arr: np.ndarray) -> np.ndarray:
+        """
+        finds the position of the value of each color
+        :param arr: array with shape (..., 3)
+        :return: array with shape arr.shape[:-1] of positions in self.values
+        """
+        idx: np.ndarray = self.table[pack_colors(arr)]
+        if not idx.all():
+            missing: np.ndarray = np.asarray(arr)[idx == 0][0]
+            raise KeyError(tuple(missing.tolist()))
+        return idx - 1
+
+    def apply(self, arr: np.ndarray) -> np.ndarray:
+        """
+        replaces every color in arr with its value
+        :param arr: array with shape (..., 3), every color in it must be in the table
+        :return: array with shape arr.shape[:-1] + the shape of one value
+        """
+        return self.values[self.lookup(arr)]
+
+
+@lru_cache(maxsize=32)
+def palette_lut(old_palette_name: str, new_palette_name: str, mode: str = "stretch") -> ColorLUT:
+    """
+    builds (once) the table that converts an image from one palette to another
+    :param old_palette_name: like "iron.pal"
+    :param new_palette_name: like "lava.pal"
+    :param mode: how palettes of different lengths are lined up, one of palette_registry.RESAMPLE_MODES
+    :return: lookup table from colors of the old palette to colors of the new palette
+    """
+    old_colors, new_colors = palette_registry.conversion_colors(palette_registry.get_palette(old_palette_name),
+                                                                palette_registry.get_palette(new_palette_name), mode)
+    return ColorLUT(old_colors, new_colors)
+
+
+class PaletteRenderer:
+    """
+    renders one ir image in many palettes (like the preview set of a panorama)
+
+    the image is turned into indexes of the colors of its palette once, after that each palette is a gather from a
+    table with one row per color of the old palette, the same colors change_palette() would give
+    """
+    def __init__(self, img: np.ndarray, palette_name: Optional[str] = None):
+        """
+        :param img: b, g, r image that only uses colors of one palette
+        :param palette_name: palette of img like "iron.pal", None to figure it out
+        """
+        if palette_name is None:
+            palette_name = palette_identifier().identify(img)[0]
+            if palette_name is None:
+                raise ValueError("could not identify the palette of the image")
+        self.palette_name: str = palette_name
+        keys: np.ndarray = palette_registry.get_palette(palette_name).sorted_keys
+        self.colors: np.ndarray = unpack_colors(keys)  # each color of the palette once
+        self.index: np.ndarray = ColorLUT(self.colors, np.arange(len(keys))).lookup(img).astype(np.uint8)
+
+    def table(self, new_palette_name: str, mode: str = "stretch") -> np.ndarray:
+        """
+        :param new_palette_name: like "lava.pal"
+        :param mode: see palette_lut()
+        :return: uint8 array with shape (number of colors, 3) of the new color of each of self.colors
+        """
+        return palette_lut(self.palette_name, new_palette_name, mode).apply(self.colors)
+
+    def render(self, new_palette_name: str, mode: str = "stretch") -> np.ndarray:
+        """
+        :param new_palette_name: like "lava.pal"
+        :param mode: see palette_lut()
+        :return: the image in the new palette
+        """
+        return np.take(self.table(new_palette_name, mode), self.index, axis=0)
+
+    def render_many(self, palette_names: List[str] = util.PALETTES,
+                    mode: str = "stretch") -> Iterator[Tuple[str, np.ndarray]]:
+        """
+        :param palette_names: palettes to render, like util.PALETTES
+        :param mode: see palette_lut()
+        :return: iterator of (palette name, image in that palette), each image is only made when it is asked for
+        """
+        tables: np.ndarray = np.stack([self.table(name, mode) for name in palette_names])
+        for name, table in zip(palette_names, tables):
+            yield name, np.take(table, self.index, axis=0)
+
+
+class NearestColorIndex:
+    """
+    finds the closest palette color (smallest sum of absolute differences of b, g and r, ties go to the first color in
+    the palette -- the same as util.get_palette_color_match()) for many colors at once
+
+    the answer for every color that has ever been asked about is kept in a table with one slot per packed color, so
+    the distances only get calculated for colors that have never been seen before. The table can be saved to and
+    loaded from a file so the work carries over between runs
+    """
+    CHUNK_SIZE: int = 1 << 14  # number of colors compared against the palette at a time
+
+    def __init__(self, palette: List[Color], cache_path: Optional[str] = None):
+        """
+        :param palette: output of util.palette_to_bgr()
+        :param cache_path: .npz file the table gets saved to and loaded from, None to keep it in memory only
+        """
+        self.palette: np.ndarray = np.array(palette, np.uint8)
+        self.cache_path: Optional[str] = cache_path
+        self.table: np.ndarray = np.zeros(NUM_KEYS, np.uint16)  # palette index + 1, 0 means not calculated yet
+        self.changed: bool = False  # whether there are entries that have not been saved
+        if cache_path is not None and os.path.isfile(cache_path):
+            self.load()
+
+    def calc_nearest(self, colors: np.ndarray) -> np.ndarray:
+        """
+        brute force search of the palette
+        :param colors: array with shape (n, 3)
+        :return: index in the palette of the closest color for each of the colors
+        """
+        pal: np.ndarray = self.palette.astype(np.int16)
+        colors = np.asarray(colors).astype(np.int16)
+        nearest: np.ndarray = np.empty(len(colors), np.intp)
+        for start in range(0, len(colors), self.CHUNK_SIZE):
+            chunk: np.ndarray = colors[start:start + self.CHUNK_SIZE]
+            differences: np.ndarray = np.abs(chunk[:, np.newaxis, :] - pal[np.newaxis, :, :]).sum(axis=2)
+            nearest[start:start + self.CHUNK_SIZE] = np.argmin(differences, axis=1)  # argmin picks the first of ties
+        return nearest
+
+    def missing(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        works out the entries that aren't in the table yet without adding them
+        :param keys: packed b, g, r colors
+        :return: each key that isn't in the table once, index in the palette of the closest color to each of them
+        """
+        new_keys: np.ndarray = np.unique(keys[self.table[keys] == 0])
+        return new_keys, self.calc_nearest(unpack_colors(new_keys))
+
+    def add(self, keys: np.ndarray, nearest: np.ndarray) -> None:
+        """
+        puts entries into the table, like the ones missing() found in another process
+        :param keys: packed b, g, r colors
+        :param nearest: index in the palette of the closest color to each of them
+        """
+        if len(keys) > 0:
+            self.table[keys] = np.asarray(nearest) + 1
+            self.changed = True
+
+    def query(self, colors: np.ndarray) -> np.ndarray:
+        """
+        :param colors: array with shape (..., 3) of b, g, r colors
+        :return: array with shape colors.shape[:-1] of the palette index of the closest color to each color
+        """
+        keys: np.ndarray = pack_colors(colors)
+        idx: np.ndarray = self.table[keys]
+        if not idx.all():
+            self.add(*self.missing(keys))
+            idx = self.table[keys]
+        return idx.astype(np.intp) - 1
+
+    def snap(self, img: np.ndarray) -> np.ndarray:
+        """
+        :param img: b, g, r image
+        :return: uint8 image where every color has been replaced by the closest palette color
+        """
+        return self.palette[self.query(img)]
+
+    def save(self) -> None:
+        """writes every calculated entry of the table to self.cache_path"""
+        if self.cache_path is None or not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        keys: np.ndarray = np.flatnonzero(self.table).astype(np.uint32)
+
+        # write to a temporary file then swap it in so other processes never see half a file
+        tmp_path: str = "{0}.{1}.tmp.npz".format(self.cache_path[:-len(".npz")], os.getpid())
+        np.savez(tmp_path, palette=self.palette, keys=keys, idx=self.table[keys])
+        os.replace(tmp_path, self.cache_path)
+        self.changed = False
+
+    def load(self) -> None:
+        """fills the table from self.cache_path (if it was made for this same palette)"""
+        with np.load(self.cache_path) as f:
+            if np.array_equal(f["palette"], self.palette):
+                self.table[f["keys"]] = f["idx"]
+
+
+_nearest_indexes: Dict[bytes, NearestColorIndex] = {}
+
+
+def nearest_color_index(palette: List[Color]) -> NearestColorIndex:
+    """
+    gives the same NearestColorIndex for the same palette every time it is called (and loads whatever was saved on
+    disk the first time)
+    :param palette: output of util.palette_to_bgr()
+    :return: index for finding the closest colors in the palette
+    """
+    key: bytes = np.array(palette, np.uint8).tobytes()
+    if key not in _nearest_indexes:
+        name: str = hashlib.sha1(key).hexdigest()[:12]
+        _nearest_indexes[key] = NearestColorIndex(palette, "{0}/nearest-{1}.npz".format(CACHE_DIRECTORY, name))
+    return _nearest_indexes[key]
+
+
+class PaletteIdentifier:
+    """
+    figures out which palette an image uses
+
+    an inverted index holds, for every packed color, a bitmask of the palettes that contain that color. Looking up
+    every pixel (or a sample of them) and counting the bits gives how much of the image each palette explains
+    """
+    def __init__(self, palette_names: List[str] = util.PALETTES):
+        """
+        :param palette_names: files in palettes/ like "iron.pal"
+        """
+        self.palette_names: List[str] = list(palette_names)
+        self.table: np.ndarray = np.zeros(NUM_KEYS, np.uint16)
+        for bit, name in enumerate(self.palette_names):
+            keys: np.ndarray = palette_registry.get_palette(name).keys
+            self.table[keys] |= 1 << bit
+
+        # for each possible bitmask, which palettes are in it
+        masks: np.ndarray = np.arange(1 << len(self.palette_names))
+        self.mask_bits: np.ndarray = (masks[:, np.newaxis] >> np.arange(len(self.palette_names))) & 1
+
+    def scores(self, img: np.ndarray, sample_size: Optional[int] = None, seed: int = 0) -> np.ndarray:
+        """
+        :param img: b, g, r image
+        :param sample_size: only look at this many randomly chosen pixels, None to look at all of them
+        :param seed: for choosing the sample, so the same image always gets the same answer
+        :return: for each palette the fraction of the (sampled) pixels whose color is in that palette
+        """
+        keys: np.ndarray = pack_colors(img).reshape(-1)
+        if sample_size is not None and sample_size < len(keys):
+            keys = keys[np.random.default_rng(seed).choice(len(keys), sample_size, replace=False)]
+        if len(keys) == 0:
+            return np.zeros(len(self.palette_names))
+        counts: np.ndarray = np.bincount(self.table[keys], minlength=len(self.mask_bits))
+        return (counts @ self.mask_bits) / len(keys)
+
+    def identify(self, img: np.ndarray, sample_size: Optional[int] = None,
+                 min_confidence: float = 1.0) -> Tuple[Optional[str], float]:
+        """
+        :param img: b, g, r image
+        :param sample_size: only look at this many randomly chosen pixels, None to look at all of them
+        :param min_confidence: fraction of the pixels the palette has to contain. The default of 1.0 means every
+        color of the image must be in the palette
+        :return: (filename of palette e.g. "iron.pal", fraction of pixels whose colors are in it). The name is None if
+        no palette reaches min_confidence or if more than one palette is tied for the best
+        """
+        scores: np.ndarray = self.scores(img, sample_size)
+        best: float = float(scores.max())
+        if best < min_confidence or best == 0 or np.count_nonzero(scores == best) > 1:
+            return None, best
+        return self.palette_names[int(np.argmax(scores))], best
+
+    def identify_many(self, imgs: List[np.ndarray], sample_size: Optional[int] = None,
+                      min_confidence: float = 1.0) -> List[Tuple[Optional[str], float]]:
+        """
+        identify() for each image
+        :param imgs: b, g, r images
+        :param sample_size: see identify()
+        :param min_confidence: see identify()
+        :return: list of (palette name or None, confidence) in the same order as imgs
+        """
+        return [self.identify(img, sample_size, min_confidence) for img in imgs]
+
+
+@lru_cache(maxsize=1)
+def palette_identifier() -> PaletteIdentifier:
+    """
+    :return: identifier for all of util.PALETTES, only built the first time this is called
+    """
+    return PaletteIdentifier()
+
+
+def identify_palettes(imgs: List[np.ndarray], sample_size: Optional[int] = None,
+                      min_confidence: float = 1.0) -> List[Optional[str]]:
+    """
+    figures out the palette of many images (like all the frames of a pano) at once
+    :param imgs: b, g, r images
+    :param sample_size: see PaletteIdentifier.identify()
+    :param min_confidence: see PaletteIdentifier.identify()
+    :return: palette name (or None if it is ambiguous or there is no match) for each image
+    """
+    return [name for name, confidence in palette_identifier().identify_many(imgs, sample_size, min_confidence)]
@@ -0,0 +1,141 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+remembers what each stage of making a pano folder's panoramas was made from, so a rerun only redoes what changed
+
+each pano folder gets a manifest.json with the hash of every input file (vl, ir, mx frames and info.json) and, for each
+stage, a key made from the hashes of what went into it (input files, the outputs of earlier stages and the settings it
+uses) and the hash of what came out. The outputs are kept as .npz files named by their hash. When a stage's key is the
+same as last time its output is read back instead of being made again, so changing just the new palette or the mixed
+image of a finished sweep skips rescaling, registering and blending. Since later stages are keyed by the hash of what
+earlier stages made (and not by how), redoing a stage that comes out the same doesn't redo the stages after it
+
+only the latest output of each stage is kept, so the folder never holds more than one set of intermediates. Those are
+still full resolution frames and panoramas, so they are saved compressed (they take up about as much disk space as the
+pngs of the pano folder)
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+import feature_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def file_hash(path: str) -> str:
+    """:return: hash of the bytes of a file"""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def arrays_hash(arrays: Dict[str, np.ndarray]) -> str:
+    """:return: hash of the names, types, shapes and contents of the arrays"""
+    return feature_cache.make_key(*["{0}:{1}:{2}".format(name, arrays[name].dtype, feature_cache.image_hash(arrays[name]))
+                                    for name in sorted(arrays)])
+
+
+class Manifest:
+    def __init__(self, directory: Optional[str]):
+        """
+        :param directory: folder for manifest.json and the stage outputs (made if it doesn't exist), None to not keep
+        anything (every stage always runs)
+        """
+        self.directory: Optional[str] = directory
+        self.data: Dict[str, Any] = {"inputs": {}, "stages": {}, "saved": {}}
+        self.hits: List[str] = []
+        self.misses: List[str] = []
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            try:
+                with open(self.path()) as f:
+                    self.data.update(json.load(f))
+            except (OSError, ValueError):  # no manifest yet (or a broken one), start over
+                pass
+
+    def path(self) -> str:
+        return os.path.join(self.directory, "manifest.json")
+
+    def object_path(self, output_hash: str) -> str:
+        return os.path.join(self.directory, output_hash + ".npz")
+
+    def write(self) -> None:
+        """saves manifest.json (never half written)"""
+        tmp_path: str = "{0}.{1}.tmp".format(self.path(), os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(tmp_path, self.path())
+
+    def input_hashes(self, paths: List[str]) -> List[str]:
+        """
+        :param paths: input files
+        :return: hash of each file. A file is only read again if its size or modification time changed since the last
+        time it was hashed (empty strings if nothing is kept)
+        """
+        if self.directory is None:
+            return ["" for path in paths]
+        hashes: List[str] = []
+        for path in paths:
+            stat: os.stat_result = os.stat(path)
+            known: Optional[List] = self.data["inputs"].get(os.path.abspath(path))
+            if known is None or known[:2] != [stat.st_size, stat.st_mtime_ns]:
+                known = [stat.st_size, stat.st_mtime_ns, file_hash(path)]
+                self.data["inputs"][os.path.abspath(path)] = known
+            hashes.append(known[2])
+        return hashes
+
+    def run(self, stage: str, inputs: List[str], settings: Dict[str, Any],
+            make: Callable[[], Dict[str, np.ndarray]]) -> Tuple[Dict[str, np.ndarray], str]:
+        """
+        gives the output of a stage, only running it if what it depends on changed
+        :param stage: name of the stage, like "rescale"
+        :param inputs: hashes of the input files and earlier stage outputs it uses
+        :param settings: settings that change its output (anything json can write)
+        :param make: runs the stage, returns its output as a dictionary of arrays
+        :return: the output, hash of the output (to pass on as an input of later stages)
+        """
+        if self.directory is None:
+            return make(), ""
+        key: str = feature_cache.make_key(stage, json.dumps(settings, sort_keys=True), *inputs)
+        previous: Optional[Dict[str, str]] = self.data["stages"].get(stage)
+        if previous is not None and previous["key"] == key and os.path.isfile(self.object_path(previous["output"])):
+            with np.load(self.object_path(previous["output"])) as f:
+                arrays: Dict[str, np.ndarray] = {name: f[name] for name in f.files}
+            self.hits.append(stage)
+            return arrays, previous["output"]
+
+        arrays = make()
+        output: str = arrays_hash(arrays)
+        if not os.path.isfile(self.object_path(output)):
+            tmp_path: str = os.path.join(self.directory, "{0}.{1}.tmp.npz".format(output, os.getpid()))
+            np.savez_compressed(tmp_path, **arrays)
+            os.replace(tmp_path, self.object_path(output))
+        self.data["stages"][stage] = {"key": key, "output": output, "settings": settings}
+        if previous is not None and previous["output"] != output and \
+                all(s["output"] != previous["output"] for s in self.data["stages"].values()):
+            os.remove(self.object_path(previous["output"]))  # nothing uses the old output anymore
+        self.write()
+        self.misses.append(stage)
+        return arrays, output
+
+    def needs_saving(self, path: str, output: str) -> bool:
+        """
+        :param path: file a stage output gets saved to
+        :param output: hash of the stage output
+        :return: whether the file has to be written, False if it was already written from this output and hasn't changed
+        """
+        if self.directory is None or not os.path.isfile(path):
+            return True
+        stat: os.stat_result = os.stat(path)
+        return self.data["saved"].get(os.path.abspath(path)) != [output, stat.st_size, stat.st_mtime_ns]
+
+    def saved(self, path: str, output: str) -> None:
+        """remembers that a file was written from a stage output"""
+        if self.directory is not None:
+            stat: os.stat_result = os.stat(path)
+            self.data["saved"][os.path.abspath(path)] = [output, stat.st_size, stat.st_mtime_ns]
+            self.write()
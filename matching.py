@@ -0,0 +1,142 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+decides which pairs of frames get matched when registering a sweep
+
+the frames of a pano are taken in order, so each frame only needs to be matched with the next few frames (a band)
+instead of with every other frame. When a pair of neighbours doesn't match well enough, pairs that skip over that spot
+are matched too (one step wider at a time) until something bridges it, so one blurry frame doesn't break the whole
+panorama and the number of pairs matched stays close to the number of frames
+"""
+
+import time
+import cv2
+import numpy as np
+from typing import List, Dict, Tuple, Set, Any
+
+
+def band_pairs(num_images: int, band: int = 1, wrap: bool = False) -> Set[Tuple[int, int]]:
+    """
+    :param num_images: number of frames
+    :param band: each frame is paired with this many frames after it
+    :param wrap: also pair the last frames with the first ones (for sweeps that go all the way around)
+    :return: set of (i, j) with i < j
+    """
+    pairs: Set[Tuple[int, int]] = set()
+    for i in range(num_images):
+        for d in range(1, band + 1):
+            j: int = i + d
+            if j < num_images:
+                pairs.add((i, j))
+            elif wrap and j - num_images < i:
+                pairs.add((j - num_images, i))
+    return pairs
+
+
+def pairs_to_mask(num_images: int, pairs: Set[Tuple[int, int]]) -> np.ndarray:
+    """
+    :param num_images: number of frames
+    :param pairs: (i, j) with i < j
+    :return: uint8 matching mask for a cv2 features matcher (it only looks at the upper triangle)
+    """
+    mask: np.ndarray = np.zeros((num_images, num_images), np.uint8)
+    for i, j in pairs:
+        mask[i, j] = 1
+    return mask
+
+
+class MatchPlanner:
+    def __init__(self, band: int = 1, wrap: bool = False, min_confidence: float = 1.0, max_band: int = 3):
+        """
+        :param band: each frame is matched with this many frames after it
+        :param wrap: also match the end of the sweep with the start (for 360 degree panoramas)
+        :param min_confidence: neighbours that match with less confidence than this count as a weak link (the bundle
+        adjuster ignores pairs below 1)
+        :param max_band: weak links are bridged by matching frames up to this far apart, set to band for no fallback
+        """
+        self.band: int = band
+        self.wrap: bool = wrap
+        self.min_confidence: float = min_confidence
+        self.max_band: int = max(band, max_band)
+        self.report: List[Dict[str, Any]] = []
+        self.secs: float = 0
+        self.weak: Set[int] = set()  # links that were still weak after the last match()
+
+    def settings(self) -> Tuple:
+        """:return: everything that changes which pairs get matched (for cache keys)"""
+        return self.band, self.wrap, self.min_confidence, self.max_band
+
+    def confident(self, matches_info: List[cv2.detail.MatchesInfo], num_images: int, i: int, j: int) -> bool:
+        """:return: whether frames i and j matched well enough"""
+        return matches_info[i * num_images + j].confidence >= self.min_confidence
+
+    def steps(self, i: int, j: int, num_images: int) -> range:
+        """
+        :return: the links (k, k + 1) a pair skips over, as the k of each. A pair that wraps around skips over the end
+        """
+        if self.wrap and j - i > num_images // 2:
+            return range(j, i + num_images)  # k past the end means the link (k - n, k - n + 1)
+        return range(i, j)
+
+    def weak_links(self, matches_info: List[cv2.detail.MatchesInfo], num_images: int,
+                   matched: Set[Tuple[int, int]]) -> Set[int]:
+        """
+        :return: k of every link (k, k + 1) that no confident pair in matched spans
+        """
+        links: List[int] = list(range(num_images - 1)) + ([num_images - 1] if self.wrap else [])
+        bridged: Set[int] = set()
+        for i, j in matched:
+            if self.confident(matches_info, num_images, i, j):
+                bridged.update(k % num_images for k in self.steps(i, j, num_images))
+        return set(links) - bridged
+
+    def match(self, matcher: cv2.detail.FeaturesMatcher, features: List[cv2.detail.ImageFeatures]) \
+            -> List[cv2.detail.MatchesInfo]:
+        """
+        matches the band, then bridges weak links with wider pairs
+        :param matcher: like cv2.detail.BestOf2NearestMatcher_create()
+        :param features: features of every frame in order
+        :return: matches info for every pair of frames (n * n of them, the pairs that weren't matched are empty)
+        """
+        start: float = time.time()
+        n: int = len(features)
+        matched: Set[Tuple[int, int]] = band_pairs(n, self.band, self.wrap)
+        matches_info: List[cv2.detail.MatchesInfo] = list(matcher.apply2(features, pairs_to_mask(n, matched)))
+        band_of: Dict[Tuple[int, int], int] = {p: self.band for p in matched}
+
+        for band in range(self.band + 1, self.max_band + 1):
+            weak: Set[int] = self.weak_links(matches_info, n, matched)
+            if len(weak) == 0:
+                break
+            print("weak links between frames", ", ".join("{0}-{1}".format(k, (k + 1) % n) for k in sorted(weak)),
+                  "-- matching frames", band, "apart")
+            new_pairs: Set[Tuple[int, int]] = set()
+            for i, j in band_pairs(n, band, self.wrap) - matched:
+                if any(k % n in weak for k in self.steps(i, j, n)):
+                    new_pairs.add((i, j))
+            if len(new_pairs) == 0:
+                continue
+            wider: List[cv2.detail.MatchesInfo] = matcher.apply2(features, pairs_to_mask(n, new_pairs))
+            for i, j in new_pairs:
+                matches_info[i * n + j] = wider[i * n + j]
+                matches_info[j * n + i] = wider[j * n + i]
+                band_of[(i, j)] = band
+            matched |= new_pairs
+        matcher.collectGarbage()
+
+        self.weak = self.weak_links(matches_info, n, matched)
+        self.secs = time.time() - start
+        self.report = [{"pair": (i, j), "confidence": matches_info[i * n + j].confidence,
+                        "num_inliers": matches_info[i * n + j].num_inliers, "band": band_of[(i, j)]}
+                       for i, j in sorted(matched)]
+        return matches_info
+
+    def print_report(self) -> None:
+        """prints the confidence of each matched pair and how long matching took"""
+        print("{0:>8} {1:>11} {2:>8} {3:>5}".format("pair", "confidence", "inliers", "band"))
+        for r in self.report:
+            weak: str = "" if r["confidence"] >= self.min_confidence else "  <- weak"
+            print("{0:>8} {1:>11.3f} {2:>8} {3:>5}{4}".format("{0}-{1}".format(*r["pair"]), r["confidence"],
+                                                          r["num_inliers"], r["band"], weak))
+        print("matched {0} pairs in {1:.2f} secs".format(len(self.report), self.secs))
@@ -0,0 +1,180 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+makes the mixed ir/vl images of Image.create_mx(), create_mx2() and create_mx3() for whole panoramas
+
+all three come from the same few things worked out from the vl image: a blurred copy, its gray version, the adaptive
+threshold mask and the edges/contours. MixedImages works each of them out once (the first time it is needed) and then
+any number of mixed images can be made from them, instead of create_mx3() blurring the vl image twice
+
+blurring is by far the slowest part. The panorama is split into tiles of columns that overlap by as much as the filter
+reaches, the tiles are blurred by a pool of threads (opencv lets go of the GIL) and the middles are put back together,
+which comes out exactly the same as blurring the whole thing at once. Edges and contours are found on the whole
+panorama so they don't stop at the tile edges
+
+filters:
+    "bilateral" -- cv2.bilateralFilter(img, 7, 50, 50) like Image.get_blurred(), the same as the original functions
+    "guided"    -- guided filter (the image guiding itself) built from box filters, also keeps edges sharp but takes
+                   about the same time no matter how strong it is. Looks very close but not exactly the same
+    "box"       -- plain 7x7 average, the fastest and blurs edges too
+"""
+
+import os
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+FILTERS: List[str] = ["bilateral", "guided", "box"]
+VARIANTS: List[str] = ["mx", "mx2", "mx3"]
+DIAMETER: int = 7  # of the bilateral filter, the box filters use the same size
+SIGMA: float = 50  # bilateral color and space sigma, the guided filter's eps is this squared
+# opencv filters most of a row in groups of columns with simd and the few left over at the end one at a time, which can
+# round differently. Tiles start on a multiple of this and are a multiple of it wide so the left over columns are in the
+# part that gets thrown away (or are the same ones as in the whole image)
+ALIGN: int = 64
+
+
+def guided_filter(img: np.ndarray, radius: int = DIAMETER // 2, eps: float = SIGMA ** 2) -> np.ndarray:
+    """
+    edge preserving smoothing with each channel guiding itself (He et al. 2010)
+    :param img: uint8 image
+    :param radius: half of the box size
+    :param eps: bigger smooths over stronger edges
+    :return: uint8 image
+    """
+    size = (2 * radius + 1, 2 * radius + 1)
+    i: np.ndarray = img.astype(np.float32)
+    mean: np.ndarray = cv2.blur(i, size)
+    variance: np.ndarray = cv2.blur(i * i, size) - mean * mean
+    a: np.ndarray = variance / (variance + eps)
+    b: np.ndarray = mean - a * mean
+    return np.clip(np.round(cv2.blur(a, size) * i + cv2.blur(b, size)), 0, 255).astype(np.uint8)
+
+
+def filter_function(name: str) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    :param name: one of FILTERS
+    :return: function that blurs an image
+    """
+    if name == "bilateral":
+        return lambda img: cv2.bilateralFilter(img, DIAMETER, SIGMA, SIGMA)
+    if name == "guided":
+        return guided_filter
+    if name == "box":
+        return lambda img: cv2.blur(img, (DIAMETER, DIAMETER))
+    raise ValueError("filter must be one of {0}, not {1}".format(FILTERS, name))
+
+
+def filter_margin(name: str) -> int:
+    """:return: how many pixels away the filter looks, so tiles have to overlap by this much"""
+    return 2 * (DIAMETER // 2) if name == "guided" else DIAMETER // 2  # the guided filter is two box filters in a row
+
+
+def filter_tiled(img: np.ndarray, fn: Callable[[np.ndarray], np.ndarray], margin: int, tile_width: int = 2048,
+                 workers: Optional[int] = None) -> np.ndarray:
+    """
+    runs a filter on tiles of columns at the same time
+    :param img: any image
+    :param fn: filter that only looks margin pixels away from each pixel
+    :param margin: how far the tiles overlap
+    :param tile_width: columns in a tile (not counting the overlap)
+    :param workers: number of threads, None for one per cpu
+    :return: the same as fn(img)
+    """
+    width: int = img.shape[1]
+    if width <= tile_width:
+        return fn(img)
+    out: np.ndarray = np.empty_like(img)
+
+    def run(x: int) -> None:
+        start: int = max(0, x - margin) // ALIGN * ALIGN
+        end: int = min(width, start + -(-(x + tile_width + margin - start) // ALIGN) * ALIGN)
+        filtered: np.ndarray = fn(img[:, start:end])
+        out[:, x:min(width, x + tile_width)] = filtered[:, x - start:x - start + min(tile_width, width - x)]
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        list(executor.map(run, range(0, width, tile_width)))
+    return out
+
+
+class MixedImages:
+    def __init__(self, vl: np.ndarray, filter_name: str = "bilateral", tile_width: int = 2048,
+                 workers: Optional[int] = None):
+        """
+        :param vl: visible light panorama (uint8 b, g, r)
+        :param filter_name: one of FILTERS
+        :param tile_width: columns blurred by each thread at a time
+        :param workers: number of threads blurring, None for one per cpu
+        """
+        self.vl: np.ndarray = vl
+        self.filter_name: str = filter_name
+        self.filter: Callable[[np.ndarray], np.ndarray] = filter_function(filter_name)
+        self.tile_width: int = tile_width
+        self.workers: Optional[int] = workers
+        self._blurred: Optional[np.ndarray] = None
+        self._mask: Optional[np.ndarray] = None
+        self._edges: Optional[np.ndarray] = None
+        self._contours: Optional[List[np.ndarray]] = None
+
+    @property
+    def blurred(self) -> np.ndarray:
+        """the vl image blurred with the filter (Image.get_blurred() for "bilateral")"""
+        if self._blurred is None:
+            self._blurred = filter_tiled(self.vl, self.filter, filter_margin(self.filter_name), self.tile_width,
+                                         self.workers)
+        return self._blurred
+
+    @property
+    def mask(self) -> np.ndarray:
+        """0 on the dark lines of the vl image that get drawn onto the ir image, 255 everywhere else"""
+        if self._mask is None:
+            self._mask = cv2.adaptiveThreshold(cv2.cvtColor(self.blurred, cv2.COLOR_BGR2GRAY), 255,
+                                               cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 3, 1)
+        return self._mask
+
+    @property
+    def edges(self) -> np.ndarray:
+        """canny edges of the blurred vl image, thresholds from the median of the vl image (see Image.calc_edges())"""
+        if self._edges is None:
+            sigma: float = 1.0
+            v = np.median(self.vl)
+            lower = int(max(0, (1.0 - sigma) * v))
+            upper = int(min(255, (1.0 + sigma) * v))
+            self._edges = cv2.Canny(self.blurred, lower, upper)
+        return self._edges
+
+    @property
+    def contours(self) -> List[np.ndarray]:
+        """outer contours of the edges"""
+        if self._contours is None:
+            self._contours = cv2.findContours(self.edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+        return self._contours
+
+    def mx(self, ir: np.ndarray) -> np.ndarray:
+        """:return: what Image.create_mx() makes, the ir colors with the dark lines of the vl image"""
+        with_black: np.ndarray = cv2.bitwise_and(ir, ir, mask=self.mask)
+        return cv2.addWeighted(with_black, .4, ir, .6, 0)
+
+    def mx2(self, ir: np.ndarray) -> np.ndarray:
+        """:return: what Image.create_mx2() makes, mostly ir with some vl on top"""
+        return cv2.addWeighted(self.vl, .2, ir, .8, 0)
+
+    def mx3(self, ir: np.ndarray) -> np.ndarray:
+        """:return: what Image.create_mx3() makes, mx() with the contours of the vl image drawn in white"""
+        with_contours: np.ndarray = ir.copy()
+        cv2.drawContours(with_contours, self.contours, -1, (255, 255, 255), 1)
+        return self.mx(with_contours)
+
+    def make(self, ir: np.ndarray, variants: List[str] = VARIANTS) -> Dict[str, np.ndarray]:
+        """
+        :param ir: ir panorama the same size as the vl one
+        :param variants: which of VARIANTS to make
+        :return: dictionary from variant to mixed image
+        """
+        functions: Dict[str, Callable[[np.ndarray], np.ndarray]] = {"mx": self.mx, "mx2": self.mx2, "mx3": self.mx3}
+        for v in variants:
+            if v not in functions:
+                raise ValueError("mixed image variants are {0}, not {1}".format(VARIANTS, v))
+        return {v: functions[v](ir) for v in variants}
@@ -0,0 +1,229 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+every .pal file in palettes/ read and converted to b, g, r once
+
+a .pal file has one YCbCr color per line. The first time a palette is asked for, the whole folder is converted at once
+(or read back from a binary cache file written the last time) and kept in memory as uint8 arrays along with the packed
+keys of its colors, a sorted inverse map from color to index, and resampled copies for converting between palettes of
+different lengths
+
+resampling modes:
+    "stretch" -- what change_palette() has always done (util.stretch_list()): each color is repeated the same number of
+                 times and the leftover spots at the end get the next color. Only makes palettes longer
+    "nearest" -- spreads the colors evenly over the new length and picks the closest one, works for longer and shorter
+    "linear"  -- like nearest but blends the two closest colors, so the result can have colors that are not in the file
+"""
+
+import os
+import numpy as np
+from util import Color
+import util
+from typing import Dict, List, Optional, Tuple
+
+PALETTE_DIRECTORY: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "palettes")  # works from any folder
+CACHE_PATH: Optional[str] = os.path.join(PALETTE_DIRECTORY, "cache", "palettes.npz")  # None to always parse the .pal files
+RESAMPLE_MODES: List[str] = ["stretch", "nearest", "linear"]
+
+
+def pack_colors(colors: np.ndarray) -> np.ndarray:
+    """
+    packs (b, g, r) triplets into 24-bit integer keys like b << 16 | g << 8 | r
+    :param colors: array with shape (..., 3) whose values are whole numbers between 0 and 255 (any dtype)
+    :return: uint32 array with shape colors.shape[:-1]
+    """
+    c: np.ndarray = np.asarray(colors).astype(np.uint32)
+    return (c[..., 0] << 16) | (c[..., 1] << 8) | c[..., 2]
+
+
+def unpack_colors(keys: np.ndarray) -> np.ndarray:
+    """
+    reverses pack_colors()
+    :param keys: array of packed colors
+    :return: uint8 array with shape keys.shape + (3,)
+    """
+    keys = np.asarray(keys, dtype=np.uint32)
+    return np.stack([(keys >> 16) & 255, (keys >> 8) & 255, keys & 255], axis=-1).astype(np.uint8)
+
+
+def ycbcr_to_bgr(ycbcr: np.ndarray) -> np.ndarray:
+    """
+    util.ycbcr_to_bgr() for many colors at once (rounds toward zero and clips the same way)
+    :param ycbcr: array with shape (n, 3)
+    :return: uint8 array with shape (n, 3) of b, g, r colors
+    """
+    c: np.ndarray = np.asarray(ycbcr, np.float64)
+    r: np.ndarray = c[:, 0] + 1.40200 * (c[:, 1] - 128)
+    g: np.ndarray = c[:, 0] - 0.34414 * (c[:, 2] - 128) - 0.71414 * (c[:, 1] - 128)
+    b: np.ndarray = c[:, 0] + 1.77200 * (c[:, 2] - 128)
+    return np.clip(np.trunc(np.stack([b, g, r], axis=1)), 0, 255).astype(np.uint8)
+
+
+def read_pal_file(filename: str) -> np.ndarray:
+    """
+    :param filename: path to .pal palette file
+    :return: uint8 array with shape (n, 3) of the b, g, r colors in the file
+    """
+    with open(filename) as f:
+        ycbcr: np.ndarray = np.array([line.split(",") for line in f.read().split("\n")], np.int64)
+    return ycbcr_to_bgr(ycbcr)
+
+
+class Palette:
+    """
+    one palette, its colors can't be changed
+    """
+    def __init__(self, name: str, colors: np.ndarray):
+        """
+        :param name: like "iron.pal"
+        :param colors: array with shape (n, 3) of b, g, r colors in palette order
+        """
+        self.name: str = name
+        self.colors: np.ndarray = np.ascontiguousarray(colors, np.uint8)
+        self.keys: np.ndarray = pack_colors(self.colors)
+
+        # inverse map: the sorted distinct keys and the index of each one in the palette. A color that shows up more
+        # than once gets its last index, like building a dictionary from the colors
+        last: np.ndarray = len(self.keys) - 1 - np.unique(self.keys[::-1], return_index=True)[1]
+        self.sorted_keys: np.ndarray = self.keys[last]
+        self.sorted_indexes: np.ndarray = last
+
+        for arr in [self.colors, self.keys, self.sorted_keys, self.sorted_indexes]:
+            arr.flags.writeable = False
+        self.resampled_colors: Dict[Tuple[int, str], np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.colors)
+
+    def as_list(self) -> List[Color]:
+        """:return: the colors as a list of (b, g, r) tuples, what util.palette_to_bgr() gives"""
+        return [tuple(c) for c in self.colors.tolist()]
+
+    def index_of(self, colors: np.ndarray) -> np.ndarray:
+        """
+        :param colors: array with shape (..., 3), every color must be in the palette
+        :return: array with shape colors.shape[:-1] of the index of each color in the palette
+        """
+        keys: np.ndarray = pack_colors(colors)
+        pos: np.ndarray = np.minimum(np.searchsorted(self.sorted_keys, keys), len(self.sorted_keys) - 1)
+        found: np.ndarray = self.sorted_keys[pos] == keys
+        if not found.all():
+            raise KeyError(tuple(np.asarray(colors)[~found][0].tolist()))
+        return self.sorted_indexes[pos]
+
+    def resampled(self, length: int, mode: str = "stretch") -> np.ndarray:
+        """
+        :param length: how many colors the new palette has
+        :param mode: one of RESAMPLE_MODES
+        :return: uint8 array with shape (length, 3), only made once for each length and mode
+        """
+        if (length, mode) not in self.resampled_colors:
+            if mode == "stretch":
+                colors: np.ndarray = self.colors[util.stretch_indexes(len(self), length)]
+            elif mode == "nearest":
+                colors = self.colors[np.round(resample_positions(len(self), length)).astype(np.intp)]
+            elif mode == "linear":
+                positions: np.ndarray = resample_positions(len(self), length)
+                below: np.ndarray = np.floor(positions).astype(np.intp)
+                above: np.ndarray = np.minimum(below + 1, len(self) - 1)
+                weight: np.ndarray = (positions - below)[:, np.newaxis]
+                blended: np.ndarray = (1 - weight) * self.colors[below] + weight * self.colors[above]
+                colors = np.clip(np.round(blended), 0, 255).astype(np.uint8)
+            else:
+                raise ValueError("resample mode must be one of {0}, not {1}".format(RESAMPLE_MODES, mode))
+            colors.flags.writeable = False
+            self.resampled_colors[(length, mode)] = colors
+        return self.resampled_colors[(length, mode)]
+
+
+def resample_positions(length: int, new_length: int) -> np.ndarray:
+    """
+    :param length: number of colors in a palette
+    :param new_length: number of colors it is being resampled to
+    :return: float array of where in the palette each new color comes from, the ends line up with the ends
+    """
+    if new_length == 1:
+        return np.zeros(1)
+    return np.arange(new_length) * ((length - 1) / (new_length - 1))
+
+
+_palettes: Dict[str, Palette] = {}  # the palettes in PALETTE_DIRECTORY by file name
+_other_palettes: Dict[str, Palette] = {}  # palettes from anywhere else by absolute path
+
+
+def file_signature(filenames: List[str]) -> np.ndarray:
+    """
+    :param filenames: paths to files
+    :return: sizes and modification times of the files, if any of them change the cache is out of date
+    """
+    stats: List[os.stat_result] = [os.stat(f) for f in filenames]
+    return np.array([[s.st_size, s.st_mtime_ns] for s in stats], np.int64).reshape(-1, 2)
+
+
+def load_directory(directory: str = PALETTE_DIRECTORY, cache_path: Optional[str] = CACHE_PATH) -> Dict[str, Palette]:
+    """
+    reads every .pal file in a folder, using the binary cache file if it was made from the same files
+    :param directory: folder of .pal files
+    :param cache_path: .npz file to read the palettes from and save them to, None to not use one
+    :return: dictionary from file name (like "iron.pal") to Palette
+    """
+    names: List[str] = sorted(n for n in os.listdir(directory) if n.endswith(".pal"))
+    signature: np.ndarray = file_signature([os.path.join(directory, n) for n in names])
+    if cache_path is not None and os.path.isfile(cache_path):
+        try:
+            with np.load(cache_path) as f:
+                if list(f["names"]) == names and np.array_equal(f["signature"], signature):
+                    return {n: Palette(n, f["colors_" + n]) for n in names}
+        except (OSError, ValueError, KeyError):  # half written or from an older version, just parse the files again
+            pass
+
+    palettes: Dict[str, Palette] = {n: Palette(n, read_pal_file(os.path.join(directory, n))) for n in names}
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        tmp_path: str = "{0}.{1}.tmp.npz".format(cache_path[:-len(".npz")], os.getpid())
+        np.savez(tmp_path, names=np.array(names), signature=signature,
+                 **{"colors_" + n: p.colors for n, p in palettes.items()})
+        os.replace(tmp_path, cache_path)  # other processes never see half a file
+    return palettes
+
+
+def get_palette(name: str) -> Palette:
+    """
+    :param name: file name of a palette in palettes/ (like "iron.pal" or "palettes/iron.pal") or a path to any .pal file
+    :return: the palette, only read from disk the first time it is asked for
+    """
+    directory: str = os.path.normpath(os.path.dirname(name))
+    if directory in [".", "palettes"] or os.path.abspath(directory) == PALETTE_DIRECTORY:
+        if len(_palettes) == 0:
+            _palettes.update(load_directory())
+        if os.path.basename(name) in _palettes:
+            return _palettes[os.path.basename(name)]
+        name = os.path.join(PALETTE_DIRECTORY, os.path.basename(name))
+    key: str = os.path.abspath(name)
+    if key not in _other_palettes:
+        _other_palettes[key] = Palette(os.path.basename(name), read_pal_file(name))
+    return _other_palettes[key]
+
+
+def all_palettes(names: List[str] = util.PALETTES) -> List[Palette]:
+    """
+    :param names: file names of palettes in palettes/
+    :return: the palettes in the same order
+    """
+    return [get_palette(n) for n in names]
+
+
+def conversion_colors(old: Palette, new: Palette, mode: str = "stretch") -> Tuple[np.ndarray, np.ndarray]:
+    """
+    pairs up the colors of two palettes for converting an image from one to the other
+    :param old: palette the image is in
+    :param new: palette the image is going to
+    :param mode: one of RESAMPLE_MODES. With "stretch" the shorter palette is stretched to the length of the longer one,
+    otherwise the new palette is resampled to the length of the old one
+    :return: uint8 colors of the old palette and the new color for each of them (same length)
+    """
+    if mode == "stretch":
+        length: int = max(len(old), len(new))
+        return old.resampled(length, mode), new.resampled(length, mode)
+    return old.colors, new.resampled(len(old), mode)
@@ -13,19 +13,26 @@ import cv2
 import numpy as np
 import time
 import os
+from concurrent.futures import ProcessPoolExecutor
 from StitcherEasy import open_directory_chooser
+from frames import discover_frames
 from util import Color
 import util
-import Image
-from typing import List, Dict
+import lut
+import palette_registry
+from palette_registry import pack_colors
+import instrument
+from Image import IndexedImage
+from typing import List, Dict, Iterator, Optional, Tuple
 
 
 class Rescaler:
     def __init__(self, directory_path: str, palette: str = "palettes/iron.pal", ):
         self.directory_path: str = directory_path
+        self.palette_name: str = palette
 
         # convert palette to bgr. originally in YCbCr
-        self.palette: List[Color] = util.palette_to_bgr(palette)
+        self.palette: List[Color] = palette_registry.get_palette(palette).as_list()
 
         # grab temperature extremes
         with open(directory_path + "/info.json") as f:
@@ -34,6 +41,7 @@ class Rescaler:
             self.lowest: List[float] = info["lowestTemperatures"]
 
         self.global_color_map: Dict[float, Color] = None
+        self.ir_paths: List[str] = discover_frames(directory_path, "ir")  # ir00.png, ir01.png, ... in order
 
     def replace_extreme_high_temps(self, thresh: float = 150, overwrite_file: bool = False) -> None:
         """
@@ -71,6 +79,7 @@ class Rescaler:
             with open(self.directory_path + "/info.json", "r+") as f:
                 info: Dict = json.loads(f.read())
                 info["highestTemperatures"] = self.highest
+                f.seek(0)  # truncating doesn't move back to the start, without this the file begins with null bytes
                 f.truncate(0)
                 f.write(json.dumps(info))
 
@@ -115,37 +124,125 @@ class Rescaler:
         :return: the rescaled image
         """
         self.global_color_map: Dict[float, Color] = self.get_global_temp_color_map()
+        return self.rescale_frame(img_num)
 
-        img_num_str: str = util.make_double_digit_str(img_num)
-        img: np.ndarray = cv2.imread(self.directory_path + "/ir{0}.png".format(img_num_str))
-
+    def frame_index_lut(self, img_num: int) -> np.ndarray:
+        """
+        makes the table that takes the palette index of a color in the image to the palette index of the global color
+        for that same temperature. Uses the global color map that has already been set in self.global_color_map
+        :param img_num: 0, 1, 2, ..., n used to grab the temperature data
+        :return: uint8 array with one global palette index per palette entry
+        """
         # get colors and temperatures separately
         color_map_orig: Dict[float, Color] = self.get_temp_color_map(self.lowest[img_num], self.highest[img_num])  # gets temperature to color
         local_temps: List[float] = list(color_map_orig.keys())
         adjusted_local_temps: List[float] = self.match_local_with_global_temps(local_temps)
         # remakes the color map so that the temperatures now match up with the global temperatures
         color_map: Dict[Color, float] = dict(zip(self.palette, adjusted_local_temps))  # color to temperature
-        # map local color to the global color
-        local_color_to_global: Dict[Color, Color] = {}
-        for color in color_map:
-            local_color_to_global[color] = self.global_color_map[color_map[color]]
-
-        rescaled_image: np.ndarray = np.zeros(img.shape)
+        global_index: Dict[float, int] = {temp: i for i, temp in enumerate(self.global_color_map)}
+        # map local color to the global color (going through the color keeps the same answer for repeated colors)
+        return np.array([global_index[color_map[color]] for color in self.palette], np.uint8)
 
-        # make sure colors in image match the palette exactly
-        image_obj: Image.Image = Image.Image(img)
-        image_obj.set_colors_to_palette(self.palette)
+    def frame_lut(self, img_num: int) -> np.ndarray:
+        """
+        same as frame_index_lut() but with the global colors instead of their indexes
+        :param img_num: 0, 1, 2, ..., n used to grab the temperature data
+        :return: uint8 array with one (b, g, r) global color per palette entry
+        """
+        return np.array(self.palette, np.uint8)[self.frame_index_lut(img_num)]
 
-        # replace local colors with global colors row by row
-        for x in range(img.shape[1]):
-            rescaled_image[:, x] = util.replace(image_obj.img[:, x].astype(np.float64), local_color_to_global)
+    def rescale_frame_indexed(self, img_num: int, index_lut: Optional[np.ndarray] = None) -> IndexedImage:
+        """
+        same as rescale_frame() but gives the palette indexes of the global colors
+        :param img_num: 0, 1, 2, ..., n the image number is used to grab the image file and the temperature data
+        :param index_lut: frame_index_lut(img_num) if it has already been made, None to make it
+        :return: the rescaled image as palette indexes
+        """
+        if index_lut is None:
+            index_lut = self.frame_index_lut(img_num)
+        with instrument.span("rescale frame", frames=1, frame=img_num) as span:
+            img: np.ndarray = cv2.imread(self.ir_paths[img_num])
+            span.set(megapix=instrument.megapix(img))
+
+            # finding the closest palette color and swapping it for the global color is done in one pass: each pixel
+            # gets the palette index of its closest color, which then picks the global index out of the table for this
+            # frame
+            nearest: lut.NearestColorIndex = lut.nearest_color_index(self.palette)
+            index: np.ndarray = index_lut[nearest.query(img)]
+            nearest.save()
+
+        return IndexedImage(index, self.palette_name, np.array(self.palette, np.uint8))
+
+    def rescale_frame(self, img_num: int) -> np.ndarray:
+        """
+        same as rescale_image() but uses the global color map that has already been set in self.global_color_map
+        :param img_num: 0, 1, 2, ..., n the image number is used to grab the image file and the temperature data
+        :return: the rescaled image (uint8 like an image read from a file)
+        """
+        return self.rescale_frame_indexed(img_num).to_bgr()
 
-        return rescaled_image
+    def rescale_all(self, num_imgs: Optional[int] = None, workers: Optional[int] = None,
+                    indexed: bool = False) -> Iterator:
+        """
+        rescales a whole set of images. The global color map and the table of every frame (frame_index_lut()) are only
+        made once, then the images are split up among a pool of processes that all get those tables and the nearest
+        color table. Colors a process has to look up in the palette are sent back with its frame and only this process
+        adds them to the table and saves it. The frames are handed back in order as they finish (as palette indexes, a
+        third of the size of the images). The "rescale frame" spans of frames done in the pool aren't recorded (see
+        instrument.py)
+        :param num_imgs: rescales images 0 through num_imgs - 1, None for every image in info.json
+        :param workers: number of processes, None for one per cpu, 1 to do everything in this process
+        :param indexed: give IndexedImages instead of b, g, r images
+        :return: iterator of the rescaled images in order
+        """
+        if num_imgs is None:
+            num_imgs = len(self.highest)
+        with instrument.span("global color map"):
+            self.global_color_map = self.get_global_temp_color_map()
+            index_luts: np.ndarray = np.stack([self.frame_index_lut(i) for i in range(num_imgs)])
+
+        if workers == 1:
+            for i in range(num_imgs):
+                rescaled: IndexedImage = self.rescale_frame_indexed(i, index_luts[i])
+                yield rescaled if indexed else rescaled.to_bgr()
+            return
+
+        colors: np.ndarray = np.array(self.palette, np.uint8)
+        nearest: lut.NearestColorIndex = lut.nearest_color_index(self.palette)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(self.ir_paths, index_luts, nearest)) as executor:
+            for index, new_keys, new_nearest in executor.map(_rescale_frame, range(num_imgs)):
+                nearest.add(new_keys, new_nearest)
+                rescaled = IndexedImage(index, self.palette_name, colors)
+                yield rescaled if indexed else rescaled.to_bgr()
+        nearest.save()
+
+
+# what a process in the pool made by rescale_all() works from: the ir frame paths, the index table of each frame and
+# the nearest color table (a copy, on linux it shares memory with the parent process until it is written to)
+_worker_tables: Optional[Tuple[List[str], np.ndarray, lut.NearestColorIndex]] = None
+
+
+def _init_worker(ir_paths: List[str], index_luts: np.ndarray, nearest: lut.NearestColorIndex) -> None:
+    """runs once when each process in the pool starts"""
+    global _worker_tables
+    _worker_tables = (ir_paths, index_luts, nearest)
+
+
+def _rescale_frame(img_num: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    runs in the pool, rescales one image
+    :return: global palette indexes of the image, the packed colors that weren't in the nearest color table yet and the
+    palette index of the closest color to each of them
+    """
+    ir_paths, index_luts, nearest = _worker_tables
+    img: np.ndarray = cv2.imread(ir_paths[img_num])
+    new_keys, new_nearest = nearest.missing(pack_colors(img))
+    nearest.add(new_keys, new_nearest)  # later frames in this process often have the same colors
+    return index_luts[img_num][nearest.query(img)], new_keys, new_nearest
 
 
 def main():
-    NUM_IMGS = 45
-
     print("*** SELECT folder containing all images ***")
     directory = open_directory_chooser()  # pop-up file chooser
     # directory = "/Users/ccuser/Desktop/AmosDecker/ir/images/pano-20200109115026"
@@ -155,11 +252,12 @@ def main():
     start = time.time()
 
     r = Rescaler(directory)
+    NUM_IMGS = len(r.ir_paths)
     print(r.get_global_temp_color_map())
     all_rescaled = []
-    for i in range(NUM_IMGS):
+    for i, rescaled in enumerate(r.rescale_all(NUM_IMGS)):
         print(str(i + 1) + "/" + str(NUM_IMGS))
-        all_rescaled.append(r.rescale_image(i))
+        all_rescaled.append(rescaled)
 
     print("total time:", time.time() - start)
 
@@ -1,39 +1,103 @@
 __author__ = "Amos Decker"
 __date__ = "January 2020"
 
+import os
 import time
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from rescale import Rescaler
 import util
 import cv2
 import StitcherEasy
+from frames import ConvertedFrames, FrameSource, discover_frames
+from feature_cache import DEFAULT_DIRECTORY, FeatureCache, make_key
+from matching import MatchPlanner
 import Image
+import temperature
+import lut
+import instrument
+from manifest import Manifest
+from mixed import MixedImages
 import numpy as np
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 
-def get_images(directory: str, type_img: str, NUM_IMGS: int):
+def get_images(directory: str, type_img: str, NUM_IMGS: Optional[int] = None) -> FrameSource:
     """
 
     :param directory: path to directory
     :param type_img: "vl", "ir", or "mx"
-    :param NUM_IMGS: number of images to grab
-    :return: list of images
+    :param NUM_IMGS: number of images to grab, None for all of them
+    :return: list-like FrameSource of images, they are only read from disk when they get used
     """
-    return [cv2.imread(directory + "/{0}{1}.png".format(type_img, i)) if i > 9 else
-            cv2.imread(directory + "/{0}0{1}.png".format(type_img, i)) for i in range(NUM_IMGS)]
+    return FrameSource.from_directory(directory, type_img, NUM_IMGS)
 
 
-def make_all_palettes(path_to_file: str, save_path: str):
+def make_all_palettes(path_to_file: str, save_directory: str, palette_names: List[str] = util.PALETTES,
+                      workers: int = 4, mode: str = "stretch") -> List[str]:
     """
-    take one image and apply all the different palettes to it
+    take one image and apply all the different palettes to it. The image is read and matched to its palette once, and
+    the pngs are written by a pool of threads while the next palettes are being made
+    :param path_to_file: ir image (like a finished ir panorama)
+    :param save_directory: where to save the images, they get named like 144-ir-lava.png
+    :param palette_names: which palettes to make, like util.PALETTES
+    :param workers: number of threads writing pngs
+    :param mode: how palettes of different lengths are lined up, see Image.change_palette()
+    :return: paths of the saved images
     """
-    for pal in util.PALETTES:
+    img: Optional[np.ndarray] = cv2.imread(path_to_file)
+    if img is None:
+        raise IOError("could not read " + path_to_file)
+    renderer: lut.PaletteRenderer = lut.PaletteRenderer(img)
+    name: str = os.path.splitext(os.path.basename(path_to_file))[0]
+
+    def write(item):
+        pal, rendered = item
+        path = "{0}/{1}-{2}.png".format(save_directory, name, os.path.splitext(pal)[0])
+        cv2.imwrite(path, rendered)
         print(pal)
-        img = cv2.imread(path_to_file)
-        cv2.imwrite(save_path, Image.Image(img).change_palette(pal).img)
+        return path
 
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(util.imap_ordered(executor, write, renderer.render_many(palette_names, mode), window=workers))
 
-def main():
+
+class Settings:
+    """
+    everything that changes how a panorama gets made, change the defaults here or pass changes in like
+    Settings(REMOVE_BLACK=False)
+    """
+    NUM_IMGS: Optional[int] = None  # number of frames in the folder, None to count them
+    REMOVE_BLACK: bool = True
+    INIT_PALETTE: str = "iron.pal"  # the palette that the original individual pano pictures are in (if unknown, can always use util.identify_palette()
+    USE_FLIR_MX: bool = True
+    CREATE_MY_MX: bool = True
+    MY_MX_VARIANTS: List[str] = ["mx"]  # which of my mixed images to make: "mx" (Image.create_mx()), "mx2" and/or "mx3", saved as -mymx.png, -mymx2.png, -mymx3.png
+    MX_MODE: str = "panorama"  # "panorama" makes my mixed images from the finished panoramas, "frames" makes them from each vl frame and its rescaled ir frame and stitches them like the other layers (small images filtered in parallel and no full size filtering, but the ir colors are from before matching the palette). Set USE_FLIR_MX to False too for the fewest layers
+    MY_MX_FILTER: str = "bilateral"  # how the vl pano is blurred for my mixed images, "guided" or "box" are faster but don't look exactly the same (see mixed.py)
+    CHANGE_PALETTE: bool = False
+    NEW_PALETTE: str = "lava.pal"  # palette the ir pano is changed to when CHANGE_PALETTE is True
+    TEMPERATURE_DOMAIN: bool = False  # stitch temperatures instead of colors and only apply the palette at the end
+    CACHE_DIRECTORY: Optional[str] = DEFAULT_DIRECTORY  # where features & camera params are kept between runs, None to not keep them
+    RESCALE_WORKERS: Optional[int] = None  # number of processes used for rescaling, None for one per cpu
+    REGISTER_QUALITY: Optional[str] = None  # "fast", "balanced" or "best" to shrink frames before finding features and only use more detail if they don't match well (see StitcherEasy.register_adaptive()), None for full size
+    WRAP_AROUND: bool = False  # the sweep goes all the way around (360 degrees), so match the last frames with the first ones
+    TILE_WIDTH: Optional[int] = None  # blend the panoramas in tiles this wide (for very long sweeps), None to blend them all at once in memory
+    REPLACE_HIGH_TEMPS: bool = True  # when rescaling images change data to get rid of strangely high temperatures (like from reflections from the sun)
+    OVERWRITE_FILE: bool = True  # whether or not to change the info.json file itself when replacing high temps
+    THRESHOLD: float = 70
+    STAGE_CACHE: Optional[str] = ".stages"  # folder (in each pano folder) where what each stage made is kept so a rerun only redoes the stages whose inputs or settings changed, None to redo everything every time (the outputs are compressed but still take about as much disk space as the frames)
+
+    def __init__(self, **changes):
+        for name, value in changes.items():
+            if not hasattr(Settings, name) or not name.isupper():
+                raise TypeError("unknown setting " + name)
+            setattr(self, name, value)
+
+
+def process_pano(directory: str, save_directory: Optional[str] = None, settings: Optional[Settings] = None) \
+        -> Dict[str, str]:
     """
     order of events...
     1 rescale
@@ -43,104 +107,261 @@ def main():
     4 (optional) change palette
     5 (optional) create mixed ir/vl image -- not relying on flir
     6 save!
+    each of these is an instrument.span ("rescale", "register", "compose", "remove black", "match palette",
+    "change palette", "mixed image", "save"), so run it inside instrument.recording() to time them. With STAGE_CACHE set
+    each stage only runs again if what it is made from changed since the last time (see manifest.py)
+    :param directory: pano folder with the vl, ir and mx frames and info.json
+    :param save_directory: where to save the panoramas, None to pick a folder once they are done
+    :param settings: how to make the panorama, None for the defaults
+    :return: what was saved ("vl", "mx", "ir", "mymx", "mymx2", "mymx3", "model") and the path it was saved to
     """
     start: float = time.time()
-
-    ########
-    # CONSTANTS
-    ########
-    NUM_IMGS: int = 45
-    REMOVE_BLACK: bool = True
-    INIT_PALETTE: str = "iron.pal"  # the palette that the original individual pano pictures are in (if unknown, can always use util.identify_palette()
-    USE_FLIR_MX: bool = True
-    CREATE_MY_MX: bool = True
-    CHANGE_PALETTE: bool = False
-    REPLACE_HIGH_TEMPS: bool = True  # when rescaling images change data to get rid of strangely high temperatures (like from reflections from the sun)
-    if REPLACE_HIGH_TEMPS:
-        OVERWRITE_FILE: bool = True  # whether or not to change the info.json file itself when replacing high temps
-        THRESHOLD: float = 70
-
-    directory: str = util.open_directory_chooser()
-    pano_num: str = directory[-14:]
+    s: Settings = Settings() if settings is None else settings
+    if s.MX_MODE not in ["panorama", "frames"]:
+        raise ValueError("MX_MODE must be \"panorama\" or \"frames\", not " + str(s.MX_MODE))
+    pano_num: str = os.path.basename(os.path.normpath(directory))[-14:]  # pano folders are named with a 14 digit date
+    num_imgs: int = len(discover_frames(directory, "vl")) if s.NUM_IMGS is None else s.NUM_IMGS
+    stages: Manifest = Manifest(os.path.join(directory, s.STAGE_CACHE) if s.STAGE_CACHE is not None else None)
+    types: List[str] = ["vl", "mx"] if s.USE_FLIR_MX else ["vl"]
+    frame_hashes: Dict[str, List[str]] = {t: stages.input_hashes(discover_frames(directory, t)[:num_imgs])
+                                          for t in types + ["ir"]}
 
 
     #######
     # RESCALE images -- makes the colors that you see represent the same temperatures across all images
     #######
     print("\nRESCALE...")
-    r: Rescaler = Rescaler(directory)
-    if REPLACE_HIGH_TEMPS:
-        r.replace_extreme_high_temps(thresh=THRESHOLD, overwrite_file=OVERWRITE_FILE)
-    all_rescaled: List[np.ndarray] = []
-    for i in range(NUM_IMGS):
-        print(str(i + 1) + "/" + str(NUM_IMGS))
-        all_rescaled.append(r.rescale_image(i))
+    with instrument.span("rescale", frames=num_imgs):
+        r: Rescaler = temperature.TemperatureFrames(directory) if s.TEMPERATURE_DOMAIN else Rescaler(directory)
+        if s.REPLACE_HIGH_TEMPS:
+            r.replace_extreme_high_temps(thresh=s.THRESHOLD, overwrite_file=s.OVERWRITE_FILE)
+
+        def rescale() -> Dict[str, np.ndarray]:
+            if s.TEMPERATURE_DOMAIN:
+                # frames are decoded to palette indexes on the global temperature scale
+                return {"frame{0}".format(i): r.stitch_layer(i) for i in range(num_imgs)}
+            # kept as palette indexes, a third of the size of the colors
+            rescaled_frames: Dict[str, np.ndarray] = {}
+            for i, rescaled in enumerate(r.rescale_all(num_imgs, workers=s.RESCALE_WORKERS, indexed=True)):
+                print(str(i + 1) + "/" + str(num_imgs))
+                rescaled_frames["frame{0}".format(i)] = rescaled.index
+            return rescaled_frames
+
+        # keyed by the temperatures themselves (after replacing the high ones) instead of by info.json
+        rescaled_frames, rescaled_hash = stages.run("rescale", frame_hashes["ir"], {
+            "lowest": r.lowest[:num_imgs], "highest": r.highest[:num_imgs], "palette": make_key(*r.palette),
+            "temperature_domain": s.TEMPERATURE_DOMAIN, "indexed": True}, rescale)
+        all_rescaled: List[np.ndarray] = [rescaled_frames["frame{0}".format(i)] for i in range(num_imgs)]
+        if not s.TEMPERATURE_DOMAIN:
+            all_rescaled = [Image.IndexedImage(index, r.palette_name, np.array(r.palette, np.uint8)).to_bgr()
+                            for index in all_rescaled]
+
+
+    #######
+    # Create mixed ir/vl of each frame to stitch with the rest (optional, see MX_MODE)
+    #######
+    layer_names: List[str] = list(types)
+    images_to_stitch: List = [get_images(directory, t, num_imgs) for t in types]
+    mixed_hash: str = ""
+    if s.CREATE_MY_MX and s.MX_MODE == "frames":
+        print("\nMIXED FRAMES...")
+        vl_frames: FrameSource = images_to_stitch[0]
+
+        def ir_colors(i: int) -> np.ndarray:
+            """:return: rescaled frame i in the colors the ir pano will end up in"""
+            palette_name: str = s.NEW_PALETTE if s.CHANGE_PALETTE else s.INIT_PALETTE
+            if s.TEMPERATURE_DOMAIN:
+                return temperature.render(all_rescaled[i][:, :, 0], palette_name, from_length=len(r.palette))
+            if s.CHANGE_PALETTE:
+                return lut.palette_lut(s.INIT_PALETTE, s.NEW_PALETTE).apply(all_rescaled[i])
+            return all_rescaled[i]
+
+        def mix_frame(i: int) -> Dict[str, np.ndarray]:
+            return MixedImages(vl_frames[i], s.MY_MX_FILTER).make(ir_colors(i), s.MY_MX_VARIANTS)
+
+        def mixed_frames() -> Dict[str, np.ndarray]:
+            with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+                made: List[Dict[str, np.ndarray]] = list(executor.map(mix_frame, range(num_imgs)))
+            return {"{0}-{1}".format(v, i): m[v] for i, m in enumerate(made) for v in s.MY_MX_VARIANTS}
+
+        with instrument.span("mixed frames", frames=num_imgs):
+            mixed_layers, mixed_hash = stages.run("mixed frames", [rescaled_hash] + frame_hashes["vl"], {
+                "variants": s.MY_MX_VARIANTS, "filter": s.MY_MX_FILTER, "change_palette": s.CHANGE_PALETTE,
+                "palette": s.NEW_PALETTE if s.CHANGE_PALETTE else s.INIT_PALETTE}, mixed_frames)
+        for v in s.MY_MX_VARIANTS:
+            layer_names.append("my" + v)
+            images_to_stitch.append([mixed_layers["{0}-{1}".format(v, i)] for i in range(num_imgs)])
 
 
     #######
     # STITCH images
     ######
     print("\nSTITCH...")
-    if USE_FLIR_MX:
-        types = ["vl", "mx"]
-        images_to_stitch: List[List[np.ndarray], List[np.ndarray], List[np.ndarray]] = []
+    layer_names.append("ir")  # the ir layer is always last
+    if s.TEMPERATURE_DOMAIN:
+        images_to_stitch.append(all_rescaled)
     else:
-        types = ["vl"]
-        images_to_stitch: List[List[np.ndarray], List[np.ndarray]] = []
-    for t in types:
-        images_to_stitch.append(get_images(directory, t, NUM_IMGS))
-    images_to_stitch.append(all_rescaled)
+        # warp the ir frames as float64 and cut them down to int16 when blending like the stitcher always has, warping
+        # the uint8 frames would round instead and change about a third of the pixels of the ir pano
+        images_to_stitch.append(ConvertedFrames(all_rescaled, np.float64))
+
+    def register() -> Dict[str, np.ndarray]:
+        cache: Optional[FeatureCache] = FeatureCache(s.CACHE_DIRECTORY) if s.CACHE_DIRECTORY is not None else None
+        if s.REGISTER_QUALITY is None:
+            model: StitcherEasy.PanoramaModel = StitcherEasy.register(images_to_stitch[0], use_kaze=True, cache=cache,
+                                                                      planner=MatchPlanner(wrap=s.WRAP_AROUND))  # if the stitch fails try changing kaze to False/True
+        else:
+            model = StitcherEasy.register_adaptive(images_to_stitch[0], use_kaze=True, cache=cache,
+                                                   planner=MatchPlanner(wrap=s.WRAP_AROUND), quality=s.REGISTER_QUALITY)
+        return model.to_arrays()
+
+    with instrument.span("register", frames=num_imgs):
+        model_arrays, model_hash = stages.run("register", frame_hashes["vl"], {
+            "use_kaze": True, "quality": s.REGISTER_QUALITY, "wrap_around": s.WRAP_AROUND}, register)
+        model: StitcherEasy.PanoramaModel = StitcherEasy.PanoramaModel.from_arrays(model_arrays)
+
+    def compose() -> Dict[str, np.ndarray]:
+        if s.TILE_WIDTH is None:
+            panos, masks = model.compose(images_to_stitch, return_masks=True)
+        else:
+            # the panoramas get written to files piece by piece so the blenders never need the whole thing in memory
+            scratch_directory: str = tempfile.mkdtemp()
+            out_paths: List[str] = [scratch_directory + "/layer{0}.npy".format(i) for i in range(len(images_to_stitch))]
+            panos, mask = model.compose_tiled(images_to_stitch, out_paths, tile_width=s.TILE_WIDTH)
+            masks = [mask] * len(panos)
+
+        layers: Dict[str, np.ndarray] = {"mask": np.asarray(masks[-1])}
+        if s.TEMPERATURE_DOMAIN:
+            # the ir pano holds global palette indexes, color it in (black wherever no frame landed)
+            layers["ir_index"], layers["covered"] = temperature.layer_to_index(panos[-1], len(r.palette))
+            panos[-1] = temperature.render(layers["ir_index"], s.INIT_PALETTE, layers["covered"])
 
-    panos: List[np.ndarray] = StitcherEasy.stitch(images_to_stitch, use_kaze=True)  # if the stitch fails try changing kaze to False/True
+        for name, pano in zip(layer_names, panos):
+            layers[name] = pano.astype(np.uint8)  # uint8 is same type as when you read img from a file
+        if s.TILE_WIDTH is not None:
+            shutil.rmtree(scratch_directory)
+        return layers
 
-    for i in range(len(panos)):
-        panos[i] = panos[i].astype(np.uint8)  # uint8 is same type as when you read img from a file
+    with instrument.span("compose", frames=num_imgs, layers=len(images_to_stitch)):
+        # tiling doesn't change the panoramas, so it isn't part of the key
+        layers, layers_hash = stages.run("compose", [model_hash, rescaled_hash, mixed_hash] +
+                                         sum(frame_hashes.values(), []), {
+            "layers": layer_names, "temperature_domain": s.TEMPERATURE_DOMAIN, "palette": s.INIT_PALETTE,
+            "ir_warp": "float64"}, compose)
 
     # get rid of black border
-    if REMOVE_BLACK:
-        # the ir image wont ever have black pixels other than the border so just get limits for that one
-        im: Image.Image = Image.Image(panos[-1])
-        upper_limit, lower_limit, removed_left, removed_right = im.remove_black()
-        panos[-1] = im.img
-        for i in range(len(panos) - 1):
-            panos[i] = panos[i][upper_limit:lower_limit, :]
-            if removed_left:
-                panos[i] = panos[i][:, 1:]
-            if removed_right:
-                panos[i] = panos[i][:, :-1]
-
-    ir_pano: Image.Image = Image.Image(panos[-1])
+    if s.REMOVE_BLACK:
+        def remove_black() -> Dict[str, np.ndarray]:
+            # the blender knows where frames landed, so use its mask instead of looking for black pixels (some palettes
+            # have colors with a 0 in them) and crop every pano the same way
+            im: Image.Image = Image.Image(layers["ir"].copy())
+            limits = im.remove_black(layers["mask"])
+            cropped: Dict[str, np.ndarray] = {name: Image.crop_border(layer, *limits) for name, layer in layers.items()}
+            cropped["ir"] = im.img
+            return cropped
+
+        with instrument.span("remove black", megapix=instrument.megapix(layers["ir"])):
+            layers, layers_hash = stages.run("remove black", [layers_hash], {}, remove_black)
+
+    ir_pano: Image.Image = Image.Image(layers["ir"])
+    ir_hash: str = layers_hash
+    ir_indexed: Optional[Image.IndexedImage] = None  # the ir pano as palette indexes once it matches the palette
 
     #######
     # CHANGE ir pano to match colors in the palette (the stitching process changes pixel data slightly, this corrects that)
     #######
-    print("\nMATCH PALETTE...")
-    ir_pano.set_colors_to_palette(util.palette_to_bgr("palettes/" + INIT_PALETTE))
+    if not s.TEMPERATURE_DOMAIN:  # rendering from palette indexes already gives exact palette colors
+        print("\nMATCH PALETTE...")
+
+        def match_palette() -> Dict[str, np.ndarray]:
+            return {"index": Image.IndexedImage.snap(ir_pano.img, s.INIT_PALETTE).index}
+
+        with instrument.span("match palette", megapix=instrument.megapix(ir_pano.img)):
+            matched, ir_hash = stages.run("match palette", [ir_hash], {"palette": s.INIT_PALETTE, "indexed": True},
+                                          match_palette)
+            ir_indexed = Image.IndexedImage(matched["index"], s.INIT_PALETTE)
 
     #######
     # CHANGE PALETTE (optional)
     ######
-    if CHANGE_PALETTE:
+    if s.CHANGE_PALETTE:
         print("\nCHANGE PALETTE...")
-        ir_pano.change_palette("lava.pal")
+
+        def change_palette() -> Dict[str, np.ndarray]:
+            if s.TEMPERATURE_DOMAIN:
+                return {"ir": temperature.render(layers["ir_index"], s.NEW_PALETTE, layers["covered"],
+                                                 from_length=len(r.palette))}
+            # only the colors the indexes point to change
+            changed_colors: Image.IndexedImage = Image.IndexedImage(ir_indexed.index, ir_indexed.palette_name)
+            changed_colors.change_palette(s.NEW_PALETTE)
+            return {"colors": changed_colors.colors}
+
+        with instrument.span("change palette", megapix=instrument.megapix(ir_pano.img)):
+            changed, ir_hash = stages.run("change palette", [ir_hash], {"palette": s.NEW_PALETTE, "indexed": True},
+                                          change_palette)
+            if s.TEMPERATURE_DOMAIN:
+                ir_pano.img = changed["ir"]
+            else:
+                ir_indexed = Image.IndexedImage(ir_indexed.index, s.NEW_PALETTE, changed["colors"])
+
+    if ir_indexed is not None:
+        ir_pano.img = ir_indexed.to_bgr()
 
     #######
     # Create mixed ir/vl using my program, not FLIR's (optional)
     #######
-    if CREATE_MY_MX:
-        my_mx: np.ndarray = Image.create_mx(panos[0], ir_pano.img)
+    if s.CREATE_MY_MX and s.MX_MODE == "panorama":
+        def mixed_images() -> Dict[str, np.ndarray]:
+            # the blurred vl pano, its edges etc. are worked out once for all the variants
+            made: Dict[str, np.ndarray] = MixedImages(layers["vl"], s.MY_MX_FILTER).make(ir_pano.img, s.MY_MX_VARIANTS)
+            return {"my" + v: img for v, img in made.items()}
+
+        with instrument.span("mixed image", megapix=instrument.megapix(ir_pano.img)):
+            my_mx, my_mx_hash = stages.run("mixed image", [layers_hash, ir_hash],
+                                           {"variants": s.MY_MX_VARIANTS, "filter": s.MY_MX_FILTER}, mixed_images)
 
     print("total time:", time.time() - start)
+    if len(stages.hits) > 0:
+        print("reused:", ", ".join(stages.hits))
     ######
     # SAVE panos
     ######
     print("\nSAVING...")
-    panos[-1] = ir_pano.img
-    save_directory = util.open_directory_chooser()
-    cv2.imwrite(save_directory + "/" + pano_num + "-vl.png", panos[0])
-    cv2.imwrite(save_directory + "/" + pano_num + "-mx.png", panos[1])
-    cv2.imwrite(save_directory + "/" + pano_num + "-ir.png", panos[2])
-    cv2.imwrite(save_directory + "/" + pano_num + "-mymx.png", my_mx)
+    if save_directory is None:
+        save_directory = util.open_directory_chooser()
+    to_save: Dict[str, Tuple[np.ndarray, str]] = {t: (layers[t], layers_hash) for t in types}
+    to_save["ir"] = (ir_pano.img, ir_hash)
+    if s.CREATE_MY_MX and s.MX_MODE == "panorama":
+        to_save.update({name: (img, my_mx_hash) for name, img in my_mx.items()})
+    elif s.CREATE_MY_MX:
+        to_save.update({"my" + v: (layers["my" + v], layers_hash) for v in s.MY_MX_VARIANTS})
+    saved: Dict[str, str] = {}
+    with instrument.span("save", megapix=instrument.megapix(ir_pano.img)):
+        for kind, (pano, pano_hash) in to_save.items():
+            saved[kind] = save_directory + "/" + pano_num + "-" + kind + ".png"
+            if stages.needs_saving(saved[kind], pano_hash + kind):
+                cv2.imwrite(saved[kind], pano)
+                stages.saved(saved[kind], pano_hash + kind)
+        saved["model"] = save_directory + "/" + pano_num + "-model.npz"
+        if stages.needs_saving(saved["model"], model_hash):
+            model.save(saved["model"])  # StitcherEasy.PanoramaModel.load() to compose more layers later
+            stages.saved(saved["model"], model_hash)
+    return saved
+
+
+def main():
+    """pick a pano folder, make its panoramas with the default Settings and pick where to save them"""
+    TRACE_PATH: Optional[str] = None  # save a chrome trace of the stages here (open it at chrome://tracing), None to not
+    LOG_PATH: Optional[str] = None  # save each stage as a line of json here, None to not
+
+    with instrument.recording() as recorder:
+        process_pano(util.open_directory_chooser())
+    print()
+    recorder.print_summary()
+    if TRACE_PATH is not None:
+        recorder.write_chrome_trace(TRACE_PATH)
+    if LOG_PATH is not None:
+        recorder.write_log(LOG_PATH)
 
 
 if __name__ == "__main__":
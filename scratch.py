@@ -0,0 +1,86 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+scratch space on disk for big in-between arrays (like warped frames and their masks)
+
+an array put in a ScratchStore is written to its own .npy file, and get() gives back a read only memory map of that
+file. The data lives in the os page cache instead of the python process: slicing the memory map reads only that part of
+the file without copying it, and once the memory map is let go of the pages stop counting toward the memory of the
+process
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+
+class ScratchStore:
+    def __init__(self, directory: Optional[str] = None):
+        """
+        :param directory: where to keep the files, None for a new temporary folder. close() deletes a temporary folder,
+        but in a folder that was passed in it only deletes the files it wrote
+        """
+        self.made_directory: bool = directory is None
+        self.directory: str = tempfile.mkdtemp(prefix="scratch-") if directory is None else directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.shapes: Dict[str, Tuple[int, ...]] = {}
+
+    def __enter__(self) -> "ScratchStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.shapes
+
+    def path(self, key: str) -> str:
+        """
+        :param key: name of the array
+        :return: file the array is kept in
+        """
+        return os.path.join(self.directory, key + ".npy")
+
+    def put(self, key: str, arr: np.ndarray, dtype: Optional[np.dtype] = None) -> None:
+        """
+        writes an array to disk
+        :param key: name of the array, putting the same name again replaces it
+        :param arr: any array
+        :param dtype: type to store it as (like np.uint8 for masks), None to keep the type of arr
+        """
+        np.save(self.path(key), arr if dtype is None else arr.astype(dtype, copy=False))
+        self.shapes[key] = arr.shape
+
+    def get(self, key: str) -> np.memmap:
+        """
+        :param key: name of the array
+        :return: read only memory map of the stored array, let go of it when done so its pages can be dropped
+        """
+        return np.load(self.path(key), mmap_mode="r")
+
+    def delete(self, key: str) -> None:
+        """
+        forgets an array and deletes its file
+        :param key: name of the array
+        """
+        del self.shapes[key]
+        os.remove(self.path(key))
+
+    def nbytes(self) -> int:
+        """:return: bytes of all the stored arrays on disk"""
+        return sum(os.path.getsize(self.path(key)) for key in self.shapes)
+
+    def close(self) -> None:
+        """deletes every file it wrote, and the folder too if it made it"""
+        if self.made_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        else:
+            for key in self.shapes:
+                try:
+                    os.remove(self.path(key))
+                except FileNotFoundError:
+                    pass
+        self.shapes.clear()
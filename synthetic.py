@@ -0,0 +1,97 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+makes fake pano folders for testing and benchmarking
+
+a random scene is wrapped around a cylinder and a camera standing in the middle of it takes one frame every few degrees,
+like the camera does when making a real panorama. Each frame is saved as a visible light image (vl00.png, ...), an ir
+image in a palette where the temperature comes from the brightness of the scene (ir00.png, ...) and a mixed image
+(mx00.png, ...), along with an info.json with the lowest and highest temperature of each frame
+"""
+
+import os
+import json
+import cv2
+import numpy as np
+import util
+import palette_registry
+from typing import Dict, List, Tuple
+
+
+def make_scene(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """
+    :param width: columns in the scene
+    :param height: rows in the scene
+    :param seed: for the random number generator
+    :return: uint8 b, g, r image of blurry color blobs with shapes drawn on top (lots of corners for finding features)
+    """
+    rng = np.random.default_rng(seed)
+    scene: np.ndarray = (rng.random((max(1, height // 8), max(1, width // 8), 3)) * 255).astype(np.uint8)
+    scene = cv2.resize(scene, (width, height), interpolation=cv2.INTER_CUBIC)
+    for i in range(width * height // 2000):
+        color: Tuple[int, int, int] = tuple(int(c) for c in rng.integers(0, 256, 3))
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        cv2.circle(scene, (x, y), int(rng.integers(3, 25)), color, -1)
+        cv2.rectangle(scene, (x, y), (x + int(rng.integers(5, 40)), y + int(rng.integers(5, 40))), color[::-1], 2)
+    return scene
+
+
+def make_pano_folder(directory: str, num_frames: int = 8, width: int = 320, height: int = 240, degrees_per_frame: float = 15,
+                     fov: float = 56, palette_name: str = "iron.pal", low: float = 0, high: float = 40,
+                     distortion: float = 0.08, seed: int = 0) -> Dict[str, List[float]]:
+    """
+    writes a fake pano folder
+    :param directory: folder to write the frames to, it is made if it doesn't exist
+    :param num_frames: number of frames in the sweep
+    :param width: columns in each frame
+    :param height: rows in each frame
+    :param degrees_per_frame: how far the camera turns between frames
+    :param fov: horizontal field of view of the camera in degrees
+    :param palette_name: palette of the ir frames
+    :param low: temperature of the darkest part of the scene
+    :param high: temperature of the brightest part of the scene
+    :param distortion: how much the lens bends straight lines (real lenses do, and without it frames match so perfectly
+    that opencv's matcher thinks they are the same image)
+    :param seed: for the random number generator
+    :return: what was written to info.json
+    """
+    os.makedirs(directory, exist_ok=True)
+    focal: float = width / (2 * np.tan(np.deg2rad(fov) / 2))
+    half_fov: float = np.arctan(width / 2 / focal)
+    scene_width: int = int(focal * (np.deg2rad(degrees_per_frame * (num_frames - 1)) + 2 * half_fov + 0.2)) + 10
+    scene_height: int = 2 * height
+    scene: np.ndarray = make_scene(scene_width, scene_height, seed)
+    temps: np.ndarray = cv2.cvtColor(scene, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255 * (high - low) + low
+    palette: np.ndarray = palette_registry.get_palette(palette_name).colors
+
+    # where each pixel of a frame looks, with a bit of barrel distortion
+    xs, ys = np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32))
+    x, y = (xs - width / 2) / focal, (ys - height / 2) / focal
+    bend: np.ndarray = 1 + distortion * (x ** 2 + y ** 2)
+    x, y = x * bend, y * bend
+
+    info: Dict[str, List[float]] = {"highestTemperatures": [], "lowestTemperatures": []}
+    for i in range(num_frames):
+        angle: np.ndarray = 0.1 + half_fov + np.deg2rad(degrees_per_frame * i) + np.arctan(x)
+        map_x: np.ndarray = (focal * angle).astype(np.float32)
+        map_y: np.ndarray = (y * focal / np.sqrt(1 + x ** 2) + scene_height / 2).astype(np.float32)
+        vl: np.ndarray = cv2.remap(scene, map_x, map_y, cv2.INTER_LINEAR)
+        t: np.ndarray = cv2.remap(temps, map_x, map_y, cv2.INTER_LINEAR)
+
+        # like the camera, every frame uses the whole palette between its own lowest and highest temperature
+        lowest, highest = float(t.min()), float(t.max())
+        idx: np.ndarray = np.round((t - lowest) / max(highest - lowest, 1e-6) * (len(palette) - 1)).astype(np.intp)
+        ir: np.ndarray = palette[idx]
+        mx: np.ndarray = cv2.addWeighted(vl, 0.3, ir, 0.7, 0)
+
+        num: str = util.make_double_digit_str(i)
+        cv2.imwrite(os.path.join(directory, "vl" + num + ".png"), vl)
+        cv2.imwrite(os.path.join(directory, "ir" + num + ".png"), ir)
+        cv2.imwrite(os.path.join(directory, "mx" + num + ".png"), mx)
+        info["lowestTemperatures"].append(lowest)
+        info["highestTemperatures"].append(highest)
+
+    with open(os.path.join(directory, "info.json"), "w") as f:
+        json.dump(info, f)
+    return info
@@ -0,0 +1,126 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+works with ir images as temperatures instead of colors
+
+each ir frame is decoded once into a plane of palette indexes (which together with the frame's lowest and highest
+temperature from info.json give the temperature of every pixel). Those get put on the global temperature scale, stitched
+as plain numbers and only turned into colors at the very end, so there is no need to match colors to the palette after
+stitching and changing the palette of a finished panorama is just one lookup in a table with one entry per index
+"""
+
+import cv2
+import numpy as np
+from rescale import Rescaler
+import lut
+import palette_registry
+from typing import Dict, Optional, Tuple
+
+COVERED: int = 255  # value of the second channel of a stitch layer wherever there is part of a frame
+
+
+class TemperatureFrames(Rescaler):
+    """
+    the ir frames of a pano folder as palette indexes. Uses the same info.json data as Rescaler (so
+    replace_extreme_high_temps() works the same way) but never changes colors into other colors
+    """
+    def __init__(self, directory_path: str, palette: str = "palettes/iron.pal"):
+        super().__init__(directory_path, palette)
+        self.decoded: Dict[int, np.ndarray] = {}
+
+    def decode(self, img_num: int) -> np.ndarray:
+        """
+        finds the palette index of every pixel of a frame. Each frame is only read and decoded once
+        :param img_num: 0, 1, 2, ..., n the image number is used to grab the image file
+        :return: uint8 array with the same height and width as the frame
+        """
+        if img_num not in self.decoded:
+            img: np.ndarray = cv2.imread(self.ir_paths[img_num])
+            nearest: lut.NearestColorIndex = lut.nearest_color_index(self.palette)
+            self.decoded[img_num] = nearest.query(img).astype(np.uint8)
+            nearest.save()
+        return self.decoded[img_num]
+
+    def temperatures(self, img_num: int) -> np.ndarray:
+        """
+        :param img_num: 0, 1, 2, ..., n
+        :return: float32 array of the temperature of each pixel of the frame
+        """
+        return index_to_temperature(self.decode(img_num), self.lowest[img_num], self.highest[img_num], len(self.palette))
+
+    def global_index_lut(self, img_num: int) -> np.ndarray:
+        """
+        the local temperature of each palette index is moved to the closest temperature on the global scale (the same
+        way Rescaler.match_local_with_global_temps() does it)
+        :param img_num: 0, 1, 2, ..., n
+        :return: uint8 array that takes a palette index of the frame to the palette index on the global scale
+        """
+        local_temps: np.ndarray = np.array(list(self.get_temp_color_map(self.lowest[img_num], self.highest[img_num]).keys()))
+        global_temps: np.ndarray = np.array(list(self.get_global_temp_color_map().keys()))
+        differences: np.ndarray = np.abs(global_temps[np.newaxis, :] - local_temps[:, np.newaxis])
+        return np.argmin(differences, axis=1).astype(np.uint8)  # palettes never have more than 256 colors
+
+    def global_index(self, img_num: int) -> np.ndarray:
+        """
+        :param img_num: 0, 1, 2, ..., n
+        :return: uint8 array of palette indexes on the global temperature scale
+        """
+        return self.global_index_lut(img_num)[self.decode(img_num)]
+
+    def stitch_layer(self, img_num: int) -> np.ndarray:
+        """
+        makes a frame that can be stitched like any other image: the first channel is the global palette index and the
+        second and third are COVERED so that after stitching it is clear which pixels are outside of every frame
+        :param img_num: 0, 1, 2, ..., n
+        :return: uint8 3 channel image
+        """
+        idx: np.ndarray = self.global_index(img_num)
+        covered: np.ndarray = np.full(idx.shape, COVERED, np.uint8)
+        return cv2.merge([idx, covered, covered])
+
+
+def index_to_temperature(idx: np.ndarray, low: float, high: float, palette_length: int) -> np.ndarray:
+    """
+    :param idx: palette indexes
+    :param low: temperature of the first color of the palette
+    :param high: temperature of the last color of the palette
+    :param palette_length: number of colors in the palette
+    :return: float32 array of temperatures
+    """
+    step_size: float = (high - low) / (palette_length - 1)
+    return (low + idx.astype(np.float32) * step_size).astype(np.float32)
+
+
+def layer_to_index(layer: np.ndarray, palette_length: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    splits a stitched layer (see TemperatureFrames.stitch_layer()) back into indexes and coverage
+    :param layer: stitched panorama of stitch layers (any integer type)
+    :param palette_length: number of colors in the palette, blending can push indexes slightly past the ends
+    :return: uint8 array of palette indexes, boolean array of which pixels are part of the panorama
+    """
+    idx: np.ndarray = np.clip(layer[:, :, 0], 0, palette_length - 1).astype(np.uint8)
+    covered: np.ndarray = layer[:, :, 1] > COVERED // 2
+    return idx, covered
+
+
+def render(idx: np.ndarray, palette_name: str, covered: Optional[np.ndarray] = None,
+           from_length: Optional[int] = None) -> np.ndarray:
+    """
+    turns palette indexes into colors
+    :param idx: palette indexes
+    :param palette_name: like "lava.pal"
+    :param covered: where this is False the pixel is black, None to color every pixel
+    :param from_length: number of colors in the palette the indexes were made with if it is different from the length
+    of this palette. The indexes get spread out over the new palette so the same index still means the same temperature
+    :return: uint8 b, g, r image
+    """
+    palette: palette_registry.Palette = palette_registry.get_palette(palette_name)
+    table: np.ndarray = palette.colors
+    if from_length is not None and from_length != len(palette):
+        table = palette.resampled(from_length, "nearest")
+    img: np.ndarray = table[np.minimum(idx, len(table) - 1)]
+    if covered is not None:
+        img[~covered] = 0
+    return img
+
@@ -0,0 +1,11 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+lets the tests import the modules in the folder above this one (run "python -m pytest tests" from anywhere)
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,97 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+checks that features, matches and camera params come back out of the FeatureCache the same as they went in, and that
+the cache deletes its least recently used entries (but never files other processes are still writing)
+"""
+
+import os
+import cv2
+import pytest
+import numpy as np
+import feature_cache
+import synthetic
+from feature_cache import FeatureCache
+from frames import discover_frames
+from typing import Dict, List
+
+
+@pytest.fixture(scope="module")
+def features(tmp_path_factory) -> List[cv2.detail.ImageFeatures]:
+    directory: str = str(tmp_path_factory.mktemp("pano"))
+    synthetic.make_pano_folder(directory, num_frames=3)
+    return [cv2.detail.computeImageFeatures2(cv2.ORB.create(), cv2.imread(p)) for p in discover_frames(directory, "vl")]
+
+
+def round_trip(cache: FeatureCache, kind: str, arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """:return: the arrays after saving them in the cache and loading them again"""
+    cache.put(kind, feature_cache.make_key(kind), arrays)
+    return cache.get(kind, feature_cache.make_key(kind))
+
+
+def assert_same_arrays(a: Dict[str, np.ndarray], b: Dict[str, np.ndarray]) -> None:
+    assert a.keys() == b.keys()
+    for name in a:
+        assert np.array_equal(a[name], b[name]), name
+
+
+def test_features_round_trip(features, tmp_path):
+    arrays: Dict[str, np.ndarray] = feature_cache.features_to_arrays(features[0])
+    loaded: cv2.detail.ImageFeatures = feature_cache.arrays_to_features(round_trip(FeatureCache(str(tmp_path)),
+                                                                                     "features", arrays))
+    assert_same_arrays(feature_cache.features_to_arrays(loaded), arrays)
+    assert len(loaded.keypoints) > 0
+
+
+def test_matches_round_trip(features, tmp_path):
+    matcher = cv2.detail.BestOf2NearestMatcher_create(False, 0.3)
+    matches_info: List[cv2.detail.MatchesInfo] = list(matcher.apply2(features))
+    arrays: Dict[str, np.ndarray] = feature_cache.matches_to_arrays(matches_info)
+    loaded: List[cv2.detail.MatchesInfo] = feature_cache.arrays_to_matches(round_trip(FeatureCache(str(tmp_path)),
+                                                                                      "matches", arrays))
+    assert_same_arrays(feature_cache.matches_to_arrays(loaded), arrays)
+    assert [(m.src_img_idx, m.dst_img_idx) for m in loaded] == [(m.src_img_idx, m.dst_img_idx) for m in matches_info]
+    assert any(len(m.matches) > 0 for m in loaded)
+
+
+def test_cameras_round_trip(tmp_path):
+    cameras: List[cv2.detail.CameraParams] = []
+    for i in range(3):
+        cam: cv2.detail.CameraParams = cv2.detail.CameraParams()
+        cam.focal, cam.aspect, cam.ppx, cam.ppy = 300.0 + i, 1.0, 160.0, 120.0
+        cam.R = cv2.Rodrigues(np.array([0, 0.2 * i, 0], np.float64))[0].astype(np.float32)
+        cam.t = np.array([[0.0], [0.0], [float(i)]])
+        cameras.append(cam)
+    arrays: Dict[str, np.ndarray] = feature_cache.cameras_to_arrays(cameras)
+    loaded: List[cv2.detail.CameraParams] = feature_cache.arrays_to_cameras(round_trip(FeatureCache(str(tmp_path)),
+                                                                                       "cameras", arrays))
+    assert_same_arrays(feature_cache.cameras_to_arrays(loaded), arrays)
+    assert loaded[2].R.dtype == np.float32
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    arrays: Dict[str, np.ndarray] = {"a": np.zeros(1000, np.uint8)}
+    cache: FeatureCache = FeatureCache(str(tmp_path))
+    for i, key in enumerate(["old", "used", "new"]):
+        cache.put("features", key, arrays)
+        os.utime(cache.path("features", key), (1000 + i, 1000 + i))
+    entry_size: int = os.path.getsize(cache.path("features", "old"))
+    assert cache.get("features", "used") is not None  # now the most recently used
+
+    cache.max_bytes = 2 * entry_size
+    cache.evict()
+    assert not os.path.exists(cache.path("features", "old"))
+    assert os.path.exists(cache.path("features", "used"))
+    assert os.path.exists(cache.path("features", "new"))
+    assert cache.size() == 2 * entry_size
+
+
+def test_files_being_written_are_left_alone(tmp_path):
+    cache: FeatureCache = FeatureCache(str(tmp_path), max_bytes=0)
+    tmp_path_of_other_process: str = "{0}.12345.tmp.npz".format(cache.path("features", "other")[:-len(".npz")])
+    np.savez(tmp_path_of_other_process, a=np.zeros(1000, np.uint8))
+    cache.put("features", "mine", {"a": np.zeros(10, np.uint8)})
+    assert os.path.exists(tmp_path_of_other_process)
+    assert not os.path.exists(cache.path("features", "mine"))
+    assert cache.size() == 0
@@ -0,0 +1,54 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+checks that a FrameSource finds the frames of a pano folder in frame number order and gives back the same frames
+whether it is indexed or looped over (with its threads reading ahead)
+"""
+
+import os
+import cv2
+import pytest
+import numpy as np
+from frames import FrameSource, discover_frames
+from typing import List
+
+
+def frame(num: int) -> np.ndarray:
+    """:return: a small image that is different for every frame number"""
+    return np.full((6, 8, 3), num, np.uint8)
+
+
+@pytest.fixture
+def pano_folder(tmp_path) -> str:
+    for num in [10, 2, 0, 1, 11]:
+        cv2.imwrite(str(tmp_path / "vl{0}.png".format(num)), frame(num))
+    for name in ["ir1.png", "vl3.jpg", "vlx.png", "myvl4.png"]:  # not vl frames
+        cv2.imwrite(str(tmp_path / name), frame(99))
+    return str(tmp_path)
+
+
+def test_frames_are_sorted_by_number(pano_folder):
+    paths: List[str] = discover_frames(pano_folder, "vl")
+    assert [os.path.basename(p) for p in paths] == ["vl0.png", "vl1.png", "vl2.png", "vl10.png", "vl11.png"]
+    assert len(FrameSource.from_directory(pano_folder, "vl", num_imgs=3)) == 3
+
+
+def test_indexing(pano_folder):
+    source: FrameSource = FrameSource.from_directory(pano_folder, "vl")
+    assert len(source) == 5
+    assert np.array_equal(source[3], frame(10))
+    assert np.array_equal(source[-1], frame(11))
+    os.remove(source.paths[0])
+    with pytest.raises(IOError):
+        source[0]
+
+
+@pytest.mark.parametrize("workers, read_ahead", [(1, 1), (2, 2), (4, 8)])
+def test_iterating_matches_indexing(pano_folder, workers: int, read_ahead: int):
+    source: FrameSource = FrameSource.from_directory(pano_folder, "vl", workers=workers, read_ahead=read_ahead)
+    for _ in range(2):  # can be looped over more than once
+        looped: List[np.ndarray] = list(source)
+        assert len(looped) == len(source)
+        assert all(np.array_equal(img, source[i]) for i, img in enumerate(looped))
+        assert [int(img[0, 0, 0]) for img in looped] == [0, 1, 2, 10, 11]
@@ -0,0 +1,140 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+checks that Image.remove_black() (find_black_border() and crop_border()) cuts off the same border as the loop it
+replaced, and that IndexedImage gives the same images as Image
+"""
+
+import pytest
+import numpy as np
+import Image
+import palette_registry
+from typing import Tuple
+
+
+def remove_black_loop(img: np.ndarray) -> Tuple[np.ndarray, Tuple[int, int, bool, bool]]:
+    """the original Image.remove_black(), a pixel with a 0 in any channel is black"""
+    BLACK: np.ndarray = np.zeros((1, 3))
+    removed_left: bool = False
+    removed_right: bool = False
+    for y in range(img.shape[0]):
+        if img[y, 0] in BLACK:
+            img = img[:, 1:]
+            removed_left = True
+            break
+    for y in range(img.shape[0] - 1, -1, -1):
+        if img[y, -1] in BLACK:
+            img = img[:, :-1]
+            removed_right = True
+            break
+
+    upper_limit: int = 0
+    for x in range(img.shape[1]):
+        for y in range(img.shape[0] // 2):
+            if img[y, x] in BLACK:
+                if y > upper_limit:
+                    upper_limit = y
+            else:
+                break
+
+    lower_limit: int = img.shape[0] - 1
+    for x in range(img.shape[1]):
+        for y in range(img.shape[0] - 1, img.shape[0] // 2, -1):
+            if img[y, x] in BLACK:
+                if y < lower_limit:
+                    lower_limit = y
+            else:
+                break
+    return img[upper_limit:lower_limit, :], (upper_limit, lower_limit, removed_left, removed_right)
+
+
+def bordered_image(height: int, width: int, seed: int) -> np.ndarray:
+    """
+    :return: bright random image with a wavy black border at the top and bottom (like a stitched panorama), sometimes
+    black at the left or right column and a few black specks inside
+    """
+    rng = np.random.default_rng(seed)
+    img: np.ndarray = rng.integers(1, 256, (height, width, 3)).astype(np.uint8)
+    top: np.ndarray = rng.integers(0, max(1, height // 3), width)
+    bottom: np.ndarray = rng.integers(0, max(1, height // 3), width)
+    for x in range(width):
+        img[:top[x], x] = 0
+        img[height - bottom[x]:, x] = 0
+    if rng.random() < 0.5:
+        img[rng.integers(0, height), 0] = 0
+    if rng.random() < 0.5:
+        img[rng.integers(0, height), -1, rng.integers(0, 3)] = 0  # one channel is enough
+    img[rng.integers(0, height, 5), rng.integers(0, width, 5), 1] = 0
+    return img
+
+
+def test_remove_black_matches_loop():
+    for seed, (height, width) in enumerate([(30, 40), (31, 17), (12, 60), (50, 5), (2, 9), (9, 2)]):
+        img: np.ndarray = bordered_image(height, width, seed)
+        expected_img, expected_limits = remove_black_loop(img.copy())
+        im: Image.Image = Image.Image(img.copy())
+        assert im.remove_black() == expected_limits, seed
+        assert np.array_equal(im.img, expected_img), seed
+
+
+def test_no_border():
+    img: np.ndarray = np.full((10, 12, 3), 7, np.uint8)
+    expected_img, expected_limits = remove_black_loop(img.copy())
+    assert Image.find_black_border((img == 0).any(axis=2)) == expected_limits
+    assert np.array_equal(Image.crop_border(img, *expected_limits), expected_img)
+
+
+def test_crop_border_matches_remove_black():
+    img: np.ndarray = bordered_image(40, 30, 7)
+    other_layer: np.ndarray = np.arange(40 * 30).reshape(40, 30)
+    im: Image.Image = Image.Image(img.copy())
+    limits = im.remove_black()
+    assert np.array_equal(Image.crop_border(img, *limits), im.img)
+    assert Image.crop_border(other_layer, *limits).shape == im.img.shape[:2]
+
+
+def test_mask_gives_the_same_border():
+    img: np.ndarray = bordered_image(25, 35, 3)
+    img[img.any(axis=2) & ~img.all(axis=2)] = 9  # only fully black pixels are outside, like a blender result
+    mask: np.ndarray = np.where(img.any(axis=2), 255, 0).astype(np.uint8)
+    assert Image.Image(img.copy()).remove_black(mask) == Image.Image(img.copy()).remove_black()
+
+
+def palette_image(name: str, height: int, width: int, seed: int) -> np.ndarray:
+    """:return: image of random colors of a palette"""
+    colors: np.ndarray = palette_registry.get_palette(name).colors
+    return colors[np.random.default_rng(seed).integers(0, len(colors), (height, width))]
+
+
+@pytest.mark.parametrize("new_palette_name, mode", [("lava.pal", "stretch"), ("rainbow.pal", "nearest"),
+                                                    ("gray.pal", "linear"), ("arctic.pal", "stretch")])
+def test_indexed_change_palette_matches_image(new_palette_name, mode):
+    img: np.ndarray = palette_image("iron.pal", 20, 30, 0)
+    indexed: Image.IndexedImage = Image.IndexedImage.from_bgr(img)
+    assert indexed.palette_name == "iron.pal" and indexed.index.dtype == np.uint8
+    assert np.array_equal(indexed.to_bgr(), img)
+
+    indexed.change_palette(new_palette_name, mode)
+    im: Image.Image = Image.Image(img.copy())
+    im.change_palette(new_palette_name, mode)
+    assert np.array_equal(indexed.to_bgr(), im.img)
+
+
+def test_indexed_snap_matches_set_colors_to_palette():
+    img: np.ndarray = palette_image("iron.pal", 20, 30, 1).astype(np.int16)
+    img = np.clip(img + np.random.default_rng(1).integers(-4, 5, img.shape), 0, 255).astype(np.uint8)
+    im: Image.Image = Image.Image(img.copy())
+    im.set_colors_to_palette(palette_registry.get_palette("iron.pal").as_list())
+    assert np.array_equal(Image.IndexedImage.snap(img, "iron.pal").to_bgr(), im.img)
+
+
+def test_indexed_remove_black_matches_image():
+    img: np.ndarray = palette_image("iron.pal", 30, 40, 2)
+    img[:4, ::3] = 0
+    img[-3:, 5:9] = 0
+    img[7, 0] = 0
+    indexed: Image.IndexedImage = Image.IndexedImage.snap(img, "iron.pal")
+    im: Image.Image = Image.Image(indexed.to_bgr())
+    assert indexed.remove_black() == im.remove_black()
+    assert np.array_equal(indexed.to_bgr(), im.img)
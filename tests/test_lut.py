@@ -0,0 +1,68 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+checks that NearestColorIndex finds the same colors as util.get_palette_color_match()
+"""
+
+import numpy as np
+import lut
+import util
+import palette_registry
+from palette_registry import pack_colors
+
+
+def random_colors(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, (n, 3)).astype(np.uint8)
+
+
+def test_snap_matches_get_palette_color_match():
+    for name in ["iron.pal", "rainbow.pal", "gray.pal"]:
+        palette = palette_registry.get_palette(name).as_list()
+        colors: np.ndarray = random_colors(500)
+        snapped: np.ndarray = lut.NearestColorIndex(palette).snap(colors)
+        expected = [util.get_palette_color_match(c.astype(int), palette) for c in colors]
+        assert [tuple(c) for c in snapped.tolist()] == expected
+
+
+def test_ties_go_to_the_first_color():
+    palette = [(10, 10, 10), (20, 20, 20), (10, 10, 10)]
+    colors: np.ndarray = np.array([[15, 15, 15], [10, 10, 10], [30, 30, 30]], np.uint8)
+    assert lut.NearestColorIndex(palette).query(colors).tolist() == [0, 0, 1]
+
+
+def test_table_gives_the_same_answers_again():
+    palette = palette_registry.get_palette("iron.pal").as_list()
+    nearest: lut.NearestColorIndex = lut.NearestColorIndex(palette)
+    img: np.ndarray = random_colors(400).reshape(20, 20, 3)
+    first: np.ndarray = nearest.query(img)
+    assert nearest.changed
+    assert np.array_equal(nearest.query(img), first)
+    assert first.shape == (20, 20)
+
+
+def test_missing_and_add_fill_in_the_same_table():
+    palette = palette_registry.get_palette("lava.pal").as_list()
+    colors: np.ndarray = random_colors(300, seed=1)
+    other: lut.NearestColorIndex = lut.NearestColorIndex(palette)
+    keys, nearest = other.missing(pack_colors(colors))
+    assert len(keys) == len(np.unique(pack_colors(colors)))
+
+    shared: lut.NearestColorIndex = lut.NearestColorIndex(palette)
+    shared.add(keys, nearest)
+    assert len(shared.missing(pack_colors(colors))[0]) == 0
+    assert np.array_equal(shared.query(colors), lut.NearestColorIndex(palette).query(colors))
+
+
+def test_save_and_load(tmp_path):
+    palette = palette_registry.get_palette("iron.pal").as_list()
+    path: str = str(tmp_path / "nearest.npz")
+    colors: np.ndarray = random_colors(200, seed=2)
+    saved: lut.NearestColorIndex = lut.NearestColorIndex(palette, path)
+    expected: np.ndarray = saved.query(colors)
+    saved.save()
+
+    loaded: lut.NearestColorIndex = lut.NearestColorIndex(palette, path)
+    assert len(loaded.missing(pack_colors(colors))[0]) == 0
+    assert np.array_equal(loaded.query(colors), expected)
+    assert len(lut.NearestColorIndex(palette[::-1], path).missing(pack_colors(colors))[0]) > 0  # other palette
@@ -0,0 +1,72 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+checks that a Manifest reuses what a stage made when its inputs and settings are the same, and runs it again when one of
+them changes
+"""
+
+import os
+import numpy as np
+from manifest import Manifest
+from typing import Any, Dict, List
+
+
+class Stage:
+    """a stage that counts how many times it actually ran"""
+    def __init__(self, value: int):
+        self.value: int = value
+        self.runs: int = 0
+
+    def __call__(self) -> Dict[str, np.ndarray]:
+        self.runs += 1
+        return {"frame0": np.full((40, 50, 3), self.value, np.uint8), "frame1": np.arange(12.0)}
+
+
+def run(directory: str, stage: Stage, inputs: List[str], settings: Dict[str, Any]):
+    """runs the stage with a fresh Manifest, like a rerun of runner.process_pano() would"""
+    return Manifest(directory).run("rescale", inputs, settings, stage)
+
+
+def test_same_inputs_and_settings_are_reused(tmp_path):
+    directory: str = str(tmp_path / ".stages")
+    stage: Stage = Stage(7)
+    made, made_hash = run(directory, stage, ["a", "b"], {"palette": "iron.pal"})
+    reused, reused_hash = run(directory, stage, ["a", "b"], {"palette": "iron.pal"})
+    assert stage.runs == 1
+    assert reused_hash == made_hash
+    assert reused.keys() == made.keys()
+    assert all(np.array_equal(reused[name], made[name]) and reused[name].dtype == made[name].dtype for name in made)
+
+
+def test_changed_setting_runs_again(tmp_path):
+    directory: str = str(tmp_path / ".stages")
+    run(directory, Stage(7), ["a", "b"], {"palette": "iron.pal"})
+    stage: Stage = Stage(8)
+    made, made_hash = run(directory, stage, ["a", "b"], {"palette": "rainbow.pal"})
+    assert stage.runs == 1
+    assert int(made["frame0"][0, 0, 0]) == 8
+    # only the latest output is kept
+    assert sorted(os.listdir(directory)) == sorted(["manifest.json", made_hash + ".npz"])
+
+
+def test_changed_input_runs_again(tmp_path):
+    directory: str = str(tmp_path / ".stages")
+    frame_path: str = str(tmp_path / "ir0.png")
+    with open(frame_path, "wb") as f:
+        f.write(b"first")
+    stage: Stage = Stage(7)
+    run(directory, stage, Manifest(directory).input_hashes([frame_path]), {})
+    run(directory, stage, Manifest(directory).input_hashes([frame_path]), {})
+    assert stage.runs == 1
+    with open(frame_path, "wb") as f:
+        f.write(b"second one")
+    run(directory, stage, Manifest(directory).input_hashes([frame_path]), {})
+    assert stage.runs == 2
+
+
+def test_outputs_are_compressed(tmp_path):
+    directory: str = str(tmp_path / ".stages")
+    made, made_hash = run(directory, Stage(7), [], {})
+    raw_bytes: int = sum(arr.nbytes for arr in made.values())
+    assert os.path.getsize(os.path.join(directory, made_hash + ".npz")) < raw_bytes / 4
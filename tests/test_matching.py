@@ -0,0 +1,101 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+checks which pairs of frames a MatchPlanner matches: the band of neighbours, the pair that wraps around the end of a 360
+degree sweep, and the wider pairs it falls back to when neighbours don't match well
+"""
+
+import cv2
+import pytest
+import numpy as np
+from matching import MatchPlanner, band_pairs, pairs_to_mask
+from typing import Dict, List, Set, Tuple
+
+
+class FakeMatcher:
+    """
+    stands in for cv2.detail.BestOf2NearestMatcher: each pair gets the confidence it is given (1.5 if it isn't given
+    one) and every set of pairs it is asked to match is remembered
+    """
+    def __init__(self, confidences: Dict[Tuple[int, int], float]):
+        self.confidences: Dict[Tuple[int, int], float] = confidences
+        self.calls: List[Set[Tuple[int, int]]] = []
+
+    def apply2(self, features: List, mask: np.ndarray) -> List[cv2.detail.MatchesInfo]:
+        n: int = len(features)
+        pairs: Set[Tuple[int, int]] = {(int(i), int(j)) for i, j in zip(*np.nonzero(mask))}
+        self.calls.append(pairs)
+        matches_info: List[cv2.detail.MatchesInfo] = []
+        for i in range(n):
+            for j in range(n):
+                m: cv2.detail.MatchesInfo = cv2.detail.MatchesInfo()
+                if (min(i, j), max(i, j)) in pairs:
+                    m.src_img_idx, m.dst_img_idx = i, j
+                    m.confidence = self.confidences.get((min(i, j), max(i, j)), 1.5)
+                matches_info.append(m)
+        return matches_info
+
+    def collectGarbage(self) -> None:
+        pass
+
+
+@pytest.mark.parametrize("n, band, wrap, expected", [
+    (5, 1, False, {(0, 1), (1, 2), (2, 3), (3, 4)}),
+    (5, 2, False, {(0, 1), (1, 2), (2, 3), (3, 4), (0, 2), (1, 3), (2, 4)}),
+    (5, 1, True, {(0, 1), (1, 2), (2, 3), (3, 4), (0, 4)}),
+    (5, 2, True, {(0, 1), (1, 2), (2, 3), (3, 4), (0, 2), (1, 3), (2, 4), (0, 4), (0, 3), (1, 4)}),
+])
+def test_band_pairs(n: int, band: int, wrap: bool, expected: Set[Tuple[int, int]]):
+    pairs: Set[Tuple[int, int]] = band_pairs(n, band, wrap)
+    assert pairs == expected
+    mask: np.ndarray = pairs_to_mask(n, pairs)
+    assert np.array_equal(np.triu(mask, 1), mask)  # the matcher only looks at the upper triangle
+    assert int(mask.sum()) == len(expected)
+
+
+def test_confident_band_is_not_widened():
+    matcher: FakeMatcher = FakeMatcher({})
+    planner: MatchPlanner = MatchPlanner()
+    planner.match(matcher, [None] * 6)
+    assert matcher.calls == [band_pairs(6)]
+    assert planner.weak == set()
+    assert all(r["band"] == 1 for r in planner.report)
+
+
+def test_wrap_around_pair_is_matched():
+    matcher: FakeMatcher = FakeMatcher({})
+    planner: MatchPlanner = MatchPlanner(wrap=True)
+    matches_info: List[cv2.detail.MatchesInfo] = planner.match(matcher, [None] * 6)
+    assert (0, 5) in matcher.calls[0]
+    assert matches_info[0 * 6 + 5].confidence == 1.5
+    assert (0, 5) in [r["pair"] for r in planner.report]
+
+
+def test_weak_link_is_bridged_by_wider_pairs():
+    matcher: FakeMatcher = FakeMatcher({(2, 3): 0.4})
+    planner: MatchPlanner = MatchPlanner()
+    matches_info: List[cv2.detail.MatchesInfo] = planner.match(matcher, [None] * 6)
+    assert matcher.calls[1] == {(1, 3), (2, 4)}  # the pairs two apart that skip over 2-3
+    assert len(matcher.calls) == 2  # bridged, so no need to go three apart
+    assert matches_info[1 * 6 + 3].confidence == 1.5 and matches_info[3 * 6 + 1].confidence == 1.5
+    assert planner.weak == set()
+    assert {r["pair"]: r["band"] for r in planner.report}[(1, 3)] == 2
+
+
+def test_weak_link_widens_up_to_max_band():
+    confidences: Dict[Tuple[int, int], float] = {(i, j): 0.2 for i in range(6) for j in range(i + 1, 6)
+                                                 if i <= 2 < j}  # nothing that spans 2-3 matches
+    matcher: FakeMatcher = FakeMatcher(confidences)
+    planner: MatchPlanner = MatchPlanner(max_band=3)
+    planner.match(matcher, [None] * 6)
+    assert matcher.calls[1:] == [{(1, 3), (2, 4)}, {(0, 3), (1, 4), (2, 5)}]
+    assert planner.weak == {2}
+
+
+def test_weak_wrap_around_link_is_bridged():
+    matcher: FakeMatcher = FakeMatcher({(0, 4): 0.4})
+    planner: MatchPlanner = MatchPlanner(wrap=True)
+    planner.match(matcher, [None] * 5)
+    assert matcher.calls[1] == {(0, 3), (1, 4)}  # the wrapping pairs two apart that skip over 4-0
+    assert planner.weak == set()
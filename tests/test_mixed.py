@@ -0,0 +1,63 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+checks that the tiled filters of mixed.py give the same images as filtering the whole image at once, and that
+MixedImages makes the same mixed images as the original Image.create_mx(), create_mx2() and create_mx3()
+"""
+
+import cv2
+import pytest
+import numpy as np
+import mixed
+import synthetic
+import Image
+
+
+def create_mx_original(vl: np.ndarray, ir: np.ndarray) -> np.ndarray:
+    mask = cv2.adaptiveThreshold(cv2.cvtColor(Image.Image(vl).get_blurred(), cv2.COLOR_BGR2GRAY), 255,
+                                 cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 3, 1)
+    with_black = cv2.bitwise_and(ir, ir, mask=mask)
+    return cv2.addWeighted(with_black, .4, ir, .6, 0)
+
+
+def create_mx3_original(vl: np.ndarray, ir: np.ndarray) -> np.ndarray:
+    vis = Image.Image(vl)
+    vis.find_contours()
+    return create_mx_original(vis.img, Image.draw_contours(ir, vis.contours, (255, 255, 255)))
+
+
+@pytest.fixture(scope="module")
+def scene() -> np.ndarray:
+    return synthetic.make_scene(700, 120, seed=3)
+
+
+@pytest.mark.parametrize("tile_width", [1, 5, 64, 333, 700, 5000])
+def test_tiled_filters_match_whole_image(scene, tile_width):
+    whole = {"bilateral": cv2.bilateralFilter(scene, mixed.DIAMETER, mixed.SIGMA, mixed.SIGMA),
+             "guided": mixed.guided_filter(scene),
+             "box": cv2.blur(scene, (mixed.DIAMETER, mixed.DIAMETER))}
+    for name in mixed.FILTERS:
+        tiled: np.ndarray = mixed.filter_tiled(scene, mixed.filter_function(name), mixed.filter_margin(name),
+                                               tile_width, workers=4)
+        assert np.array_equal(tiled, whole[name]), name
+
+
+def test_bilateral_matches_get_blurred(scene):
+    assert np.array_equal(mixed.filter_function("bilateral")(scene), Image.Image(scene).get_blurred())
+
+
+def test_unknown_filter():
+    with pytest.raises(ValueError):
+        mixed.filter_function("median")
+
+
+def test_mixed_images_match_originals(scene):
+    ir: np.ndarray = cv2.applyColorMap(cv2.cvtColor(synthetic.make_scene(700, 120, seed=4), cv2.COLOR_BGR2GRAY),
+                                       cv2.COLORMAP_INFERNO)
+    made = mixed.MixedImages(scene, tile_width=100, workers=3).make(ir)
+    assert np.array_equal(made["mx"], create_mx_original(scene, ir))
+    assert np.array_equal(made["mx2"], cv2.addWeighted(scene, .2, ir, .8, 0))
+    assert np.array_equal(made["mx3"], create_mx3_original(scene, ir))
+    with pytest.raises(ValueError):
+        mixed.MixedImages(scene).make(ir, ["mx4"])
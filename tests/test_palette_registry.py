@@ -0,0 +1,59 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+checks that the palettes read by palette_registry have the same colors the old util.palette_to_bgr() gave
+"""
+
+import os
+import pytest
+import numpy as np
+import util
+import palette_registry
+from util import Color
+from typing import Dict, List
+
+
+def palette_to_bgr_loop(filename: str) -> List[Color]:
+    """the original util.palette_to_bgr()"""
+    with open(filename) as f:
+        palette: List[Color] = [tuple([int(y) for y in x.split(",")]) for x in f.read().split("\n")]
+        for i in range(len(palette)):
+            palette[i] = util.ycbcr_to_bgr(palette[i])
+    return palette
+
+
+def test_ycbcr_to_bgr_matches_util():
+    values: np.ndarray = np.arange(0, 256, 15)
+    ycbcr: np.ndarray = np.stack(np.meshgrid(values, values, values), axis=-1).reshape(-1, 3)
+    expected: List[Color] = [util.ycbcr_to_bgr(tuple(c)) for c in ycbcr.tolist()]
+    assert [tuple(c) for c in palette_registry.ycbcr_to_bgr(ycbcr).tolist()] == expected
+
+
+@pytest.mark.parametrize("name", util.PALETTES)
+def test_palette_colors_match_the_file(name):
+    path: str = os.path.join(palette_registry.PALETTE_DIRECTORY, name)
+    assert palette_registry.get_palette(name).as_list() == palette_to_bgr_loop(path)
+    assert palette_registry.get_palette(name).as_list() == palette_registry.load_directory(cache_path=None)[name].as_list()
+
+
+@pytest.mark.parametrize("name", util.PALETTES)
+def test_index_of_gives_the_last_index_like_a_dictionary(name):
+    palette: palette_registry.Palette = palette_registry.get_palette(name)
+    last: Dict[Color, int] = {color: i for i, color in enumerate(palette.as_list())}
+    colors: np.ndarray = palette.colors[::-1].reshape(-1, 1, 3)
+    expected: List[int] = [last[tuple(c)] for c in palette.colors[::-1].tolist()]
+    assert palette.index_of(colors).reshape(-1).tolist() == expected
+
+
+def test_index_of_color_not_in_palette():
+    palette: palette_registry.Palette = palette_registry.get_palette("gray.pal")
+    with pytest.raises(KeyError):
+        palette.index_of(np.array([[1, 2, 250]], np.uint8))
+
+
+def test_pack_and_unpack():
+    colors: np.ndarray = np.random.default_rng(0).integers(0, 256, (100, 3)).astype(np.uint8)
+    keys: np.ndarray = palette_registry.pack_colors(colors)
+    assert keys.tolist() == [(int(b) << 16) | (int(g) << 8) | int(r) for b, g, r in colors]
+    assert np.array_equal(palette_registry.unpack_colors(keys), colors)
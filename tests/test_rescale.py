@@ -0,0 +1,52 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+checks that rescaling frames in a pool of processes gives the same frames as rescaling them one at a time
+"""
+
+import os
+import cv2
+import pytest
+import numpy as np
+import lut
+import synthetic
+from rescale import Rescaler
+from frames import discover_frames
+from typing import List
+
+
+@pytest.fixture
+def pano_folder(tmp_path, monkeypatch):
+    """fake pano folder whose ir frames are a bit off from the palette colors, with its own nearest color cache"""
+    monkeypatch.setattr(lut, "CACHE_DIRECTORY", str(tmp_path / "cache"))
+    monkeypatch.setattr(lut, "_nearest_indexes", {})
+    directory: str = str(tmp_path / "pano")
+    synthetic.make_pano_folder(directory, num_frames=5, width=160, height=120)
+    rng = np.random.default_rng(0)
+    for path in discover_frames(directory, "ir"):
+        img: np.ndarray = cv2.imread(path).astype(np.int16)
+        cv2.imwrite(path, np.clip(img + rng.integers(-2, 3, img.shape), 0, 255).astype(np.uint8))
+    return directory
+
+
+def test_pool_matches_one_at_a_time(pano_folder):
+    one_at_a_time: List[np.ndarray] = [Rescaler(pano_folder).rescale_image(i) for i in range(5)]
+    lut._nearest_indexes.clear()
+    pooled: List[np.ndarray] = list(Rescaler(pano_folder).rescale_all(workers=2))
+    assert all(np.array_equal(a, b) for a, b in zip(one_at_a_time, pooled))
+    indexed = list(Rescaler(pano_folder).rescale_all(workers=2, indexed=True))
+    assert all(np.array_equal(a, b.to_bgr()) for a, b in zip(one_at_a_time, indexed))
+    assert indexed[0].index.dtype == np.uint8
+
+
+def test_pool_colors_are_saved_by_the_parent(pano_folder):
+    list(Rescaler(pano_folder).rescale_all(workers=2))
+    nearest: lut.NearestColorIndex = lut.nearest_color_index(Rescaler(pano_folder).palette)
+    assert not nearest.changed  # everything the workers found was added and saved
+    assert os.listdir(lut.CACHE_DIRECTORY) == [os.path.basename(nearest.cache_path)]
+
+    lut._nearest_indexes.clear()  # a new run only loads the saved table
+    loaded: lut.NearestColorIndex = lut.nearest_color_index(Rescaler(pano_folder).palette)
+    for path in discover_frames(pano_folder, "ir"):
+        assert len(loaded.missing(lut.pack_colors(cv2.imread(path)))[0]) == 0
@@ -0,0 +1,61 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+checks that process_pano() stitches the ir pano the way the stitcher always has: the rescaled frames are warped as
+float64 and cut down to int16 before blending, not warped as uint8 (which rounds instead of cutting off)
+"""
+
+import cv2
+import pytest
+import numpy as np
+import lut
+import runner
+import synthetic
+import Image
+import StitcherEasy
+import palette_registry
+from rescale import Rescaler
+from typing import Dict, List, Optional
+
+
+@pytest.fixture(scope="module")
+def pano_folder(tmp_path_factory) -> str:
+    directory: str = str(tmp_path_factory.mktemp("pano"))
+    synthetic.make_pano_folder(directory, num_frames=5)
+    return directory
+
+
+def baseline_ir_pano(directory: str, model: StitcherEasy.PanoramaModel) -> np.ndarray:
+    """
+    :param directory: path to pano folder
+    :param model: the registration process_pano() used
+    :return: the ir pano made the old way, one float64 rescaled frame at a time, cut down to int16 right before blending
+    """
+    r: Rescaler = Rescaler(directory)
+    frames: List[np.ndarray] = [r.rescale_image(i).astype(np.float64) for i in range(len(model.cameras))]
+    blender = model.make_blender()
+    for i, img in enumerate(frames):
+        mask_warped: np.ndarray = model.warp_mask(i)
+        image_warped: np.ndarray = model.warp_image(i, img)
+        assert image_warped.dtype == np.float64
+        model.compensator.apply(i, model.corners[i], image_warped, mask_warped)
+        blender.feed(image_warped.astype(np.int16), mask_warped, model.corners[i])
+    pano, mask = blender.blend(None, None)
+
+    im: Image.Image = Image.Image(pano.astype(np.uint8))
+    im.remove_black(mask)
+    im.set_colors_to_palette(palette_registry.get_palette(runner.Settings.INIT_PALETTE).as_list())
+    return im.img
+
+
+@pytest.mark.parametrize("tile_width", [None, 200])
+def test_ir_pano_matches_baseline(pano_folder, tmp_path, monkeypatch, tile_width: Optional[int]):
+    monkeypatch.setattr(lut, "CACHE_DIRECTORY", str(tmp_path / "cache"))
+    monkeypatch.setattr(lut, "_nearest_indexes", {})
+    settings: runner.Settings = runner.Settings(CACHE_DIRECTORY=None, STAGE_CACHE=None, OVERWRITE_FILE=False,
+                                                TILE_WIDTH=tile_width)
+    cv2.setRNGSeed(1)
+    saved: Dict[str, str] = runner.process_pano(pano_folder, str(tmp_path), settings)
+    model: StitcherEasy.PanoramaModel = StitcherEasy.PanoramaModel.load(saved["model"])
+    assert np.array_equal(cv2.imread(saved["ir"]), baseline_ir_pano(pano_folder, model))
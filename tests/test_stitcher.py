@@ -0,0 +1,48 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+checks that PanoramaModel.compose_tiled() makes the same panoramas as compose() on a fake pano folder
+"""
+
+import os
+import cv2
+import pytest
+import numpy as np
+import StitcherEasy
+import synthetic
+from frames import discover_frames
+from typing import List
+
+
+@pytest.fixture(scope="module")
+def model_and_layers(tmp_path_factory):
+    directory: str = str(tmp_path_factory.mktemp("pano"))
+    synthetic.make_pano_folder(directory, num_frames=6)
+    layers: List[List[np.ndarray]] = [[cv2.imread(p) for p in discover_frames(directory, t)] for t in ["vl", "ir"]]
+    cv2.setRNGSeed(1)
+    model: StitcherEasy.PanoramaModel = StitcherEasy.register(layers[0], use_kaze=True)
+    return model, layers
+
+
+@pytest.mark.parametrize("tile_width, tile_height", [(64, None), (200, None), (96, 100)])
+def test_compose_tiled_matches_compose(model_and_layers, tmp_path, tile_width, tile_height):
+    model, layers = model_and_layers
+    panos, masks = model.compose(layers, return_masks=True)
+    out_paths: List[str] = [str(tmp_path / "layer{0}.npy".format(i)) for i in range(len(layers))]
+    tiled, mask = model.compose_tiled(layers, out_paths, tile_width=tile_width, tile_height=tile_height)
+    for pano, tiled_pano in zip(panos, tiled):
+        assert pano.shape == tiled_pano.shape
+        assert np.array_equal(pano, tiled_pano)
+    assert np.array_equal(np.asarray(masks[-1]).reshape(mask.shape), mask)
+
+
+def test_compose_tiled_leaves_the_scratch_folder(model_and_layers, tmp_path):
+    model, layers = model_and_layers
+    scratch: str = str(tmp_path / "scratch")
+    os.makedirs(scratch)
+    with open(os.path.join(scratch, "keep.txt"), "w") as f:
+        f.write("not made by the scratch store")
+    out_paths: List[str] = [str(tmp_path / "layer{0}.npy".format(i)) for i in range(len(layers))]
+    model.compose_tiled(layers, out_paths, tile_width=128, scratch_directory=scratch)
+    assert os.listdir(scratch) == ["keep.txt"]
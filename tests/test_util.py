@@ -0,0 +1,44 @@
+__author__ = "Amos Decker"
+__date__ = "January 2020"
+
+"""
+checks that util.stretch_indexes() gives the same lists as the old util.stretch_list()
+"""
+
+import util
+from typing import List
+
+
+def stretch_list_loop(orig: List, new_length: int) -> List:
+    """the original util.stretch_list()"""
+    new: List = [None] * new_length
+    num_each: int = round(len(new) / len(orig))
+
+    prev: int = 0
+    i: int = 0
+    while num_each * (i + 1) <= new_length and i < len(orig):
+        new[prev:num_each * (i + 1)] = [orig[i]] * num_each
+        prev = num_each * (i + 1)
+        i += 1
+
+    numNone: int = new.count(None)
+    if numNone > 0:
+        if i >= len(orig):
+            i = len(orig) - 1
+        new[-numNone:] = stretch_list_loop([orig[i]], numNone)
+    return new
+
+
+def test_stretch_indexes_matches_stretch_list():
+    for length in range(1, 60):
+        orig: List[int] = list(range(length))
+        for new_length in list(range(0, 130)) + [224, 255, 256, 448, 1000]:
+            expected: List[int] = stretch_list_loop(orig, new_length)
+            assert util.stretch_indexes(length, new_length).tolist() == expected, (length, new_length)
+            assert util.stretch_list(orig, new_length) == expected, (length, new_length)
+
+
+def test_palette_lengths():
+    for length in [112, 128, 224, 256]:
+        for new_length in [112, 128, 224, 256]:
+            assert util.stretch_indexes(length, new_length).tolist() == stretch_list_loop(list(range(length)), new_length)
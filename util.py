@@ -8,10 +8,10 @@ various helpful tools used in StitcherEasy and rescale
 - & others
 """
 
-from tkinter import Tk
-from tkinter.filedialog import askdirectory
 import numpy as np
-from typing import List, Dict, Any, Tuple, TextIO
+from collections import deque
+from concurrent.futures import Executor, Future
+from typing import List, Dict, Any, Tuple, Callable, Iterable, Iterator, Deque
 
 PALETTES: List[str] = ["arctic.pal", "coldest.pal", "contrast.pal", "gray.pal", "hottest.pal", "iron.pal", "lava.pal", "rainbow.pal", "wheel.pal"]
 Color = Tuple[int, int, int]
@@ -19,6 +19,9 @@ Color = Tuple[int, int, int]
 
 def open_directory_chooser() -> str:
     """opens system file chooser and returns path to directory the user selects"""
+    # imported here so that everything else works on computers without a display (or without tkinter)
+    from tkinter import Tk
+    from tkinter.filedialog import askdirectory
     root: Tk = Tk()
     root.withdraw()
     root.update()
@@ -63,12 +66,8 @@ def palette_to_bgr(filename: str) -> List[Color]:
     :param filename: path to .pal palette file
     :return: list of tuple of (b, g, r)
     """
-    f: TextIO
-    with open(filename) as f:
-        palette: List[Color] = [tuple([int(y) for y in x.split(",")]) for x in f.read().split("\n")]
-        for i in range(len(palette)):
-            palette[i] = ycbcr_to_bgr(palette[i])
-    return palette
+    import palette_registry  # palette_registry uses util, so import it here to avoid a circular import
+    return palette_registry.get_palette(filename).as_list()
 
 
 def get_palette_color_match(pxl: np.ndarray, palette: List[Color]) -> Color:
@@ -84,6 +83,23 @@ def get_palette_color_match(pxl: np.ndarray, palette: List[Color]) -> Color:
     return palette[idx]
 
 
+def stretch_indexes(length: int, new_length: int) -> np.ndarray:
+    """
+    the positions stretch_list() takes its values from, made without building any lists
+
+    every position is repeated round(new_length / length) times and whatever is left over at the end (if it doesn't
+    divide evenly) is filled with the next position, or the last one if all of them have been used
+    :param length: length of the list to be stretched
+    :param new_length: length of final stretched list
+    :return: int array with new_length positions in the original list
+    """
+    num_each: int = round(new_length / length)
+    num_blocks: int = min(length, new_length // num_each) if num_each > 0 else length
+    filled: np.ndarray = np.repeat(np.arange(num_blocks), num_each)
+    rest: np.ndarray = np.full(new_length - len(filled), min(num_blocks, length - 1))
+    return np.concatenate([filled, rest]).astype(np.intp)
+
+
 def stretch_list(orig: List, new_length: int) -> List:
     """
     stretches a list to be a certain length and tries to fill it in as evenly as possible
@@ -93,22 +109,7 @@ def stretch_list(orig: List, new_length: int) -> List:
     :param new_length: length of final stretched list
     :return: list with length leng filled evenly with values from orig
     """
-    new: List = [None] * new_length
-    num_each: int = round(len(new) / len(orig))
-
-    prev: int = 0
-    i: int = 0
-    while num_each * (i + 1) <= new_length and i < len(orig):
-        new[prev:num_each * (i + 1)] = [orig[i]] * num_each
-        prev = num_each * (i + 1)
-        i += 1
-
-    numNone:int = new.count(None)
-    if numNone > 0:
-        if i >= len(orig):
-            i = len(orig) - 1
-        new[-numNone:] = stretch_list([orig[i]], numNone)
-    return new
+    return [orig[i] for i in stretch_indexes(len(orig), new_length)]
 
 
 def replace(arr: np.ndarray, d: Dict) -> np.ndarray:
@@ -118,15 +119,20 @@ def replace(arr: np.ndarray, d: Dict) -> np.ndarray:
     example: arr = [[1, 2, 3], [1, 2, 3], [4, 5, 6]] and dict = {(1, 2, 3): (0, 0, 0), (4, 5, 6):(1, 1, 1)}
             gives [[0, 0, 0], [0, 0, 0], [1, 1, 1]]
 
-    thanks to https://stackoverflow.com/a/16992881 for this solution
+    thanks to https://stackoverflow.com/a/16992881 for this solution (used when the keys are not (b, g, r) colors)
     :param arr: a 2-D array
     :param d: keys must contain all values in arr
     :return: new np array with same shape as arr
     """
-    u, inv = np.unique(arr, return_inverse=True,
-                       axis=0)  # inv gives back indices allowing reconstruction of original array from unique elements
-
-    new_arr = np.array([d[tuple(x)] for x in u])[inv]
+    keys: List = list(d.keys())
+    if arr.shape[-1] == 3 and len(keys) > 0 and len(keys[0]) == 3:
+        # colors get packed into integer keys and the whole array is replaced in one go
+        import lut  # lut uses util, so import it here to avoid a circular import
+        new_arr = lut.ColorLUT.from_dict(d).apply(arr)
+    else:
+        u, inv = np.unique(arr, return_inverse=True,
+                           axis=0)  # inv gives back indices allowing reconstruction of original array from unique elements
+        new_arr = np.array([d[tuple(x)] for x in u])[inv.reshape(-1)]
 
     if new_arr.shape[-1] == arr.shape[-1]:
         return new_arr.reshape(arr.shape)
@@ -137,3 +143,20 @@ def replace(arr: np.ndarray, d: Dict) -> np.ndarray:
             return new_arr
 
 
+def imap_ordered(executor: Executor, fn: Callable, items: Iterable, window: int) -> Iterator:
+    """
+    like executor.map() but only keeps window items in progress at a time, so results that have not been used yet
+    don't pile up in memory
+    :param executor: thread or process pool
+    :param fn: function to run on each item
+    :param items: inputs to fn
+    :param window: how many items can be submitted ahead of the one being waited on
+    :return: iterator of the results of fn in the same order as items
+    """
+    pending: Deque[Future] = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()